@@ -9,7 +9,8 @@ cv2.setNumThreads(4)
 from pathlib import Path
 import time
 import os
-from utils.model_detector import ModelDetector
+import uuid
+from utils.inference_executor import get_executor, PRIORITY_INTERACTIVE, QueueFullError
 from utils.db_manager import DBManager
 
 # 设置页面配置
@@ -255,17 +256,25 @@ if uploaded_file is not None:
         
     if start_dect:
         with st.spinner('正在进行建筑物检测分析...'):
-            # 初始化YOLO检测器
-            detector = ModelDetector(model_name=model_name)
-            
             # 加载并处理图像
             image = Image.open(uploaded_file)
             if not isinstance(image, Image.Image):
                 st.error("无法加载图像文件，请确保上传的是有效的图像文件")
                 st.stop()
             
-            # 执行检测
-            detections, viz_img = detector.detect(image, conf_thres=confidence_threshold,iou_thres = iou_threshold)
+            # 执行检测：单图请求以交互优先级提交到进程级推理执行器
+            session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+            try:
+                ticket = get_executor().submit(session_id, model_name, image, conf_thres=confidence_threshold,
+                                               iou_thres=iou_threshold, priority=PRIORITY_INTERACTIVE)
+            except QueueFullError:
+                st.warning("⚠️ 系统繁忙，推理队列已满，请稍后重试")
+                st.stop()
+            queue_status = st.empty()
+            detections, viz_img = ticket.result(
+                on_wait=lambda position: queue_status.text(f"排队中，第 {position} 位" if position > 0 else "正在检测...")
+            )
+            queue_status.empty()
             
             # 确保viz_img是RGB格式的numpy数组
             if isinstance(viz_img, Image.Image):
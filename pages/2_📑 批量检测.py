@@ -2,9 +2,19 @@ import streamlit as st
 import pandas as pd
 import time
 import os
+import uuid
 from pathlib import Path
-from utils.model_detector import ModelDetector
-from utils.db_manager import DBManager
+import hashlib
+import shutil
+import zipfile
+from utils.job_manager import JobManager, JOB_PENDING, JOB_RUNNING, JOB_COMPLETED, JOB_CANCELLED
+from utils.job_runner import (start_job, cancel_job, is_job_running, get_job_dir, get_result_thumbnail_path,
+                              results_to_table, get_job_progress)
+from utils.job_worker import format_duration
+from utils.thumbnails import ThumbnailCache, content_key, paginate
+from utils.prefilter import SKIP_BLANK, SKIP_DUPLICATE
+from utils.batch_io import (iter_image_paths, iter_zip_members, is_zip_source, parse_zip_source, absolute_source,
+                            source_fingerprint)
 
 # 设置页面配置
 st.set_page_config(
@@ -200,116 +210,272 @@ with st.sidebar:
         on_change=lambda: setattr(st.session_state, 'iou_threshold', iou_threshold)
     )
 
+    use_prefilter = st.checkbox(
+        "跳过空白和重复图片",
+        value=True,
+        help="空白/nodata图片直接判定为未检测到建筑物，与已检测图片近似重复的图片复用已有结果，均不执行模型推理"
+    )
+    dedup_distance = st.slider(
+        "重复判定阈值",
+        min_value=0,
+        max_value=12,
+        value=4,
+        disabled=not use_prefilter,
+        help="感知哈希的汉明距离不超过该值时视为重复图片，0表示只跳过几乎完全相同的图片"
+    )
+
+    st.markdown("### 作业恢复")
+    resume_job_id = st.text_input(
+        "作业ID",
+        value=st.session_state.get('batch_job_id', ''),
+        help="输入中断的作业ID继续检测；重新上传相同的图片或压缩包时，已完成的图片按内容跳过；"
+             "服务器路径下的图片按路径、大小和修改时间判断是否已完成"
+    )
+    resume_clicked = st.button("🔄 恢复作业")
+
 # 文件上传区域
 st.markdown("### 📤 上传图片")
 
-uploaded_files = st.file_uploader(
-    "拖拽或选择多张建筑物图片，支持 .jpg、.jpeg、.png 格式",
-    type=['jpg', 'jpeg', 'png'],
-    accept_multiple_files=True
+input_mode = st.radio(
+    "图片来源",
+    options=["上传图片", "上传ZIP压缩包", "服务器目录"],
+    horizontal=True,
+    help="图片较多时建议上传ZIP压缩包或直接读取服务器上的目录，检测时逐张读取，不会一次性载入内存"
 )
+uploaded_files, uploaded_zip, server_path = [], None, ''
+
+if input_mode == "上传图片":
+    uploaded_files = st.file_uploader(
+        "拖拽或选择多张建筑物图片，支持 .jpg、.jpeg、.png 格式",
+        type=['jpg', 'jpeg', 'png'],
+        accept_multiple_files=True
+    )
+elif input_mode == "上传ZIP压缩包":
+    uploaded_zip = st.file_uploader("选择包含建筑物图片的ZIP压缩包，其中的非图片文件会被跳过", type=['zip'])
+    if uploaded_zip is not None:
+        try:
+            # 只读取中央目录统计图片数量，不解压条目
+            entry_count = sum(1 for _ in iter_zip_members(uploaded_zip))
+            st.caption(f"压缩包中共有 {entry_count} 张图片")
+        except zipfile.BadZipFile:
+            st.error("无法读取ZIP压缩包，请检查文件是否完整")
+            uploaded_zip = None
+else:
+    server_path = st.text_input(
+        "服务器上的图片目录或ZIP压缩包路径",
+        help="直接读取运行本系统的服务器上的文件，目录会递归查找 .jpg、.jpeg、.png 图片"
+    ).strip()
+    if server_path and not os.path.exists(server_path):
+        st.error(f"路径不存在: {server_path}")
+        server_path = ''
 
-# 显示上传的图片预览
+has_input = bool(uploaded_files or uploaded_zip is not None or server_path)
+
+thumbnails = ThumbnailCache()
+
+def render_gallery(items, key, page_size=20, num_cols=5):
+    """分页显示缩略图，只为当前页生成和渲染图片；items 为 (标题, 返回缩略图路径的函数) 列表"""
+    pages = paginate(len(items), 1, page_size)[2]
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"页码（共 {pages} 页，{len(items)} 张）", min_value=1, max_value=pages,
+                               value=1, step=1, key=f"{key}_page")
+    start, end, _ = paginate(len(items), page, page_size)
+    for row_start in range(start, end, num_cols):
+        cols = st.columns(num_cols)
+        for col, (caption, load_thumbnail) in zip(cols, items[row_start:min(row_start + num_cols, end)]):
+            with col:
+                try:
+                    st.image(str(load_thumbnail()), caption=caption, use_container_width=True)
+                except Exception as e:
+                    st.caption(f"{caption}：无法生成预览（{str(e)}）")
+
+# 服务器目录列表的缓存时长（秒）：顶层目录的修改时间反映不了子目录中的增删，超过该时长后重新遍历
+SERVER_LIST_TTL = 30
+
+def list_server_images(path):
+    """服务器路径下的图片列表缓存在会话中，路径或顶层修改时间变化、或超过 SERVER_LIST_TTL 时重新遍历；
+    进度区域每秒刷新时不重复遍历整个目录"""
+    key = (path, os.path.getmtime(path))
+    cached = st.session_state.get('server_images')
+    if cached is None or cached[0] != key or time.monotonic() - cached[1] > SERVER_LIST_TTL:
+        cached = st.session_state['server_images'] = (key, time.monotonic(), list(iter_image_paths([path])))
+    return cached[2]
+
+# 显示上传的图片预览，缩略图按内容哈希缓存，只生成当前页
+preview_items = []
 if uploaded_files:
+    preview_items = [(file.name, lambda file=file: thumbnails.get(content_key(file.getvalue()), file))
+                     for file in uploaded_files]
+elif uploaded_zip is not None:
+    preview_zip = zipfile.ZipFile(uploaded_zip)
+    preview_items = [(info.filename, lambda info=info: thumbnails.get(
+                          f"crc32:{info.CRC:08x}-{info.file_size}", preview_zip.read(info.filename)))
+                     for info in iter_zip_members(uploaded_zip)]
+elif server_path:
+    preview_items = [(str(source), lambda source=source: thumbnails.get(source_fingerprint(source), source))
+                     for source in list_server_images(server_path)]
+if preview_items:
     st.markdown("### 🖼️ 图片预览")
-    # 创建图片网格布局
-    num_cols = 5  # 每行显示的图片数量
-    image_rows = [uploaded_files[i:i+num_cols] for i in range(0, len(uploaded_files), num_cols)]
-    
-    for row in image_rows:
-        cols = st.columns(num_cols)
-        for i, image_file in enumerate(row):
-            with cols[i]:
-                # 显示图片,设置图片高度为200像素
-                st.image(image_file, caption=image_file.name,use_container_width=True)
-                # 添加文件名标签
-                # st.markdown(f"<p style='text-align: center; font-size: 0.8rem;'>{image_file.name}</p>", unsafe_allow_html=True)
+    render_gallery(preview_items, key='preview')
 
 # 开始检测按钮
 start_batch_detect = st.button("🚀 开始批量检测", type="primary")
 
 # 检查是否有上传图片
-if start_batch_detect and not uploaded_files:
+if start_batch_detect and not has_input:
     st.warning("⚠️ 请先上传需要检测的图片")
     st.stop()
 
-if uploaded_files and start_batch_detect:
-        # 显示检测进度
-        st.markdown("### 📊 检测进度")
-        progress_container = st.empty()
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+job_manager = JobManager()
 
-        detector = ModelDetector(model_name=model_name)
-        
-        total_files = len(uploaded_files)
-        results = []
+def save_uploads(job_id, files):
+    """把上传的图片保存到作业目录，返回带内容哈希的任务列表"""
+    job_dir = get_job_dir(job_id)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    sources = []
+    for file in files:
+        data = file.getvalue()
+        content_hash = hashlib.sha1(data).hexdigest()
+        path = job_dir / f"{content_hash}{Path(file.name).suffix.lower()}"
+        if not path.exists():
+            path.write_bytes(data)
+        sources.append({'source': str(path), 'name': file.name, 'content_hash': content_hash})
+    return sources
+
+def collect_sources(job_id):
+    """把当前输入转换为任务列表；ZIP压缩包和服务器目录只记录条目位置，检测时逐个读取"""
+    if uploaded_files:
+        return save_uploads(job_id, uploaded_files)
+    if uploaded_zip is not None:
+        job_dir = get_job_dir(job_id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        # 按内容命名，恢复作业时重新上传同一个压缩包直接复用作业目录中已保存的副本，条目来源也保持不变
+        archive = job_dir / f"upload_{hashlib.sha1(uploaded_zip.getvalue()).hexdigest()[:16]}.zip"
+        if not archive.exists():
+            uploaded_zip.seek(0)
+            with open(archive, 'wb') as out:
+                shutil.copyfileobj(uploaded_zip, out)
+        inputs = [str(archive)]
+    elif server_path:
+        inputs = [server_path]
+    else:
+        return None
+    root = Path(server_path) if server_path and os.path.isdir(server_path) else None
+    sources = []
+    for source in iter_image_paths(inputs):
+        if is_zip_source(source):
+            name = parse_zip_source(source)[1]
+        else:
+            name = str(Path(source).relative_to(root)) if root else Path(source).name
+        sources.append({'source': absolute_source(source), 'name': name, 'content_hash': source_fingerprint(source)})
+    return sources
+
+if has_input and start_batch_detect:
+    # 检测作为后台作业执行，每张图片的结果完成后立即写入作业数据库，关闭页面不会中断检测
+    job_id = uuid.uuid4().hex
+    job_manager.create_job(model_name, collect_sources(job_id), conf_thres=confidence_threshold,
+                           iou_thres=iou_threshold, job_id=job_id, owner=session_id,
+                           params={'prefilter': {'dedup_distance': dedup_distance}} if use_prefilter else None)
+    start_job(job_id, session_id, job_manager)
+    st.session_state.batch_job_id = job_id
+
+if resume_clicked and resume_job_id:
+    job_id = resume_job_id.strip()
+    if job_manager.get_job(job_id) is None:
+        st.error(f"作业不存在: {job_id}")
+    else:
+        # 重新上传的图片按内容哈希跳过已完成的部分
+        resumed = job_manager.resume_job(job_id, collect_sources(job_id))
+        start_job(job_id, session_id, job_manager)
+        st.session_state.batch_job_id = job_id
+        st.info(f"已恢复作业：跳过已完成 {resumed['skipped']} 张，重新入队 {resumed['requeued']} 张，新增 {resumed['added']} 张")
+
+job_id = st.session_state.get('batch_job_id')
+
+# 当前会话提交的作业列表，可切换查看
+my_jobs = job_manager.list_jobs(owner=session_id)
+if my_jobs:
+    st.markdown("### 🗂️ 我的作业")
+    status_names = {JOB_PENDING: '等待中', JOB_RUNNING: '检测中', JOB_COMPLETED: '已完成', JOB_CANCELLED: '已取消'}
+    st.dataframe(pd.DataFrame([{
+        '作业ID': job['id'],
+        '提交时间': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created_at'])),
+        '模型': job['model_name'],
+        '状态': status_names.get(job['status'], job['status']),
+        '进度': f"{job['counts'].get('done', 0) + job['counts'].get('failed', 0)}/{job['total_tasks']}"
+    } for job in my_jobs]), use_container_width=True)
+    job_ids = [job['id'] for job in my_jobs]
+    if job_id in job_ids:
+        job_id = st.selectbox("查看作业", options=job_ids, index=job_ids.index(job_id))
+        st.session_state.batch_job_id = job_id
+
+def render_job_status(job_id):
+    """显示作业进度、吞吐量、预计剩余时间和最近的失败记录，只查询作业数据库，不占用页面线程执行推理"""
+    status = job_manager.get_job_status(job_id)
+    # 已完成的图片加上当前批次按阶段折算的进度，批次内的预处理、推理、绘制和保存都会推进进度条
+    event = get_job_progress(job_id)
+    in_flight = event.fraction * status['running'] if event is not None else 0.0
+    st.progress(min((status['done'] + in_flight) / status['total'], 1.0) if status['total'] else 0.0,
+                text=f"当前批次：{event.describe()}" if event is not None and status['running'] else None)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("已完成", f"{status['done']}/{status['total']}")
+    col2.metric("失败", status['failed'])
+    col3.metric("吞吐量", f"{status['throughput']:.2f} 张/秒" if status['throughput'] else "-")
+    col4.metric("预计剩余", format_duration(status['eta']) if status['eta'] is not None else "-")
+    if status['recent_failures']:
+        with st.expander(f"最近的失败记录（{len(status['recent_failures'])}）"):
+            for failure in status['recent_failures']:
+                st.text(f"{failure['name']}（第{failure['attempts']}次尝试）: {failure['error']}")
+    if status['status'] in (JOB_PENDING, JOB_RUNNING):
+        if not is_job_running(job_id) and status['running'] == 0:
+            st.warning("⚠️ 作业未在运行（服务可能已重启），可在侧边栏输入作业ID恢复，已完成的图片不会重复检测")
+        elif st.button("⏹️ 取消作业", key=f"cancel_{job_id}"):
+            cancel_job(job_id, job_manager)
+    return status
+
+job_active = False
+if job_id:
+    job = job_manager.get_job(job_id)
+    job_active = job['status'] in (JOB_PENDING, JOB_RUNNING)
+    
+    # 显示检测进度
+    st.markdown("### 📊 检测进度")
+    st.caption(f"作业ID：{job_id}（检测在后台执行，关闭页面不影响；之后可在侧边栏输入该ID恢复或查看结果）")
+    
+    if job_active and hasattr(st, 'fragment'):
+        # 只定时刷新进度区域，其余控件的交互不会重复提交或中断检测
+        def job_status_panel():
+            status = render_job_status(job_id)
+            if status['status'] not in (JOB_PENDING, JOB_RUNNING):
+                # 作业结束后整页重新运行以显示检测结果
+                st.rerun()
+        st.fragment(job_status_panel, run_every=1)()
+    else:
+        render_job_status(job_id)
+    if job_active:
+        st.info("⏳ 检测进行中，完成后将在此显示检测结果")
+
+if job_id and not job_active:
+        rows = list(job_manager.iter_results(job_id))
+        results = results_to_table(rows)
+        total_files = len(rows)
+        for row in rows:
+            if 'error' in row:
+                st.error(f"检测文件 {row['name']} 时出错: {row['error']}")
         
-        # 使用横向布局显示检测后的图片
-        st.markdown("### 🖼️ 检测结果预览[前5张]")
-        result_cols = st.columns(5)  # 创建5列布局
-
-        for i, file in enumerate(uploaded_files):
-            start_time = time.time()
-            
-            # 更新进度
-            progress = (i + 1) / total_files
-            progress_bar.progress(progress)
-            status_text.text(f"正在检测: {file.name} ({i+1}/{total_files})")
-            
-            try:
-                # 执行检测
-                detections, plotted_image = detector.detect(file, conf_thres=confidence_threshold ,iou_thres = iou_threshold)
-                
-                # 获取检测结果统计
-                if detections:
-                    # 统计检测到的目标数量
-                    detection_count = len(detections)
-                    # 获取最高置信度的检测结果
-                    best_detection = max(detections, key=lambda x: x['confidence'])
-                    confidence = best_detection['confidence'] #round(best_detection['confidence'] * 100, 1)
-                    building_type = best_detection['label']
-                else:
-                    detection_count = 0
-                    confidence = 0
-                    building_type = '未检测到建筑物'
-                
-                # 计算检测时间
-                process_time = time.time() - start_time
-                
-                # 保存结果
-                results.append({
-                    '文件名': file.name,
-                    '建筑物类型': building_type,
-                    '检测目标数量': detection_count,
-                    '置信度': confidence,
-                    '检测时间': f"{process_time:.1f}秒"
-                })
-                
-                # 显示检测后的图片
-                if i < 5:  # 只显示前5张图片的检测结果
-                    with result_cols[i]:
-                        st.image(plotted_image, caption=f"检测结果: {file.name}", use_container_width=True)
-                    
-            except Exception as e:
-                st.error(f"检测文件 {file.name} 时出错: {str(e)}")
-                continue
+        # 分页浏览全部检测结果的缩略图
+        st.markdown("### 🖼️ 检测结果")
+        render_gallery([(f"{row['name']}（{row['detection_count']}个目标）",
+                         lambda row=row: get_result_thumbnail_path(job_id, row['seq']))
+                        for row in rows if 'error' not in row], key=f"results_{job_id}")
         
         # 显示检测完成信息
-        st.success(f"✨ 批量检测完成！共检测 {total_files} 张图片")
-        
-        # 保存历史记录
-        try:
-            db = DBManager()
-            db.add_batch_detection(
-                total_images=total_files,
-                success_count=len([r for r in results if r['检测目标数量'] > 0]),
-                failed_count=len([r for r in results if r['检测目标数量'] == 0]),
-                confidence=confidence,
-                batch_result=results
-            )
-        except Exception as e:
-            st.warning(f"保存历史记录失败: {str(e)}")
+        if job['status'] == JOB_CANCELLED:
+            st.info(f"作业已取消，已检测 {total_files} 张图片")
+        else:
+            st.success(f"✨ 批量检测完成！共检测 {total_files} 张图片")
         
         # 显示检测结果摘要
         st.markdown("### 📈 检测结果摘要")
@@ -337,6 +503,10 @@ if uploaded_files and start_batch_detect:
                 <h2>{:.1f}秒</h2>
             </div>
             """.format(total_time), unsafe_allow_html=True)
+        skipped_blank = sum(1 for row in rows if row.get('skipped') == SKIP_BLANK)
+        skipped_duplicate = sum(1 for row in rows if row.get('skipped') == SKIP_DUPLICATE)
+        if skipped_blank or skipped_duplicate:
+            st.caption(f"预筛选跳过推理：空白/nodata图片 {skipped_blank} 张，近似重复图片 {skipped_duplicate} 张")
         
         # 显示详细结果
         st.markdown("### 📋 详细结果")
@@ -366,7 +536,7 @@ if uploaded_files and start_batch_detect:
                 file_name='batch_recognition_results.xlsx',
                 mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
-else:
+elif not job_id:
     st.info("👆 请先上传需要检测的图片")
 
 # 添加页脚
@@ -376,3 +546,8 @@ st.markdown("""
     <p>© 2025 城市建筑物检测系统 | 技术支持：AIE52期-5组</p>
 </div>
 """, unsafe_allow_html=True)
+
+# 旧版本Streamlit不支持局部刷新时，作业进行中定时整页刷新进度
+if job_active and not hasattr(st, 'fragment'):
+    time.sleep(1)
+    st.rerun()
@@ -5,7 +5,7 @@ import pandas as pd
 import plotly.express as px
 import os
 from pathlib import Path
-from utils.model_detector import ModelDetector
+from utils.inference_client import create_detector
 from PIL import Image
 import json
 
@@ -159,7 +159,7 @@ if start_detect and uploaded_file:
             try:
                 # 初始化模型
                 start_time = time.time()
-                detector = ModelDetector(model_name)
+                detector = create_detector(model_name)
                 load_time = time.time() - start_time
                 
                 # 执行检测
@@ -1,7 +1,6 @@
 import streamlit as st
 import plotly.express as px
 from PIL import Image
-import numpy as np
 from pathlib import Path
 import time
 import os
@@ -11,9 +10,12 @@ cv2.setUseOptimized(True)
 cv2.setNumThreads(4)
 
 from utils.db_manager import DBManager
-from utils.model_detector import ModelDetector
-import matplotlib.pyplot as plt
-from skimage.metrics import structural_similarity as ssim
+import uuid
+from utils.inference_executor import get_executor, PRIORITY_INTERACTIVE, QueueFullError
+from utils.change_detector import ChangeDetector
+from utils.detection_cache import DetectionCache
+from utils.progress_events import (ProgressReporter, STAGE_DECODE, STAGE_PREPROCESS, STAGE_INFER, STAGE_POSTPROCESS,
+                                   STAGE_RENDER, STAGE_REGISTER, STAGE_COMPARE, STAGE_PERSIST)
 
 
 # 设置页面配置
@@ -255,8 +257,6 @@ with st.sidebar:
         on_change=lambda: setattr(st.session_state, 'model_name', model_name)
     )
 
-    print(f'页面选择模型：{model_name}')
-    
     confidence_threshold = st.slider(
         "置信度阈值",
         min_value=0.0,
@@ -274,6 +274,25 @@ with st.sidebar:
         help="调整变化检测的敏感度，值越低对变化越敏感"
     )
     
+    min_change_area = st.number_input(
+        "最小变化面积（像素）",
+        min_value=0,
+        value=20,
+        help="仅分割模型：按像素比较掩码时忽略面积小于该值的变化区域"
+    )
+    
+    coregister = st.checkbox(
+        "自动配准",
+        value=True,
+        help="比较前估计两期影像之间的平移（必要时为旋转/缩放），把早期检测结果变换到近期影像坐标，避免轻微错位产生大量误报"
+    )
+    
+    incremental = st.checkbox(
+        "增量检测（重复调查）",
+        value=False,
+        help="复用缓存的早期影像检测结果，只对与早期影像差异明显的分块重新检测，其余分块沿用早期结果；适用于同一区域、相同尺寸的定期影像"
+    )
+    
     
 
 # 主页面标题和介绍
@@ -312,209 +331,70 @@ with options_col3:
 if earlier_image is not None and recent_image is not None:
     if st.button("🔍 开始变化检测", type="primary"):
         with st.spinner('正在进行建筑物变化检测分析...'):
-            # 显示进度条
-            progress_bar = st.progress(0)
-            for i in range(100):
-                time.sleep(0.03)
-                progress_bar.progress(i + 1)
-            
-            # 初始化模型检测器
-            detector = ModelDetector(model_name)
-            
-            # 对早期和近期图片进行建筑物检测
-            earlier_detections, earlier_viz = detector.detect(earlier_image, conf_thres=confidence_threshold)
-            recent_detections, recent_viz = detector.detect(recent_image, conf_thres=confidence_threshold)
-            
-            # 计算变化统计信息
-            total_change_area = 0
-            significant_changes = []
-            
-            # 设置变化检测的阈值
-            area_change_threshold = 0.3  # 面积变化阈值
-            position_change_threshold = 20  # 位置变化阈值（像素）
-            
-            # 计算IOU函数
-            def calculate_iou(box1, box2):
-                # box格式: [x1, y1, x2, y2]
-                x1_1, y1_1, x2_1, y2_1 = box1
-                x1_2, y1_2, x2_2, y2_2 = box2
-                
-                # 计算交集区域的坐标
-                x1_i = max(x1_1, x1_2)
-                y1_i = max(y1_1, y1_2)
-                x2_i = min(x2_1, x2_2)
-                y2_i = min(y2_1, y2_2)
-                
-                # 如果没有交集，返回0
-                if x2_i < x1_i or y2_i < y1_i:
-                    return 0.0
-                
-                # 计算交集面积
-                intersection = (x2_i - x1_i) * (y2_i - y1_i)
-                
-                # 计算两个框的面积
-                area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-                area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-                
-                # 计算并集面积
-                union = area1 + area2 - intersection
-                
-                # 返回IOU
-                return intersection / union if union > 0 else 0.0
-            
-            # 将检测结果转换为列表，包含更多信息
-            earlier_buildings = []
-            recent_buildings = []
-            
-            for det in earlier_detections:
-                if 'bbox' in det:
-                    bbox = det['bbox']
-                    area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-                    center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
-                    earlier_buildings.append({
-                        'bbox': bbox,
-                        'area': area,
-                        'center': center,
-                        'confidence': det.get('confidence', 0.0)
-                    })
-            
-            for det in recent_detections:
-                if 'bbox' in det:
-                    bbox = det['bbox']
-                    area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-                    center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
-                    recent_buildings.append({
-                        'bbox': bbox,
-                        'area': area,
-                        'center': center,
-                        'confidence': det.get('confidence', 0.0)
-                    })
-            
-            # 分析变化
-            # 使用IOU阈值判断建筑物变化
-            iou_threshold = detection_threshold  # 使用用户设置的检测阈值
-            
-            # 标记已匹配的建筑物
-            matched_earlier = [False] * len(earlier_buildings)
-            matched_recent = [False] * len(recent_buildings)
-            
-            # 初始化变化类型计数和变化列表
-            changes_count = {
-                "新建筑物": 0,
-                "拆除建筑物": 0,
-                "建筑物扩建": 0
-            }
-            significant_changes = []
-            total_change_area = 0
-            
-            # 第一步：匹配建筑物并检测扩建
-            for i, recent_building in enumerate(recent_buildings):
-                best_iou = 0
-                best_match = -1
-                
-                # 寻找最佳匹配的早期建筑物
-                for j, earlier_building in enumerate(earlier_buildings):
-                    if not matched_earlier[j]:
-                        iou = calculate_iou(recent_building['bbox'], earlier_building['bbox'])
-                        if iou > best_iou:
-                            best_iou = iou
-                            best_match = j
-                
-                # 判断建筑物变化情况
-                if best_iou > iou_threshold and best_match != -1:
-                    area_change = recent_building['area'] - earlier_buildings[best_match]['area']
-                    area_change_ratio = abs(area_change) / earlier_buildings[best_match]['area']
-                    
-                    if detect_extensions and area_change_ratio > area_change_threshold:
-                        # 检测到扩建或缩小
-                        matched_recent[i] = True
-                        matched_earlier[best_match] = True
-                        total_change_area += abs(area_change)
-                        changes_count["建筑物扩建"] += 1
-                        change_type = "建筑物扩建" if area_change > 0 else "建筑物缩小"
-                        significant_changes.append({
-                            "类型": change_type,
-                            "位置": f"坐标({int(recent_building['center'][0])}, {int(recent_building['center'][1])})",
-                            "面积变化": f"从 {int(earlier_buildings[best_match]['area'])} 变化到 {int(recent_building['area'])} 平方像素",
-                            "变化比例": f"{int(area_change_ratio * 100)}%"
-                        })
-                    else:
-                        # 如果面积变化不大，标记为匹配
-                        matched_recent[i] = True
-                        matched_earlier[best_match] = True
-                elif detect_new_buildings and not matched_recent[i]:
-                    # 如果没有匹配到或IOU低于阈值，且启用了新建筑检测
-                    total_change_area += recent_building['area']
-                    changes_count["新建筑物"] += 1
-                    significant_changes.append({
-                        "类型": "新建筑物",
-                        "位置": f"坐标({int(recent_building['center'][0])}, {int(recent_building['center'][1])})",
-                        "面积": f"约 {int(recent_building['area'])} 平方像素",
-                        "置信度": f"{recent_building['confidence']:.2f}"
-                    })
-            
-            # 第二步：处理拆除的建筑物
-            if detect_demolished:
-                for i, earlier_building in enumerate(earlier_buildings):
-                    if not matched_earlier[i]:
-                        total_change_area += earlier_building['area']
-                        changes_count["拆除建筑物"] += 1
-                        significant_changes.append({
-                            "类型": "拆除建筑物",
-                            "位置": f"坐标({int(earlier_building['center'][0])}, {int(earlier_building['center'][1])})",
-                            "面积": f"约 {int(earlier_building['area'])} 平方像素",
-                            "置信度": f"{earlier_building['confidence']:.2f}"
-                        })
-
-            
-            # 创建基于模型检测框的变化可视化图像
-            change_viz = recent_viz.copy()
-            # 绘制拆除建筑（红色虚线）
-            for i, earlier_building in enumerate(earlier_buildings):
-                if not matched_earlier[i]:
-                    x1, y1, x2, y2 = map(int, earlier_building['bbox'])
-                    # 使用虚线绘制拆除建筑的边框
-                    for j in range(0, (x2-x1), 10):
-                        cv2.line(change_viz, (x1+j, y1), (min(x1+j+5, x2), y1), (255, 0, 0), 2)
-                        cv2.line(change_viz, (x1+j, y2), (min(x1+j+5, x2), y2), (255, 0, 0), 2)
-                    for j in range(0, (y2-y1), 10):
-                        cv2.line(change_viz, (x1, y1+j), (x1, min(y1+j+5, y2)), (255, 0, 0), 2)
-                        cv2.line(change_viz, (x2, y1+j), (x2, min(y1+j+5, y2)), (255, 0, 0), 2)
-            # 绘制新建建筑（绿色实线）
-            for i, recent_building in enumerate(recent_buildings):
-                if not matched_recent[i]:
-                    x1, y1, x2, y2 = map(int, recent_building['bbox'])
-                    cv2.rectangle(change_viz, (x1, y1), (x2, y2), (0, 255, 0), 3)
-            # 绘制扩建建筑（黄色点线）
-            for i, recent_building in enumerate(recent_buildings):
-                if matched_recent[i] and any(matched_earlier[j] and calculate_iou(recent_building['bbox'], earlier_buildings[j]['bbox']) > iou_threshold for j in range(len(earlier_buildings))):
-                    x1, y1, x2, y2 = map(int, recent_building['bbox'])
-                    # 使用黄色点线绘制扩建建筑的边框
-                    for j in range(0, (x2-x1), 10):
-                        cv2.line(change_viz, (x1+j, y1), (min(x1+j+5, x2), y1), (255, 255, 0), 2)
-                        cv2.line(change_viz, (x1+j, y2), (min(x1+j+5, x2), y2), (255, 255, 0), 2)
-                    for j in range(0, (y2-y1), 10):
-                        cv2.line(change_viz, (x1, y1+j), (x1, min(y1+j+5, y2)), (255, 255, 0), 2)
-                        cv2.line(change_viz, (x2, y1+j), (x2, min(y1+j+5, y2)), (255, 255, 0), 2)
-        
-            
-            # 获取图片尺寸并统一化
-            earlier_img = Image.open(earlier_image)
-            recent_img = Image.open(recent_image)
-            
-            # 统一图片尺寸为较大的那个尺寸
-            target_size = (max(earlier_img.size[0], recent_img.size[0]), max(earlier_img.size[1], recent_img.size[1]))
-            earlier_img = earlier_img.resize(target_size, Image.Resampling.LANCZOS)
-            recent_img = recent_img.resize(target_size, Image.Resampling.LANCZOS)
-            
-            # 转换为numpy数组以便进行OpenCV操作
-            earlier_array = np.array(earlier_img)
-            recent_array = np.array(recent_img)
-            
-            # 计算平均变化强度
-            intensity_diff = 0
-            if significant_changes:
-                intensity_diff = total_change_area / len(significant_changes)
+            # 每个时期的影像只解码一次，检测、统计、显示和保存历史记录都复用解码后的图片
+            earlier_img = Image.open(earlier_image).convert('RGB')
+            recent_img = Image.open(recent_image).convert('RGB')
+            
+            # 进度条由检测器和变化检测引擎发布的阶段事件驱动：推理在执行器线程中进行，等待期间读取最近的事件
+            stages = [STAGE_DECODE, STAGE_PREPROCESS, STAGE_INFER, STAGE_POSTPROCESS, STAGE_RENDER, STAGE_COMPARE,
+                      STAGE_PERSIST] + ([STAGE_REGISTER] if coregister else [])
+            progress = ProgressReporter(stages)
+            progress_bar = st.progress(0.0, text="准备检测...")
+            show_progress = lambda event: progress_bar.progress(min(event.fraction, 1.0), text=event.describe())
+            progress.subscribe(show_progress, local=True)
+            
+            # 两个时期的影像作为一个请求以交互优先级提交到进程级推理执行器，在同一次批量前向推理中完成
+            executor = get_executor()
+            session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+            queue_status = st.empty()
+            
+            def show_position(position):
+                if position > 0:
+                    queue_status.text(f"排队中，第 {position} 位")
+                    return
+                queue_status.empty()
+                event = progress.latest()
+                if event is not None:
+                    show_progress(event)
+            
+            def infer_batch(images):
+                ticket = executor.submit_batch(session_id, model_name, images, conf_thres=confidence_threshold,
+                                               priority=PRIORITY_INTERACTIVE, progress=progress)
+                return ticket.result(on_wait=show_position)
+            
+            # 分析变化：在IOU矩阵上做最优一一匹配，IOU阈值使用用户设置的检测阈值
+            change_detector = ChangeDetector(
+                conf_thres=confidence_threshold,
+                match_iou=detection_threshold,
+                area_change_threshold=0.3,
+                detect_new=detect_new_buildings,
+                detect_demolished=detect_demolished,
+                detect_resized=detect_extensions,
+                min_change_area=min_change_area,
+                infer_batch=infer_batch,
+                coregister=coregister
+            )
+            try:
+                # 分割模型输出掩码时按像素比较，检测模型按检测框匹配；变化率按两幅影像中较大的尺寸计算
+                if incremental:
+                    cache = DetectionCache(model_name, conf_thres=confidence_threshold)
+                    result = change_detector.detect_incremental(earlier_img, recent_img, cache, progress=progress)
+                else:
+                    result = change_detector.detect(earlier_img, recent_img, progress=progress)
+            except QueueFullError:
+                st.warning("⚠️ 系统繁忙，推理队列已满，请稍后重试")
+                st.stop()
+            queue_status.empty()
+            report = result.report
+            earlier_detections, earlier_viz = result.earlier_detections, result.earlier_viz
+            recent_detections, recent_viz = result.recent_detections, result.recent_viz
+            # 基于模型检测结果的变化可视化图像
+            change_viz = result.change_viz
+            changes_count = report['changes_count']
+            significant_changes = report['significant_changes']
+            total_change_area = report['total_change_area']
+            changes_detected = report['changes_detected']
+            change_type = report['change_type']
             
             # 准备数据
             changes_data = pd.DataFrame({
@@ -522,16 +402,20 @@ if earlier_image is not None and recent_image is not None:
                 "数量": [changes_count["新建筑物"], changes_count["拆除建筑物"], changes_count["建筑物扩建"]]
             })
             
-            # 统计检测结果
-            changes_detected = {
-                "新建筑物": changes_count["新建筑物"],
-                "拆除建筑物": changes_count["拆除建筑物"],
-                "扩建区域": changes_count["建筑物扩建"],
-                "总变化面积": f"约 {int(total_change_area)} 平方像素",
-                "变化率": f"{min(100.0, (total_change_area / (target_size[0] * target_size[1]) * 100)):.1f}%"
-            }
-            
             st.success("✨ 变化检测完成！")
+            if 'registration' in report:
+                registration = report['registration']
+                st.caption(f"配准偏移 ({registration['shift'][0]:.1f}, {registration['shift'][1]:.1f}) 像素，"
+                           f"方法 {registration['method']}，耗时 {registration['elapsed_ms']:.0f} 毫秒")
+            if incremental:
+                stats = result.stats
+                if stats['recent_cached']:
+                    st.caption("近期影像已检测过，直接使用缓存的检测结果")
+                elif stats['full_recent']:
+                    st.caption("影像尺寸不同或变化区域较多，已对近期影像整体检测")
+                else:
+                    st.caption(f"早期影像{'使用缓存结果' if stats['earlier_cached'] else '已检测并缓存'}，"
+                               f"近期影像重新检测 {stats['changed_tiles']}/{stats['tiles']} 个分块")
             
             # 显示检测结果
             st.markdown("### 🔍 检测结果")
@@ -545,6 +429,7 @@ if earlier_image is not None and recent_image is not None:
             
                 
             # 保存历史记录
+            progress.start(STAGE_PERSIST, message="保存历史记录")
             try:
                 # 定义图片路径变量
                 earlier_image_path = os.path.join('data/detection_results', f'{int(time.time())}_earlier.jpg')
@@ -554,15 +439,6 @@ if earlier_image is not None and recent_image is not None:
                 earlier_img.save(earlier_image_path)
                 recent_img.save(recent_image_path)
                 
-                # 确定主要变化类型
-                change_type = "混合变化"
-                if changes_detected["新建筑物"] > 0 and changes_detected["拆除建筑物"] == 0 and changes_detected["扩建区域"] == 0:
-                    change_type = "新增建筑"
-                elif changes_detected["拆除建筑物"] > 0 and changes_detected["新建筑物"] == 0 and changes_detected["扩建区域"] == 0:
-                    change_type = "拆除建筑"
-                elif changes_detected["扩建区域"] > 0 and changes_detected["新建筑物"] == 0 and changes_detected["拆除建筑物"] == 0:
-                    change_type = "建筑扩建"
-                
                 earlier_confidence = earlier_detections[0]['confidence'] if earlier_detections else 0.5
                 recent_confidence = recent_detections[0]['confidence'] if recent_detections else 0.5
 
@@ -581,6 +457,7 @@ if earlier_image is not None and recent_image is not None:
                 )
             except Exception as e:
                 st.warning(f"保存历史记录失败: {str(e)}")
+            progress.complete("变化检测完成")
 
             
             
@@ -0,0 +1,172 @@
+import streamlit as st
+import streamlit.components.v1 as components
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from utils.inference_executor import get_executor, QueueFullError
+from utils.model_detector import get_model_type
+from utils.raster_source import open_raster, iter_windows
+from utils.tiled_detector import TiledDetector
+from utils.tile_pyramid import (SCENE_DIR, TilePyramid, register_pyramid, get_pyramid, tile_url_template,
+                                get_leaflet_url)
+
+# 设置页面配置
+st.set_page_config(
+    page_title="大幅影像检测 - 智能建筑物检测系统",
+    page_icon="🗺️",
+    layout="wide"
+)
+
+st.markdown("""
+<style>
+    .stButton>button {
+        width: 100%;
+        background: linear-gradient(45deg, #0083B8, #00A3E0);
+        color: white;
+        border: none;
+        padding: 0.8rem;
+        border-radius: 8px;
+        font-weight: 500;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+</style>
+""", unsafe_allow_html=True)
+
+# 页面标题
+st.title("🗺️ 大幅影像检测")
+st.markdown("对整幅正射影像按窗口分块检测，检测结果生成瓦片金字塔，可以平移缩放浏览")
+
+# 侧边栏设置
+with st.sidebar:
+    st.markdown("### 检测设置")
+    model_dir = Path(__file__).parent.parent / 'model'
+    model_files = [f.name for f in list(model_dir.glob('*.pt')) + list(model_dir.glob('*.pth'))]
+    if not model_files:
+        st.error("未找到可用的模型文件，请确保model目录中存在.pt或.pth格式的模型文件")
+        model_files = ['build_V8n.pt']
+    model_name = st.selectbox("选择模型", options=model_files, help="YOLO模型输出检测框，分割模型输出建筑物掩码")
+
+    confidence_threshold = st.slider("置信度阈值", min_value=0.0, max_value=1.0,
+                                     value=st.session_state.get('confidence_threshold', 0.5))
+    iou_threshold = st.slider("IOU阈值", min_value=0.0, max_value=1.0,
+                              value=st.session_state.get('iou_threshold', 0.8))
+
+    st.markdown("### 分块设置")
+    tile_size = st.select_slider("分块边长", options=[512, 640, 800, 1024], value=640)
+    overlap = st.slider("分块重叠像素", min_value=0, max_value=256, value=64, step=16,
+                        help="跨越分块边界的建筑物在重叠区域中被完整检测，重复的检测框会自动合并")
+    skip_blank = st.checkbox("跳过空白/无数据分块", value=True,
+                             help="正射影像边缘的大片无数据区域不执行模型推理")
+    min_area = st.number_input("最小建筑物面积（像素）", min_value=0, value=50,
+                               help="仅分割模型：忽略面积小于该值的连通域")
+
+# 影像输入：大幅影像无法通过浏览器上传，直接读取服务器上的文件
+st.markdown("### 📂 影像文件")
+raster_path = st.text_input(
+    "服务器上的影像路径",
+    help="支持 .tif/.tiff（含BigTIFF）、.npy 栅格以及普通图片；影像按窗口读取，不会整体载入内存"
+).strip()
+if raster_path:
+    if not os.path.exists(raster_path):
+        st.error(f"路径不存在: {raster_path}")
+        raster_path = ''
+    else:
+        try:
+            with open_raster(raster_path) as raster:
+                tile_count = sum(1 for _ in iter_windows(raster.width, raster.height, tile_size, overlap))
+                st.caption(f"影像尺寸 {raster.width} x {raster.height}，{raster.bands} 个波段，"
+                           f"共 {tile_count} 个分块")
+        except Exception as e:
+            st.error(f"无法读取影像: {str(e)}")
+            raster_path = ''
+
+start_detect = st.button("🚀 开始检测", type="primary")
+if start_detect and not raster_path:
+    st.warning("⚠️ 请先填写需要检测的影像路径")
+    st.stop()
+
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
+if start_detect:
+    scene_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    scene_dir = SCENE_DIR / scene_id
+    scene_dir.mkdir(parents=True, exist_ok=True)
+    is_yolo = get_model_type(model_name) == 'yolo'
+
+    def infer_batch(images):
+        # 分块推理与其他页面共享进程级推理执行器，队列已满时等待
+        while True:
+            try:
+                return get_executor().submit_batch(session_id, model_name, images, conf_thres=confidence_threshold,
+                                                   iou_thres=iou_threshold).result()
+            except QueueFullError:
+                time.sleep(0.5)
+
+    tiled = TiledDetector(tile_size=tile_size, overlap=overlap, conf_thres=confidence_threshold,
+                          iou_thres=iou_threshold, skip_blank=skip_blank, infer_batch=infer_batch)
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+
+    def update_progress(stats):
+        progress_bar.progress(stats['done'] / max(stats['tiles'], 1))
+        status_text.text(f"已检测 {stats['done']}/{stats['tiles']} 块，跳过空白 {stats['skipped']} 块")
+
+    mask_path = None
+    try:
+        with open_raster(raster_path) as raster:
+            if is_yolo:
+                detections = tiled.detect(raster, on_tile=update_progress)
+            else:
+                mask_path = scene_dir / 'mask.npy'
+                detections = tiled.segment(raster, mask_path=mask_path, min_area=min_area, work_dir=scene_dir,
+                                           on_tile=update_progress)
+    except Exception as e:
+        st.error(f"检测失败: {str(e)}")
+        st.stop()
+
+    with open(scene_dir / 'detections.jsonl', 'w', encoding='utf-8') as f:
+        for detection in detections:
+            f.write(json.dumps({k: v for k, v in detection.items() if k != 'segmentation'}, ensure_ascii=False) + '\n')
+    with st.spinner("正在生成概览瓦片..."):
+        pyramid = register_pyramid(TilePyramid.create(scene_dir, raster_path, detections if is_yolo else None,
+                                                      mask_path))
+        pyramid.precompute()
+    status_text.empty()
+    st.success(f"✨ 检测完成！共检测到 {len(detections)} 个建筑物，耗时 {tiled.stats.get('elapsed', 0):.1f}秒")
+    st.session_state['scene_id'] = scene_id
+
+# 浏览检测结果，可以切换到之前检测过的影像
+scene_ids = sorted((p.name for p in SCENE_DIR.glob('*') if (p / 'meta.json').exists()), reverse=True) \
+    if SCENE_DIR.exists() else []
+if scene_ids:
+    st.markdown("### 🔎 检测结果浏览")
+    current = st.session_state.get('scene_id')
+    scene_id = st.selectbox("选择影像", options=scene_ids,
+                            index=scene_ids.index(current) if current in scene_ids else 0)
+    pyramid = get_pyramid(scene_id)
+    if pyramid is None:
+        st.error("无法打开检测结果")
+    else:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("影像尺寸", f"{pyramid.width} x {pyramid.height}")
+        detections_path = pyramid.scene_dir / 'detections.jsonl'
+        detection_count = sum(1 for _ in open(detections_path, encoding='utf-8')) if detections_path.exists() else 0
+        col2.metric("建筑物数量", detection_count)
+        col3.metric("缩放层级", f"0 - {pyramid.max_zoom}")
+        st.caption(f"影像: {pyramid.meta['raster']}，检测时间: {pyramid.meta['created_at']}")
+        # 查看器只请求当前视野内的瓦片，深层级瓦片在第一次浏览时生成并缓存
+        components.html(pyramid.viewer_html(tile_url_template(pyramid), height=600,
+                                            leaflet_url=get_leaflet_url()), height=620)
+        if detections_path.exists():
+            st.download_button("📥 导出检测结果 (JSONL)", data=detections_path.read_bytes(),
+                               file_name=f"{scene_id}_detections.jsonl", mime="application/json")
+
+# 添加页脚
+st.markdown("---")
+st.markdown("""
+<div style='text-align: center; color: #666;'>
+    <p>© 2025 城市建筑物检测系统 | 技术支持：AIE52期-5组</p>
+</div>
+""", unsafe_allow_html=True)
@@ -0,0 +1,186 @@
+import streamlit as st
+import plotly.express as px
+import pandas as pd
+import json
+import time
+import uuid
+from pathlib import Path
+from PIL import Image
+from utils.inference_executor import get_executor, PRIORITY_INTERACTIVE, QueueFullError
+from utils.detection_cache import DetectionCache
+from utils.change_detector import draw_detections
+from utils.change_series import ChangeSeries, EVENT_NEW, EVENT_DEMOLISHED, EVENT_EXTENDED, EVENT_SHRUNK
+
+# 设置页面配置
+st.set_page_config(
+    page_title="多时期分析 - 城市建筑物检测系统",
+    page_icon="📈",
+    layout="wide"
+)
+
+st.markdown("""
+<style>
+    .stButton>button {
+        width: 100%;
+        background: linear-gradient(45deg, #0083B8, #00A3E0);
+        color: white;
+        border: none;
+        padding: 0.8rem;
+        border-radius: 8px;
+        font-weight: 500;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+    img {
+        border-radius: 12px;
+        max-width: 100%;
+        height: auto;
+    }
+</style>
+""", unsafe_allow_html=True)
+
+# 页面标题
+st.title("📈 多时期变化分析")
+st.markdown("上传同一地点多个时期的影像，追踪每个建筑物从出现、扩建到拆除的完整生命周期")
+
+# 侧边栏设置
+with st.sidebar:
+    st.markdown("### 检测设置")
+    model_dir = Path(__file__).parent.parent / 'model'
+    model_files = [f.name for f in list(model_dir.glob('*.pt')) + list(model_dir.glob('*.pth'))]
+    if not model_files:
+        st.error("未找到可用的模型文件，请确保model目录中存在.pt或.pth格式的模型文件")
+        model_files = ['build_V8n.pt']
+    model_name = st.selectbox("选择模型", options=model_files, help="选择不同的预训练模型进行检测")
+
+    confidence_threshold = st.slider("置信度阈值", min_value=0.0, max_value=1.0,
+                                     value=st.session_state.get('confidence_threshold', 0.5))
+    match_threshold = st.slider("变化检测阈值", min_value=0.0, max_value=1.0, value=0.3,
+                                help="相邻时期判定为同一建筑物的IoU阈值，值越低对变化越不敏感")
+    coregister = st.checkbox("自动配准", value=True, help="匹配前估计相邻时期影像之间的平移，避免轻微错位产生误报")
+
+# 影像上传：按文件名排序作为时间顺序
+st.markdown("### 📤 各时期影像上传")
+uploaded_files = st.file_uploader(
+    "选择同一地点不同时期的影像（至少两张）",
+    type=['jpg', 'jpeg', 'png'],
+    accept_multiple_files=True,
+    help="按文件名排序作为时间顺序，建议以日期命名，例如 2021-06.jpg"
+)
+uploaded_files = sorted(uploaded_files or [], key=lambda f: f.name)
+if uploaded_files:
+    st.caption("时间顺序：" + " → ".join(Path(f.name).stem for f in uploaded_files))
+
+# 上传的影像变化时清除上一次的分析结果
+uploaded_names = [f.name for f in uploaded_files]
+if st.session_state.get('series_files') != uploaded_names:
+    for key in ('series_result', 'series_images', 'series_names'):
+        st.session_state.pop(key, None)
+    st.session_state['series_files'] = uploaded_names
+
+if len(uploaded_files) >= 2 and st.button("🔍 开始多时期分析", type="primary"):
+    # 每个时期只解码一次，缓存命中的时期不再推理
+    images = [Image.open(f).convert('RGB') for f in uploaded_files]
+    names = [Path(f.name).stem for f in uploaded_files]
+
+    executor = get_executor()
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    queue_status = st.empty()
+    show_position = lambda position: queue_status.text(f"排队中，第 {position} 位" if position > 0 else "正在检测...")
+
+    def infer_batch(batch):
+        ticket = executor.submit_batch(session_id, model_name, batch, conf_thres=confidence_threshold,
+                                       priority=PRIORITY_INTERACTIVE)
+        return ticket.result(on_wait=show_position)
+
+    series = ChangeSeries(infer_batch=infer_batch, cache=DetectionCache(model_name, conf_thres=confidence_threshold),
+                          conf_thres=confidence_threshold, match_iou=match_threshold, coregister=coregister)
+    with st.spinner('正在进行多时期变化分析...'):
+        try:
+            result = series.analyze(images, names=names)
+        except QueueFullError:
+            st.warning("⚠️ 系统繁忙，推理队列已满，请稍后重试")
+            st.stop()
+    queue_status.empty()
+    stats = result.stats
+    st.success(f"✨ 分析完成！共 {stats['epochs']} 个时期，新检测 {stats['inferred']} 个，"
+               f"复用缓存 {stats['cached']} 个，耗时 {stats['elapsed']:.1f}秒")
+    # 结果保存在session_state中，筛选等控件触发重新运行时不必重新分析
+    st.session_state['series_result'] = result
+    st.session_state['series_images'] = images
+    st.session_state['series_names'] = names
+elif uploaded_files and len(uploaded_files) < 2:
+    st.info("请至少上传两个时期的影像")
+
+if 'series_result' in st.session_state:
+    result = st.session_state['series_result']
+    images = st.session_state['series_images']
+    names = st.session_state['series_names']
+
+    # 各时期检测结果
+    st.markdown("### 🔍 各时期检测结果")
+    columns = st.columns(min(len(names), 4))
+    for index, (name, detections) in enumerate(zip(names, result.detections)):
+        with columns[index % len(columns)]:
+            # 模型的可视化结果通道顺序不一，统一在RGB原图上绘制
+            st.image(draw_detections(images[index], detections), caption=f"{name}（{len(detections)}）",
+                     use_container_width=True)
+
+    # 相邻时期之间的统计
+    st.markdown("### 📊 时期间变化统计")
+    intervals_df = pd.DataFrame([{
+        '时期': f"{interval['from']} → {interval['to']}",
+        '建筑物数量': interval['buildings_after'],
+        '新建': interval[EVENT_NEW],
+        '拆除': interval[EVENT_DEMOLISHED],
+        '扩建': interval[EVENT_EXTENDED],
+        '缩小': interval[EVENT_SHRUNK],
+        '变化面积（平方像素）': int(interval['change_area'])
+    } for interval in result.intervals])
+    col1, col2 = st.columns(2)
+    with col1:
+        st.dataframe(intervals_df, use_container_width=True)
+    with col2:
+        fig_bar = px.bar(
+            intervals_df.melt(id_vars='时期', value_vars=['新建', '拆除', '扩建', '缩小'],
+                              var_name='变化类型', value_name='数量'),
+            x='时期', y='数量', color='变化类型', barmode='group', title="各时期间建筑物变化数量",
+            color_discrete_sequence=["#00A3E0", "#FF5733", "#33FF57", "#FFC300"]
+        )
+        fig_bar.update_layout(plot_bgcolor="white", margin=dict(t=40, r=10, b=10, l=10))
+        st.plotly_chart(fig_bar, use_container_width=True)
+
+    # 每个建筑物的生命周期
+    st.markdown("### 🏗️ 建筑物生命周期")
+    timelines_df = pd.DataFrame([{
+        '编号': timeline['id'],
+        '首次出现': timeline['first_seen'],
+        '最后出现': timeline['last_seen'],
+        '拆除时期': timeline['demolished_at'] or '-',
+        '变化记录': '，'.join(f"{event['epoch']} {event['type']}" for event in timeline['events']),
+        '最新面积（平方像素）': int(timeline['footprints'][-1]['area'])
+    } for timeline in result.timelines])
+    status = st.radio("筛选", ["全部", "新建", "已拆除", "发生扩建/缩小"], horizontal=True)
+    if not timelines_df.empty:
+        if status == "新建":
+            timelines_df = timelines_df[timelines_df['首次出现'] != names[0]]
+        elif status == "已拆除":
+            timelines_df = timelines_df[timelines_df['拆除时期'] != '-']
+        elif status == "发生扩建/缩小":
+            timelines_df = timelines_df[timelines_df['变化记录'].str.contains(f"{EVENT_EXTENDED}|{EVENT_SHRUNK}")]
+    st.dataframe(timelines_df, use_container_width=True, hide_index=True)
+
+    st.download_button(
+        "📥 导出分析结果 (JSON)",
+        data=json.dumps({'epochs': names, 'intervals': result.intervals, 'timelines': result.timelines},
+                        ensure_ascii=False, indent=2),
+        file_name=f"series_{time.strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json"
+    )
+
+# 添加页脚
+st.markdown("---")
+st.markdown("""
+<div style='text-align: center; color: #666;'>
+    <p>© 2025 城市建筑物检测系统 | 技术支持：AIE52期-5组</p>
+</div>
+""", unsafe_allow_html=True)
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# 仓库没有安装为包，测试直接从仓库根目录导入 utils
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
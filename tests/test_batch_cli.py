@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+from PIL import Image
+
+from utils.batch_cli import run_batch
+from utils.batch_io import open_result_writer
+
+
+class FakeDetector:
+    def preprocess_image(self, image):
+        return Image.open(image).convert('RGB')
+
+    def detect(self, image, conf_thres=0.5, iou_thres=0.45):
+        return self.postprocess(image, np.asarray(image), conf_thres)
+
+    def forward_batch(self, images, conf_thres=0.5, iou_thres=0.45):
+        return [np.asarray(image) for image in images]
+
+    def postprocess(self, image, output, conf_thres=0.5):
+        return [{'label': 'building', 'confidence': 0.9, 'bbox': [0, 0, 4, 4]}], output
+
+
+def test_same_named_images_keep_separate_visualizations(tmp_path):
+    paths = []
+    for index, folder in enumerate(['a', 'b']):
+        (tmp_path / folder).mkdir()
+        paths.append(tmp_path / folder / 'tile.png')
+        Image.fromarray(np.full((8, 8, 3), index * 100, dtype=np.uint8)).save(paths[-1])
+
+    with open_result_writer(tmp_path / 'results.jsonl') as writer:
+        stats = run_batch(FakeDetector(), paths, writer, save_dir=tmp_path / 'viz')
+    assert (stats['total'], stats['success']) == (2, 2)
+
+    saved = sorted(path.name for path in (tmp_path / 'viz').iterdir())
+    assert saved == ['000000_tile_result.jpg', '000001_tile_result.jpg']
+    rows = [json.loads(line) for line in (tmp_path / 'results.jsonl').read_text(encoding='utf-8').splitlines()]
+    assert [row['path'] for row in rows] == [str(path) for path in paths]
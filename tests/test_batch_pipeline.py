@@ -0,0 +1,43 @@
+import pytest
+
+from utils.batch_pipeline import BatchPipeline
+
+
+def infer_batch(images):
+    return [([{'label': 'building', 'confidence': 0.9, 'bbox': [0, 0, image, image]}], None) for image in images]
+
+
+def make_pipeline(**kwargs):
+    return BatchPipeline(infer_batch=infer_batch, load_image=lambda source: source, batch_size=3, **kwargs)
+
+
+def test_results_are_in_input_order():
+    items = [(str(i), i) for i in range(40)]
+    results = list(make_pipeline(decode_workers=4, postprocess_workers=3).run(items))
+    assert [item.name for item in results] == [name for name, _ in items]
+    assert all(item.detections[0]['bbox'][2] == item.index for item in results)
+
+
+def test_decode_errors_are_reported_per_item():
+    def load_image(source):
+        if source == 3:
+            raise ValueError("bad image")
+        return source
+
+    pipeline = BatchPipeline(infer_batch=infer_batch, load_image=load_image)
+    results = list(pipeline.run((str(i), i) for i in range(6)))
+    assert [item.error is not None for item in results] == [False, False, False, True, False, False]
+
+
+def test_input_error_is_raised_after_draining():
+    def items():
+        for i in range(5):
+            yield str(i), i
+        raise OSError("archive truncated")
+
+    results = []
+    with pytest.raises(OSError, match="archive truncated"):
+        for item in make_pipeline().run(items()):
+            results.append(item.name)
+    # 出错前已读取的图片照常输出
+    assert results == ['0', '1', '2', '3', '4']
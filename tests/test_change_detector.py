@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.change_detector import CHANGE_DEMOLISHED, CHANGE_NEW, CHANGE_RESIZED, CHANGE_SHRUNK, ChangeDetector
+from utils.detection_cache import DetectionCache
+
+
+def find_buildings(images):
+    """用亮色连通域代替模型：每个白色矩形是一个建筑物"""
+    results = []
+    for image in images:
+        mask = (np.asarray(image)[..., 0] > 200).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        detections = [{'label': 'building', 'class': 'building', 'confidence': 0.9,
+                       'bbox': [float(x), float(y), float(x + w), float(y + h)]}
+                      for x, y, w, h, _ in stats[1:count]]
+        results.append((detections, None))
+    find_buildings.pixels += sum(image.width * image.height for image in images)
+    return results
+
+
+@pytest.fixture
+def detector():
+    find_buildings.pixels = 0
+    return ChangeDetector(infer_batch=find_buildings)
+
+
+def boxes(detections):
+    return sorted(tuple(d['bbox']) for d in detections)
+
+
+def box(x1, y1, x2, y2):
+    return {'bbox': [x1, y1, x2, y2], 'confidence': 0.8}
+
+
+# 早期：保持不变、被拆除、将被扩建、将被缩小；近期另有一栋新建筑
+EARLIER = [box(0, 0, 10, 10), box(100, 100, 120, 120), box(50, 0, 70, 20), box(200, 0, 240, 40)]
+RECENT = [box(0, 0, 10, 10), box(50, 0, 80, 20), box(200, 0, 225, 40), box(300, 300, 330, 310)]
+
+
+def test_compare_boxes_reports_each_change_type():
+    report = ChangeDetector().compare(EARLIER, RECENT, (400, 400))
+    assert report['mode'] == 'bbox'
+    assert (report['earlier_count'], report['recent_count'], report['matched']) == (4, 4, 3)
+    assert report['changes_count'] == {CHANGE_NEW: 1, CHANGE_DEMOLISHED: 1, CHANGE_RESIZED: 2}
+    assert report['new'] == [[300, 300, 330, 310]]
+    assert report['demolished'] == [[100, 100, 120, 120]]
+    assert sorted(report['resized']) == [[50, 0, 80, 20], [200, 0, 225, 40]]
+    kinds = sorted(change['类型'] for change in report['significant_changes'])
+    assert kinds == sorted([CHANGE_NEW, CHANGE_DEMOLISHED, CHANGE_RESIZED, CHANGE_SHRUNK])
+    # 新建 300 + 拆除 400 + 扩建 200 + 缩小 600
+    assert report['total_change_area'] == 1500
+    assert report['change_rate'] == pytest.approx(1500 / 160000 * 100)
+    assert report['change_type'] == '混合变化'
+
+
+@pytest.mark.parametrize('flag, kept', [
+    ('detect_new', {CHANGE_DEMOLISHED: 1, CHANGE_RESIZED: 2}),
+    ('detect_demolished', {CHANGE_NEW: 1, CHANGE_RESIZED: 2}),
+    ('detect_resized', {CHANGE_NEW: 1, CHANGE_DEMOLISHED: 1}),
+])
+def test_compare_boxes_respects_change_flags(flag, kept):
+    report = ChangeDetector(**{flag: False}).compare(EARLIER, RECENT, (400, 400))
+    expected = {CHANGE_NEW: 0, CHANGE_DEMOLISHED: 0, CHANGE_RESIZED: 0, **kept}
+    assert report['changes_count'] == expected
+    keys = {CHANGE_NEW: 'new', CHANGE_DEMOLISHED: 'demolished', CHANGE_RESIZED: 'resized'}
+    assert {kind: len(report[key]) for kind, key in keys.items()} == expected
+    assert len(report['significant_changes']) == sum(expected.values())
+
+
+def test_compare_boxes_single_change_type_and_empty_image():
+    detector = ChangeDetector()
+    report = detector.compare(EARLIER[:1], EARLIER[:1] + RECENT[3:], (400, 400))
+    assert report['change_type'] == '新增建筑'
+    assert report['changes_detected']['新建筑物'] == 1
+    assert detector.compare(EARLIER, [], (400, 400))['change_type'] == '拆除建筑'
+    assert detector.compare(EARLIER, EARLIER, (0, 0))['change_rate'] == 0.0
+
+
+def incremental(detector, tmp_path, earlier, recent, warm=True):
+    cache = DetectionCache('fake', cache_dir=tmp_path / 'cache')
+    if warm:
+        detector.detect_incremental(Image.fromarray(earlier), Image.fromarray(earlier), cache)
+    find_buildings.pixels = 0
+    result = detector.detect_incremental(Image.fromarray(earlier), Image.fromarray(recent), cache,
+                                         max_changed_fraction=1.0)
+    inferred_pixels = find_buildings.pixels
+    return result, find_buildings([Image.fromarray(recent)])[0][0], inferred_pixels
+
+
+def blank():
+    return np.zeros((512, 768, 3), dtype=np.uint8)
+
+
+def test_unchanged_tiles_reuse_earlier_detections(detector, tmp_path):
+    earlier = blank()
+    earlier[40:80, 40:90] = 255
+    earlier[300:340, 600:650] = 255
+    recent = earlier.copy()
+    recent[300:340, 300:340] = 255
+    result, full, inferred_pixels = incremental(detector, tmp_path, earlier, recent)
+    assert 0 < result.stats['changed_tiles'] < result.stats['tiles']
+    assert inferred_pixels < earlier.shape[0] * earlier.shape[1]
+    assert boxes(result.recent_detections) == boxes(full)
+    assert result.report['changes_detected']['新建筑物'] == 1
+
+
+@pytest.mark.parametrize('warm', [True, False])
+def test_building_reaching_into_changed_tile_is_replaced(detector, tmp_path, warm):
+    # 中心在未变化分块的建筑物延伸进发生变化（扩建）的分块
+    earlier = blank()
+    earlier[40:100, 60:300] = 255
+    recent = earlier.copy()
+    recent[40:100, 300:420] = 255
+    result, full, _ = incremental(detector, tmp_path, earlier, recent, warm=warm)
+    assert boxes(result.recent_detections) == boxes(full) == [(60.0, 40.0, 420.0, 100.0)]
+
+
+def test_new_building_across_several_tiles_is_not_split(detector, tmp_path):
+    earlier = blank()
+    recent = earlier.copy()
+    recent[300:360, 100:700] = 255
+    result, full, _ = incremental(detector, tmp_path, earlier, recent)
+    assert result.stats['changed_tiles'] >= 3
+    assert boxes(result.recent_detections) == boxes(full) == [(100.0, 300.0, 700.0, 360.0)]
+
+
+def test_random_scenes_match_full_detection(detector, tmp_path):
+    rng = np.random.default_rng(0)
+    for trial in range(10):
+        earlier, placed = blank(), []
+        while len(placed) < 12:
+            w, h = rng.integers(15, 300), rng.integers(15, 100)
+            x, y = rng.integers(0, 768 - w), rng.integers(0, 512 - h)
+            if any(x < b[2] + 4 and x + w + 4 > b[0] and y < b[3] + 4 and y + h + 4 > b[1] for b in placed):
+                continue
+            placed.append((x, y, x + w, y + h))
+            earlier[y:y + h, x:x + w] = 255
+        recent = earlier.copy()
+        for index in rng.choice(len(placed), 2, replace=False):
+            x1, y1, x2, y2 = placed[index]
+            recent[y1:y2, x1:x2] = 0
+        result, full, _ = incremental(detector, tmp_path / str(trial), earlier, recent)
+        assert boxes(result.recent_detections) == boxes(full)
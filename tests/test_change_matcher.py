@@ -0,0 +1,67 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from utils.change_matcher import candidate_pairs, iou_matrix, match_buildings
+
+
+def test_optimal_rather_than_greedy_assignment():
+    # 贪心按顺序会把近期框0分给早期框0（IoU 0.6），导致早期框1无法匹配；最优匹配两对都成立
+    earlier = [[0, 0, 10, 10], [4, 0, 14, 10]]
+    recent = [[2, 0, 12, 10], [6, 0, 16, 10]]
+    result = match_buildings(earlier, recent, iou_threshold=0.3)
+    assert sorted((i, j) for i, j, _ in result.matched) == [(0, 0), (1, 1)]
+    assert result.new == [] and result.demolished == []
+
+
+def test_new_demolished_and_resized():
+    earlier = [[0, 0, 10, 10], [100, 100, 110, 110], [50, 50, 60, 60]]
+    recent = [[0, 0, 10, 10], [50, 50, 64, 64], [200, 200, 210, 210]]
+    result = match_buildings(earlier, recent, iou_threshold=0.3, area_change_threshold=0.3)
+    assert sorted((i, j) for i, j, _ in result.matched) == [(0, 0), (2, 1)]
+    assert result.demolished == [1]
+    assert result.new == [2]
+    (i, j, _, ratio), = result.resized
+    assert (i, j) == (2, 1)
+    assert ratio > 0.9
+
+
+def test_pairs_below_threshold_do_not_match():
+    result = match_buildings([[0, 0, 10, 10]], [[8, 8, 18, 18]], iou_threshold=0.3)
+    assert result.matched == []
+    assert result.new == [0] and result.demolished == [0]
+
+
+def test_empty_inputs():
+    result = match_buildings([], [[0, 0, 1, 1]])
+    assert result.new == [0] and result.demolished == [] and result.matched == []
+    result = match_buildings(np.zeros((0, 4)), np.zeros((0, 4)))
+    assert result.matched == [] and result.new == [] and result.demolished == []
+
+
+def random_boxes(rng, count, extent=2000, max_size=60):
+    xy = rng.uniform(0, extent, (count, 2))
+    size = rng.uniform(2, max_size, (count, 2))
+    return np.hstack([xy, xy + size])
+
+
+def test_grid_candidates_match_dense_intersections():
+    rng = np.random.default_rng(0)
+    boxes_a, boxes_b = random_boxes(rng, 800), random_boxes(rng, 700)
+    dense = iou_matrix(boxes_a, boxes_b)
+    for cell_size in (None, 7.0, 500.0):
+        index_a, index_b = candidate_pairs(boxes_a, boxes_b, cell_size)
+        assert set(zip(index_a.tolist(), index_b.tolist())) == set(zip(*np.nonzero(dense > 0)))
+
+
+def test_matching_maximizes_total_iou():
+    rng = np.random.default_rng(1)
+    earlier = random_boxes(rng, 300, extent=400)
+    recent = earlier + rng.normal(0, 4, earlier.shape)
+    result = match_buildings(earlier, recent, iou_threshold=0.1)
+    assert len({i for i, _, _ in result.matched}) == len(result.matched)
+    assert len({j for _, j, _ in result.matched}) == len(result.matched)
+    # 与稠密IoU矩阵上的匈牙利算法结果一致
+    dense = iou_matrix(earlier, recent)
+    gain = np.where(dense > 0.1, dense, 0)
+    rows, cols = linear_sum_assignment(gain, maximize=True)
+    assert np.isclose(sum(iou for _, _, iou in result.matched), gain[rows, cols].sum())
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.change_series import (ChangeSeries, EVENT_DEMOLISHED, EVENT_EXISTING, EVENT_EXTENDED, EVENT_NEW,
+                                 EVENT_SHRUNK, footprints)
+from utils.detection_cache import DetectionCache
+
+
+def epoch(*boxes):
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4), np.full(len(boxes), 0.9)
+
+
+def event_types(timeline):
+    return [event['type'] for event in timeline['events']]
+
+
+@pytest.fixture
+def series():
+    return ChangeSeries(infer_batch=lambda images: [([], None) for _ in images])
+
+
+def test_link_builds_lifecycles(series):
+    epochs = [
+        epoch([0, 0, 10, 10], [50, 50, 60, 60], [100, 0, 120, 20]),
+        epoch([0, 0, 10, 10], [50, 50, 70, 60], [200, 200, 210, 210]),  # 扩建、拆除、新建
+        epoch([0, 0, 10, 10], [50, 50, 70, 60]),                        # 新建的建筑物又被拆除
+    ]
+    timelines, intervals = series.link(epochs, ['2019', '2020', '2021'])
+
+    assert [t['id'] for t in timelines] == [1, 2, 3, 4]
+    unchanged, extended, demolished, short_lived = timelines
+    assert event_types(unchanged) == [EVENT_EXISTING]
+    assert (unchanged['first_seen'], unchanged['last_seen'], unchanged['demolished_at']) == ('2019', '2021', None)
+    assert len(unchanged['footprints']) == 3
+    assert event_types(extended) == [EVENT_EXISTING, EVENT_EXTENDED]
+    assert extended['events'][1]['ratio'] == pytest.approx(1.0)
+    assert extended['footprints'][-1]['area'] == 200
+    assert event_types(demolished) == [EVENT_EXISTING, EVENT_DEMOLISHED]
+    assert (demolished['last_seen'], demolished['demolished_at']) == ('2019', '2020')
+    assert event_types(short_lived) == [EVENT_NEW, EVENT_DEMOLISHED]
+    assert (short_lived['first_seen'], short_lived['demolished_at']) == ('2020', '2021')
+
+    first, second = intervals
+    assert (first['from'], first['to'], first['buildings_before'], first['buildings_after']) == ('2019', '2020', 3, 3)
+    assert (first[EVENT_NEW], first[EVENT_DEMOLISHED], first[EVENT_EXTENDED], first[EVENT_SHRUNK]) == (1, 1, 1, 0)
+    # 新建 100 + 拆除 400 + 扩建 100
+    assert first['change_area'] == 600
+    assert (second[EVENT_NEW], second[EVENT_DEMOLISHED], second[EVENT_EXTENDED]) == (0, 1, 0)
+
+
+def test_link_handles_empty_epochs(series):
+    timelines, intervals = series.link([epoch(), epoch([0, 0, 10, 10]), epoch()], ['a', 'b', 'c'])
+    assert len(timelines) == 1
+    assert event_types(timelines[0]) == [EVENT_NEW, EVENT_DEMOLISHED]
+    assert [interval['buildings_after'] for interval in intervals] == [1, 0]
+    assert series.link([], []) == ([], [])
+
+
+def test_footprints_from_segmentation():
+    prob = np.zeros((50, 50), dtype=np.float32)
+    prob[5:15, 5:25] = 0.8
+    prob[40:42, 40:42] = 0.8  # 小于 min_area 的连通域被忽略
+    boxes, confidences = footprints([{'segmentation': prob, 'width': 100, 'height': 100}], (100, 100))
+    assert boxes.shape == (1, 4)
+    np.testing.assert_allclose(boxes[0], [10, 10, 50, 30], atol=1)
+    assert confidences[0] == pytest.approx(0.8, abs=0.05)
+
+
+def test_analyze_reuses_cached_epochs(tmp_path):
+    calls = []
+
+    def infer_batch(images):
+        calls.append(len(images))
+        # 按图片亮度生成一个大小不同的检测框，便于区分各时期
+        return [([{'bbox': [0, 0, 10 + int(np.asarray(image).mean()) // 10, 10], 'confidence': 0.9}], None)
+                for image in images]
+
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(value, value + 20, (32, 32, 3), dtype=np.uint8))
+              for value in (0, 100, 200)]
+    cache = DetectionCache('fake.pt', cache_dir=tmp_path / 'cache')
+    series = ChangeSeries(infer_batch=infer_batch, cache=cache)
+
+    first = series.analyze(images[:2], names=['a', 'b'])
+    assert calls == [2]
+    assert (first.stats['inferred'], first.stats['cached']) == (2, 0)
+
+    # 追加一个时期只需要对该时期推理，前两个时期复用缓存的检测结果
+    second = series.analyze(images, names=['a', 'b', 'c'])
+    assert calls == [2, 1]
+    assert (second.stats['inferred'], second.stats['cached']) == (1, 2)
+    assert second.detections[:2] == first.detections
+    assert second.intervals[0] == first.intervals[0]
+    assert len(second.intervals) == 2
+
+    with pytest.raises(ValueError):
+        series.analyze(images, names=['a'])
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.coregistration import Registration, estimate_transform, phase_correlation, warp_detections
+
+
+def texture(seed, size=1024):
+    rng = np.random.default_rng(seed)
+    noise = cv2.GaussianBlur(rng.random((size, size)).astype(np.float32), (0, 0), 4)
+    return cv2.normalize(noise, None, 0, 255, cv2.NORM_MINMAX)
+
+
+def translation(dx, dy):
+    return Registration(np.float64([[1, 0, dx], [0, 1, dy]]), 'phase')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_aligned_pair_with_new_buildings_stays_aligned(seed):
+    # 中心窗口内新建的高亮建筑曾让细层级残差跳到几十像素之外
+    earlier = texture(seed)
+    recent = earlier.copy()
+    rng = np.random.default_rng(100 + seed)
+    for _ in range(4):
+        x, y = rng.integers(420, 560, 2)
+        w, h = rng.integers(20, 70, 2)
+        recent[y:y + h, x:x + w] = rng.uniform(230, 255)
+    shift, response = phase_correlation(earlier, recent)
+    assert np.abs(shift).max() < 1.0
+    assert response > 0.3
+
+
+@pytest.mark.parametrize('dx, dy', [(-58, 51), (22, -45), (7, 3)])
+def test_translation_is_recovered(dx, dy):
+    big = texture(7, size=1200)
+    earlier = big[100:1124, 100:1124]
+    recent = big[100 - dy:1124 - dy, 100 - dx:1124 - dx]
+    shift, _ = phase_correlation(earlier, recent)
+    np.testing.assert_allclose(shift, [dx, dy], atol=0.5)
+
+
+def test_estimate_transform_scales_to_original_resolution():
+    # 配准在1024工作尺寸上进行，矩阵换算回2048原始分辨率后平移加倍
+    big = texture(3, size=1200)
+    earlier = np.dstack([big[100:1124, 100:1124]] * 3).astype(np.uint8)
+    recent = np.dstack([big[90:1114, 120:1144]] * 3).astype(np.uint8)
+    earlier = cv2.resize(earlier, (2048, 2048), interpolation=cv2.INTER_LINEAR)
+    recent = cv2.resize(recent, (2048, 2048), interpolation=cv2.INTER_LINEAR)
+
+    registration = estimate_transform(earlier, recent, method='phase')
+    assert registration.method == 'phase'
+    np.testing.assert_allclose(registration.matrix[:, :2], np.eye(2))
+    np.testing.assert_allclose(registration.matrix[:, 2], [-40, 20], atol=1.5)
+    np.testing.assert_allclose(registration.shift, [-40, 20], atol=1.5)
+    assert registration.to_dict()['method'] == 'phase'
+
+
+def test_estimate_transform_includes_size_difference():
+    earlier = texture(4)
+    recent = cv2.resize(earlier, (512, 512), interpolation=cv2.INTER_AREA)
+    registration = estimate_transform(earlier, recent, method='phase')
+    np.testing.assert_allclose(registration.matrix[:, :2], np.eye(2) * 0.5, atol=1e-6)
+    np.testing.assert_allclose(registration.matrix[:, 2], [0, 0], atol=1.0)
+    assert registration.shift == pytest.approx((0, 0), abs=1.0)
+
+
+def test_warp_detections_moves_and_clips_boxes():
+    detections = [
+        {'bbox': [10, 10, 30, 40], 'confidence': 0.9},
+        {'bbox': [90, 90, 99, 99]},  # 平移后部分移出影像，被裁剪
+        {'bbox': [-50, -50, -40, -40]},  # 平移后仍在影像之外，被丢弃
+    ]
+    warped = warp_detections(detections, translation(5, -3), (100, 100))
+    assert [d['bbox'] for d in warped] == [[15, 7, 35, 37], [95, 87, 100, 96]]
+    assert warped[0]['confidence'] == 0.9
+    assert warped[0]['width'] == warped[0]['height'] == 100
+    # 不修改输入
+    assert detections[0]['bbox'] == [10, 10, 30, 40]
+
+
+def test_warp_detections_resamples_segmentation():
+    # 50x50 概率图对应 100x100 的早期影像
+    prob = np.zeros((50, 50), dtype=np.float32)
+    prob[10:20, 10:20] = 1.0
+    detection = {'segmentation': prob, 'width': 100, 'height': 100}
+    warped, = warp_detections([detection], translation(10, 0), (120, 100))
+    segmentation = warped['segmentation']
+    assert segmentation.shape == (100, 120)
+    ys, xs = np.nonzero(segmentation > 0.5)
+    # 概率图中的方块对应早期影像的 [20, 40)，平移后横向落在 [30, 50)
+    assert xs.mean() == pytest.approx(39.5, abs=1.0)
+    assert ys.mean() == pytest.approx(29.5, abs=1.0)
+    assert len(xs) == pytest.approx(400, rel=0.15)
+    assert (warped['width'], warped['height']) == (120, 100)
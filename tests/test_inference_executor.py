@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from utils import inference_executor
+from utils.inference_executor import PRIORITY_INTERACTIVE, InferenceExecutor, QueueFullError
+
+
+class FakeDetector:
+    instances = []
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.active = 0
+        self.overlaps = 0
+        self.guard = threading.Lock()
+        FakeDetector.instances.append(self)
+
+    def detect_batch(self, images, conf_thres=0.5, iou_thres=0.45, preview_size=None, progress=None):
+        with self.guard:
+            self.active += 1
+            self.overlaps += self.active > 1
+        time.sleep(0.01)
+        with self.guard:
+            self.active -= 1
+        return [([{'bbox': [0, 0, image, image]}], None) for image in images]
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    FakeDetector.instances = []
+    monkeypatch.setattr(inference_executor, 'create_detector', FakeDetector)
+    executor = InferenceExecutor(max_workers=4)
+    yield executor
+    executor.shutdown()
+
+
+def test_workers_share_one_detector_per_model(executor):
+    tickets = [executor.submit(f"session-{i % 3}", 'a.pt', i) for i in range(12)]
+    tickets.append(executor.submit_batch('session-0', 'b.pt', [1, 2]))
+    results = [ticket.result(timeout=10) for ticket in tickets]
+
+    assert [detections[0]['bbox'][2] for detections, _ in results[:12]] == list(range(12))
+    assert [detections[0]['bbox'][2] for detections, _ in results[12]] == [1, 2]
+    # 每个模型只加载一次，同一模型的前向推理不会并发执行
+    assert sorted(detector.model_name for detector in FakeDetector.instances) == ['a.pt', 'b.pt']
+    assert all(detector.overlaps == 0 for detector in FakeDetector.instances)
+
+
+def test_interactive_requests_run_first_and_queue_is_bounded(monkeypatch):
+    started, release, order = threading.Event(), threading.Event(), []
+
+    class BlockingDetector(FakeDetector):
+        def detect_batch(self, images, **kwargs):
+            if images == [0]:
+                started.set()
+                release.wait(5)
+            order.extend(images)
+            return super().detect_batch(images, **kwargs)
+
+    monkeypatch.setattr(inference_executor, 'create_detector', BlockingDetector)
+    executor = InferenceExecutor(max_workers=1, max_queue_size=3)
+    executor.submit('s', 'a.pt', 0)
+    assert started.wait(5)
+    tickets = [executor.submit('s', 'a.pt', 1), executor.submit('s', 'a.pt', 2, priority=PRIORITY_INTERACTIVE)]
+    assert [ticket.position() for ticket in tickets] == [2, 1]
+    executor.submit('s', 'a.pt', 3)
+    with pytest.raises(QueueFullError):
+        executor.submit('s', 'a.pt', 4)
+    release.set()
+    executor.shutdown()
+    assert order == [0, 2, 1, 3]
@@ -0,0 +1,185 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.job_manager import JobManager, JOB_COMPLETED, TASK_DONE, TASK_QUEUED
+from utils.job_worker import JobWorker
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(tmp_path / 'jobs.db')
+
+
+def sources(count):
+    return [{'source': f'/data/{i}.jpg', 'content_hash': f'hash{i}'} for i in range(count)]
+
+
+def test_default_journal_mode_is_delete(manager):
+    conn = sqlite3.connect(manager.db_path)
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    finally:
+        conn.close()
+
+
+def test_concurrent_claims_are_exclusive(tmp_path):
+    manager = JobManager(tmp_path / 'jobs.db')
+    manager.create_job('m', sources(200))
+    claimed = {}
+
+    def work(worker_id):
+        # 每个工作线程使用独立的 JobManager（独立连接），模拟多个工作进程
+        worker_manager = JobManager(tmp_path / 'jobs.db')
+        claimed[worker_id] = []
+        while True:
+            tasks = worker_manager.claim_tasks(worker_id, limit=7)
+            if not tasks:
+                return
+            claimed[worker_id] += [task['id'] for task in tasks]
+            for task in tasks:
+                assert worker_manager.complete_task(worker_id, task['id'], {'ok': True})
+
+    threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = [task_id for ids in claimed.values() for task_id in ids]
+    assert len(all_claimed) == 200
+    assert len(set(all_claimed)) == 200
+
+
+def test_expired_lease_is_taken_over(manager):
+    job_id = manager.create_job('m', sources(2))
+    first = manager.claim_tasks('a', limit=2, lease_seconds=0.05)
+    assert len(first) == 2
+    assert manager.claim_tasks('b', limit=2) == []
+    time.sleep(0.1)
+
+    second = manager.claim_tasks('b', limit=2)
+    assert [task['id'] for task in second] == [task['id'] for task in first]
+    assert all(task['attempts'] == 2 for task in second)
+    # 原持有者的租约已失效，迟到的结果不能覆盖接管者
+    assert not manager.complete_task('a', first[0]['id'], {'from': 'a'})
+    assert manager.complete_task('b', second[0]['id'], {'from': 'b'})
+    results = list(manager.iter_results(job_id))
+    assert results[0]['from'] == 'b'
+
+
+def test_heartbeat_extends_lease(manager):
+    manager.create_job('m', sources(1))
+    task = manager.claim_tasks('a', limit=1, lease_seconds=0.2)[0]
+    for _ in range(3):
+        time.sleep(0.1)
+        assert manager.heartbeat('a', [task['id']], lease_seconds=0.2) == 1
+    assert manager.claim_tasks('b') == []
+    # 其他工作进程不能为不属于自己的任务续约
+    assert manager.heartbeat('b', [task['id']]) == 0
+
+
+def test_fail_task_requeues_until_max_attempts(manager):
+    job_id = manager.create_job('m', sources(1))
+    for attempt in range(1, 4):
+        task = manager.claim_tasks('a')[0]
+        assert task['attempts'] == attempt
+        manager.fail_task('a', task['id'], 'boom', max_attempts=3)
+    assert manager.claim_tasks('a') == []
+    status = manager.get_job_status(job_id)
+    assert status['failed'] == 1
+    assert status['status'] == JOB_COMPLETED
+
+
+def test_resume_skips_done_tasks(manager):
+    job_id = manager.create_job('m', sources(4))
+    tasks = manager.claim_tasks('a', limit=4, lease_seconds=0.05)
+    manager.complete_task('a', tasks[0]['id'], {'ok': True})
+    manager.fail_task('a', tasks[1]['id'], 'boom', max_attempts=1)
+    time.sleep(0.1)
+
+    # 重新提交同样的图片和一张新图片：已完成和已在队列中的按内容哈希跳过
+    summary = manager.resume_job(job_id, sources=sources(5))
+    assert summary == {'requeued': 1, 'skipped': 4, 'added': 1}
+
+    remaining = manager.claim_tasks('b', limit=10)
+    assert sorted(task['seq'] for task in remaining) == [1, 2, 3, 4]
+    job = manager.get_job(job_id)
+    assert job['counts'] == {TASK_DONE: 1, 'leased': 4}
+    for task in remaining:
+        manager.complete_task('b', task['id'], {'ok': True})
+    assert manager.get_job(job_id)['status'] == JOB_COMPLETED
+    assert [result['seq'] for result in manager.iter_results(job_id)] == [0, 1, 2, 3, 4]
+
+
+def test_cancelled_job_is_not_claimed(manager):
+    job_id = manager.create_job('m', sources(3))
+    assert manager.cancel_job(job_id)
+    assert manager.claim_tasks('a') == []
+    assert manager.get_job(job_id)['counts'] == {TASK_QUEUED: 3}
+
+
+class FakeDetector:
+    """按图片均值生成一个检测结果，记录每次前向推理的批大小"""
+
+    def __init__(self, model_name):
+        self.batches = []
+
+    def preprocess_image(self, image):
+        return Image.open(image).convert('RGB')
+
+    def forward_batch(self, images, conf_thres=0.5, iou_thres=0.45):
+        self.batches.append(len(images))
+        return [float(np.asarray(image).mean()) for image in images]
+
+    def postprocess(self, image, output, conf_thres=0.5):
+        return [{'label': 'building', 'confidence': 0.9, 'bbox': [0, 0, 1, 1], 'mean': output}], np.asarray(image)
+
+
+class RecordingWorker(JobWorker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saved = {}
+
+    def _on_result(self, task, image, plotted_image, reference=None):
+        self.saved[task['seq']] = (plotted_image is not None, reference)
+
+
+def test_worker_runs_tasks_through_pipeline_with_prefilter(manager, tmp_path):
+    rng = np.random.default_rng(0)
+    textures = [rng.integers(0, 255, (32, 32, 3), dtype=np.uint8) for _ in range(2)]
+    images = [textures[0], np.full((32, 32, 3), 128, dtype=np.uint8), textures[0], textures[1], textures[0]]
+    paths = []
+    for i, image in enumerate(images):
+        paths.append(tmp_path / f'{i}.png')
+        Image.fromarray(image).save(paths[-1])
+    paths.append(tmp_path / 'broken.png')
+    paths[-1].write_bytes(b'not an image')
+    job_id = manager.create_job('m', [{'source': str(p)} for p in paths],
+                                params={'prefilter': {'dedup_distance': 4}})
+
+    detectors = []
+    worker = RecordingWorker(manager, batch_size=3, max_attempts=1,
+                             detector_factory=lambda name: detectors.append(FakeDetector(name)) or detectors[-1])
+    stats = worker.run(exit_when_idle=True)
+    assert stats == {'completed': 5, 'failed': 1, 'lost': 0}
+    # 空白图片与重复图片不进入推理：第一批只推理 seq 0，第二批只推理 seq 3（seq 4 复用上一批 seq 0 的结果）
+    assert sum(detectors[0].batches) == 2
+
+    rows = {row['name']: row for row in manager.iter_results(job_id)}
+    assert rows['1.png']['skipped'] == 'blank' and rows['1.png']['detection_count'] == 0
+    # 同一批内并行解码，seq 0 与 seq 2 中先完成预筛选的一张作为参考
+    first, second = sorted(['0.png', '2.png'], key=lambda name: 'skipped' in rows[name])
+    assert 'skipped' not in rows[first] and rows[second]['skipped'] == 'duplicate'
+    assert rows['4.png']['skipped'] == 'duplicate'
+    assert rows['4.png']['detections'] == rows['2.png']['detections'] == rows['0.png']['detections']
+    assert rows['3.png']['detections'][0]['mean'] != rows['0.png']['detections'][0]['mean']
+    assert 'error' in rows['broken.png']
+    # 结果保存钩子收到参考图片的任务序号，检测失败的任务不调用
+    reference = int(first[0])
+    assert worker.saved == {reference: (True, None), int(second[0]): (False, reference), 1: (False, None),
+                            3: (True, None), 4: (False, reference)}
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.mask_change import align_probability, block_any, diff_masks
+
+
+def reference_regions(earlier_prob, recent_prob, threshold=0.5):
+    """直接在全图上计算的变化区域，用于核对粗到细的实现"""
+    earlier, recent = earlier_prob > threshold, recent_prob > threshold
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    regions = []
+    for change, pixels, other in (('added', recent & ~earlier, earlier), ('removed', earlier & ~recent, recent)):
+        near = cv2.dilate(other.astype(np.uint8), kernel) > 0
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(pixels.astype(np.uint8), connectivity=8)
+        for k in range(1, n):
+            x, y, w, h, area = (int(v) for v in stats[k])
+            regions.append((change, area, (x, y, x + w, y + h), bool(near[labels == k].any())))
+    return sorted(regions)
+
+
+def summarize(diff):
+    return sorted((r['change'], r['area'], tuple(r['bbox']), r['touches']) for r in diff.regions)
+
+
+def random_masks(seed, size=(200, 240)):
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(2):
+        prob = np.zeros(size, dtype=np.float32)
+        for _ in range(12):
+            x, y = rng.integers(0, size[1] - 10), rng.integers(0, size[0] - 10)
+            w, h = rng.integers(2, 40, 2)
+            prob[y:y + h, x:x + w] = rng.uniform(0.6, 1.0)
+        masks.append(prob)
+    # 两个时期共享一部分建筑物
+    masks[1][:100] = np.maximum(masks[1][:100], masks[0][:100])
+    return masks
+
+
+def test_block_any():
+    mask = np.zeros((10, 13), dtype=bool)
+    mask[9, 12] = True
+    coarse = block_any(mask, 4)
+    assert coarse.shape == (3, 4)
+    assert coarse.sum() == 1 and coarse[2, 3]
+
+
+def test_identical_masks_have_no_changes():
+    prob = random_masks(0)[0]
+    diff = diff_masks(prob, prob.copy())
+    assert diff.regions == []
+    assert not diff.added.any() and not diff.removed.any()
+    assert diff.added.shape == prob.shape
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('factor', [4, 8, 16])
+def test_matches_full_resolution_reference(seed, factor):
+    earlier, recent = random_masks(seed)
+    diff = diff_masks(earlier, recent, factor=factor)
+    assert summarize(diff) == reference_regions(earlier, recent)
+    np.testing.assert_array_equal(diff.added, (recent > 0.5) & ~(earlier > 0.5))
+    np.testing.assert_array_equal(diff.removed, (earlier > 0.5) & ~(recent > 0.5))
+
+
+def test_extension_touches_and_new_building_does_not():
+    earlier = np.zeros((64, 64), dtype=np.float32)
+    earlier[10:20, 10:20] = 0.9
+    earlier[40:50, 5:15] = 0.9      # 拆除
+    recent = earlier.copy()
+    recent[40:50, 5:15] = 0
+    recent[10:20, 20:26] = 0.8      # 扩建：紧贴原有建筑物
+    recent[40:60, 40:60] = 0.7      # 新建
+    diff = diff_masks(earlier, recent, factor=8)
+    regions = {(r['change'], tuple(r['bbox'])): r for r in diff.regions}
+    assert set(regions) == {('added', (20, 10, 26, 20)), ('added', (40, 40, 60, 60)), ('removed', (5, 40, 15, 50))}
+    assert regions[('added', (20, 10, 26, 20))]['touches']
+    assert not regions[('added', (40, 40, 60, 60))]['touches']
+    assert not regions[('removed', (5, 40, 15, 50))]['touches']
+    new = regions[('added', (40, 40, 60, 60))]
+    assert new['area'] == 400
+    assert new['confidence'] == pytest.approx(0.7)
+    assert new['centroid'] == pytest.approx([49.5, 49.5])
+
+
+def test_min_area_filters_small_regions():
+    earlier = np.zeros((32, 32), dtype=np.float32)
+    recent = earlier.copy()
+    recent[2:4, 2:4] = 0.9
+    recent[10:20, 10:20] = 0.9
+    assert [r['area'] for r in diff_masks(earlier, recent, min_area=5).regions] == [100]
+    # 被过滤的区域仍计入新增像素图
+    assert diff_masks(earlier, recent, min_area=5).added.sum() == 104
+
+
+def test_align_probability_resizes_and_takes_maximum():
+    low = np.full((5, 5), 0.2, dtype=np.float32)
+    high = np.zeros((10, 10), dtype=np.float32)
+    high[:5] = 0.9
+    prob = align_probability([{'bbox': [0, 0, 1, 1]}, {'segmentation': low}, {'segmentation': high}], (10, 10))
+    assert prob.shape == (10, 10)
+    assert prob[0, 0] == pytest.approx(0.9) and prob[9, 9] == pytest.approx(0.2)
+    assert align_probability([{'bbox': [0, 0, 1, 1]}], (10, 10)) is None
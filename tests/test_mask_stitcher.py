@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from utils.mask_stitcher import MaskStitcher
+
+
+@pytest.fixture
+def stitcher(tmp_path):
+    # 每块只有4行，迫使连通域跨越多个分块
+    with MaskStitcher(40, 30, work_dir=tmp_path / 'stitch', block_pixels=40 * 4) as stitcher:
+        yield stitcher
+
+
+def average(stitcher):
+    return np.vstack([prob for _, prob in stitcher.iter_blocks()])
+
+
+def test_overlapping_windows_are_averaged(stitcher):
+    stitcher.add((0, 0, 20, 20), np.full((20, 20), 0.2, dtype=np.float32))
+    stitcher.add((10, 0, 20, 20), np.full((20, 20), 0.8, dtype=np.float32))
+    prob = average(stitcher)
+    assert prob.shape == (30, 40)
+    np.testing.assert_allclose(prob[0, 5], 0.2, atol=1e-3)
+    np.testing.assert_allclose(prob[0, 15], 0.5, atol=1e-3)
+    np.testing.assert_allclose(prob[0, 25], 0.8, atol=1e-3)
+    # 未被任何窗口覆盖的像素概率为0
+    assert prob[25, 35] == 0
+
+
+def test_windows_are_resized_and_clipped(stitcher):
+    # 概率图尺寸与窗口不同时缩放；超出影像范围的部分被裁掉
+    stitcher.add((30, 20, 20, 20), np.ones((10, 10), dtype=np.float32))
+    prob = average(stitcher)
+    assert prob[20:, 30:].min() == pytest.approx(1.0)
+    assert prob[:20].max() == 0
+
+
+def test_components_merge_across_blocks(stitcher, tmp_path):
+    prob = np.zeros((30, 40), dtype=np.float32)
+    prob[2:17, 3:8] = 0.9      # 竖条跨越4个分块
+    prob[20:22, 20:22] = 0.9   # 小连通域
+    # 仅在对角方向相邻的两部分按8邻域属于同一连通域
+    prob[10:12, 30:32] = 0.9
+    prob[12:14, 32:34] = 0.9
+    stitcher.add((0, 0, 40, 30), prob)
+
+    components = stitcher.finalize(mask_path=tmp_path / 'mask.npy')
+    assert [c['area'] for c in components] == [75, 8, 4]
+    tall, diagonal, small = components
+    assert tall['bbox'] == [3, 2, 8, 17]
+    assert diagonal['bbox'] == [30, 10, 34, 14]
+    assert tall['centroid'] == pytest.approx([5.0, 9.0])
+    assert tall['confidence'] == pytest.approx(0.9, abs=1e-3)
+    mask = np.load(tmp_path / 'mask.npy')
+    np.testing.assert_array_equal(mask, (prob > stitcher.threshold).astype(np.uint8))
+
+    assert [c['area'] for c in stitcher.finalize(min_area=5)] == [75, 8]
+
+
+def test_close_removes_memmap_files(tmp_path):
+    stitcher = MaskStitcher(8, 8, work_dir=tmp_path / 'stitch')
+    stitcher.close()
+    assert list((tmp_path / 'stitch').iterdir()) == []
@@ -0,0 +1,50 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.parallel_batch import ShardedBatchRunner
+
+
+class PoisonDetector:
+    """名称中含有 poison 的图片使工作进程直接退出，模拟解码库崩溃"""
+
+    def __init__(self, model_name):
+        pass
+
+    def preprocess_image(self, image):
+        if 'poison' in os.path.basename(str(image)):
+            os._exit(1)
+        return Image.open(image).convert('RGB')
+
+    def forward_batch(self, images, conf_thres=0.5, iou_thres=0.45):
+        # 正常分块处理较慢，有毒分块崩溃时其他分块仍在处理中
+        time.sleep(0.2)
+        return [None] * len(images)
+
+    def postprocess(self, image, output, conf_thres=0.5):
+        return [], None
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(12):
+        name = 'poison.png' if i == 5 else f'{i:02d}.png'
+        Image.fromarray(np.full((8, 8, 3), i, dtype=np.uint8)).save(tmp_path / name)
+        paths.append(tmp_path / name)
+    return paths
+
+
+def test_worker_crash_only_fails_the_poison_chunk(images):
+    rows = []
+    runner = ShardedBatchRunner('m', processes=2, chunk_size=2, max_retries=1, detector_factory=PoisonDetector)
+    stats = runner.run(images, on_result=lambda stats, row: rows.append(row))
+
+    assert [row['path'] for row in rows] == [str(path) for path in images]
+    failed = [os.path.basename(row['path']) for row in rows if row.get('error')]
+    # 只有与有毒图片同一分块的图片失败，与其同时在处理中的分块不受影响
+    assert failed == ['04.png', 'poison.png']
+    assert stats['success'] == 10 and stats['failed'] == 2
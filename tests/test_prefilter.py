@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.prefilter import (PreFilter, SKIP_BLANK, SKIP_DUPLICATE, detect_with_prefilter, dhash, hamming,
+                             image_stats)
+
+
+def textured(seed, size=(128, 128)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, size + (3,), dtype=np.uint8))
+
+
+def solid(value, size=(128, 128)):
+    return Image.new('RGB', size, (value, value, value))
+
+
+def test_blank_and_nodata_images():
+    prefilter = PreFilter()
+    assert image_stats(solid(0))['nodata_ratio'] == 1.0
+    assert image_stats(solid(120))['std'] == 0.0
+    assert prefilter.check(solid(120), 'gray') == (SKIP_BLANK, None)
+    # 大部分为nodata、只有边角有内容的图片同样跳过
+    array = np.zeros((128, 128, 3), dtype=np.uint8)
+    array[:2, :2] = 200
+    assert prefilter.check(Image.fromarray(array), 'edge') == (SKIP_BLANK, None)
+    assert prefilter.check(textured(0), 'texture') == (None, None)
+    assert PreFilter(skip_blank=False).check(solid(120), 'gray') == (None, None)
+    assert prefilter.stats == {SKIP_BLANK: 2, SKIP_DUPLICATE: 0, 'checked': 3}
+
+
+def test_near_duplicates_reuse_reference():
+    prefilter = PreFilter(dedup_distance=4)
+    image = textured(1)
+    # 轻微的亮度变化和重新编码不改变感知哈希
+    brighter = Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + 3, 0, 255).astype(np.uint8))
+    assert hamming(dhash(image), dhash(brighter)) <= 4
+    assert prefilter.check(image, 'a') == (None, None)
+    assert prefilter.check(brighter, 'b') == (SKIP_DUPLICATE, 'a')
+    assert prefilter.check(textured(2), 'c') == (None, None)
+    assert prefilter.lookup('a') is None
+    prefilter.remember('a', [{'bbox': [0, 0, 5, 5], 'confidence': 0.9}])
+    result = prefilter.lookup('a')
+    assert result[0]['bbox'] == [0, 0, 5, 5]
+    result[0]['bbox'][0] = 99
+    assert prefilter.lookup('a')[0]['bbox'] == [0, 0, 5, 5]
+    # 未登记的键（如被跳过的图片）不保存结果
+    prefilter.remember('b', [])
+    assert prefilter.lookup('b') is None
+
+
+def test_negative_distance_disables_dedup():
+    prefilter = PreFilter(dedup_distance=-1)
+    assert prefilter.check(textured(1), 'a') == (None, None)
+    assert prefilter.check(textured(1), 'b') == (None, None)
+
+
+@pytest.mark.parametrize('distance', [0, 3, 8])
+def test_band_index_matches_linear_scan(distance):
+    rng = np.random.default_rng(distance)
+    prefilter = PreFilter(dedup_distance=distance)
+    values = [int(v) for v in rng.integers(0, 2 ** 63, 200, dtype=np.int64)]
+    # 在已登记的哈希上随机翻转若干位作为查询
+    for key, value in enumerate(values):
+        prefilter._register(key, value)
+    for value in values[:50]:
+        for flips in range(distance + 3):
+            query = value
+            for bit in rng.choice(64, flips, replace=False):
+                query ^= 1 << int(bit)
+            expected = [key for key, v in enumerate(values) if hamming(v, query) <= distance]
+            found = prefilter._find(query)
+            assert (found is None) == (not expected)
+            if found is not None:
+                assert found in expected
+
+
+def test_oldest_entries_are_evicted():
+    prefilter = PreFilter(max_entries=2)
+    for key in range(3):
+        assert prefilter.check(textured(key), key) == (None, None)
+        prefilter.remember(key, [])
+    assert list(prefilter._hashes) == [1, 2]
+    assert prefilter.lookup(0) is None and prefilter.lookup(2) == []
+    # 被淘汰的图片再次出现时重新检测
+    assert prefilter.check(textured(0), 'again') == (None, None)
+
+
+def test_detect_with_prefilter():
+    calls = []
+
+    def infer(images):
+        calls.append(len(images))
+        return [([{'bbox': [0, 0, 1, 1], 'confidence': 0.9}], 'plotted') for _ in images]
+
+    prefilter = PreFilter()
+    items = [('a', textured(1)), ('blank', solid(0)), ('b', textured(1)), ('c', textured(2))]
+    outcomes = detect_with_prefilter(prefilter, items, infer)
+    assert calls == [2]
+    assert [outcome[2:] for outcome in outcomes] == [(None, None), (SKIP_BLANK, None), (SKIP_DUPLICATE, 'a'),
+                                                   (None, None)]
+    assert outcomes[1][0] == [] and outcomes[2][0][0]['bbox'] == [0, 0, 1, 1]
+    assert outcomes[2][1] is None
+
+    # 后续批次中的重复图片直接复用结果，不再推理
+    assert detect_with_prefilter(prefilter, [('d', textured(2))], infer)[0][2:] == (SKIP_DUPLICATE, 'c')
+    assert calls == [2]
+    assert detect_with_prefilter(None, [('e', textured(3))], infer)[0] == (
+        [{'bbox': [0, 0, 1, 1], 'confidence': 0.9}], 'plotted', None, None)
+
+
+def test_missing_reference_result_is_detected_and_filled():
+    prefilter = PreFilter()
+    prefilter.check(textured(1), 'failed')    # 参考图片登记后检测失败，没有结果
+    outcomes = detect_with_prefilter(prefilter, [('retry', textured(1))], lambda images: [([], None)] * len(images))
+    assert outcomes[0][2] is None
+    assert prefilter.lookup('failed') == []
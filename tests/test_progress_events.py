@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from utils.progress_events import (ProgressReporter, STAGE_DECODE, STAGE_DONE, STAGE_INFER, STAGE_QUEUE,
+                                   STAGE_RENDER, ensure_reporter)
+
+
+def test_fraction_is_weighted_by_stage():
+    progress = ProgressReporter([STAGE_DECODE, STAGE_INFER, STAGE_RENDER])
+    events = []
+    progress.subscribe(events.append)
+    progress.start(STAGE_DECODE, 2)
+    progress.advance(STAGE_DECODE)
+    assert events[-1].fraction == pytest.approx(0.5 / 10)
+    progress.finish(STAGE_DECODE)
+    progress.start(STAGE_INFER, 4)
+    progress.advance(STAGE_INFER, 2)
+    event = events[-1]
+    # 解码权重1已完成，推理权重8完成一半
+    assert event.fraction == pytest.approx(5 / 10)
+    assert (event.stage, event.done, event.total, event.finished) == (STAGE_INFER, 2, 4, False)
+    assert event.describe() == '推理 2/4'
+    progress.finish(STAGE_INFER)
+    assert events[-1].fraction == pytest.approx(9 / 10)
+    assert progress.complete().fraction == 1.0
+    assert events[-1].stage == STAGE_DONE
+
+
+def test_fraction_never_decreases_and_ignores_unlisted_stages():
+    progress = ProgressReporter([STAGE_INFER, STAGE_RENDER])
+    progress.start(STAGE_INFER, 2)
+    progress.finish(STAGE_INFER)
+    high = progress.latest().fraction
+    # 同一阶段被另一个组件重新开始时，整体进度保持不变
+    assert progress.start(STAGE_INFER, 10).fraction == high
+    assert progress.start(STAGE_QUEUE).fraction == high
+    assert progress.advance(STAGE_DECODE, 5).total is None
+    progress.reset()
+    assert progress.latest() is None
+    assert progress.start(STAGE_INFER, 4).fraction == 0.0
+
+
+def test_stage_context_records_timings_and_local_subscribers():
+    progress = ProgressReporter()
+    local, shared = [], []
+    progress.subscribe(local.append, local=True)
+    progress.subscribe(shared.append)
+    worker = threading.Thread(target=lambda: progress.advance(STAGE_INFER))
+    worker.start()
+    worker.join()
+    with progress.stage(STAGE_DECODE, 3):
+        pass
+    assert [event.stage for event in shared] == [STAGE_INFER, STAGE_DECODE, STAGE_DECODE]
+    assert [event.stage for event in local] == [STAGE_DECODE, STAGE_DECODE]
+    assert local[-1].finished and local[-1].done == 3
+    assert set(progress.timings()) == {STAGE_DECODE}
+    assert progress.latest() is local[-1]
+
+
+def test_ensure_reporter():
+    progress = ProgressReporter()
+    assert ensure_reporter(progress) is progress
+    silent = ensure_reporter(None)
+    assert silent.advance(STAGE_INFER).fraction == 0.0
@@ -0,0 +1,137 @@
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.raster_source import (NpyRasterSource, PilRasterSource, RawRasterSource, TiffRasterSource, iter_windows,
+                                 open_raster)
+
+
+def raster(height=90, width=130, bands=3, dtype=np.uint8):
+    values = np.arange(height * width * bands) % 251
+    return values.reshape(height, width, bands).astype(dtype)
+
+
+def write_tiled_tiff(path, array, tile=32):
+    """写出未压缩、像素交错存储的分块TIFF（小端序），边缘分块按TIFF规范补齐到完整大小"""
+    height, width, bands = array.shape
+    across, down = -(-width // tile), -(-height // tile)
+    padded = np.zeros((down * tile, across * tile, bands), dtype=np.uint8)
+    padded[:height, :width] = array
+    tiles = [padded[r * tile:(r + 1) * tile, c * tile:(c + 1) * tile].tobytes()
+             for r in range(down) for c in range(across)]
+    count = len(tiles)
+    entries = 11
+    ifd_offset = 8
+    extra = ifd_offset + 2 + entries * 12 + 4
+    bits_offset = extra
+    offsets_offset = bits_offset + 2 * bands
+    counts_offset = offsets_offset + 4 * count
+    data_offset = counts_offset + 4 * count
+    tile_offsets = [data_offset + i * len(tiles[0]) for i in range(count)]
+    tags = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, bands, bits_offset), (259, 3, 1, 1),
+            (262, 3, 1, 2), (277, 3, 1, bands), (284, 3, 1, 1), (322, 3, 1, tile), (323, 3, 1, tile),
+            (324, 4, count, offsets_offset), (325, 4, count, counts_offset)]
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_offset))
+        f.write(struct.pack('<H', entries))
+        for tag, kind, n, value in tags:
+            f.write(struct.pack('<HHII', tag, kind, n, value))
+        f.write(struct.pack('<I', 0))
+        f.write(struct.pack(f'<{bands}H', *([8] * bands)))
+        f.write(struct.pack(f'<{count}I', *tile_offsets))
+        f.write(struct.pack(f'<{count}I', *([len(tiles[0])] * count)))
+        for data in tiles:
+            f.write(data)
+
+
+@pytest.fixture(params=['npy', 'raw', 'pil', 'strip_tiff', 'tiled_tiff'])
+def source(request, tmp_path):
+    array = raster()
+    if request.param == 'npy':
+        np.save(tmp_path / 'r.npy', array)
+        source = open_raster(tmp_path / 'r.npy')
+        assert isinstance(source, NpyRasterSource)
+    elif request.param == 'raw':
+        array.tofile(tmp_path / 'r.raw')
+        source = RawRasterSource(tmp_path / 'r.raw', width=130, height=90)
+    elif request.param == 'pil':
+        Image.fromarray(array).save(tmp_path / 'r.png')
+        source = PilRasterSource(tmp_path / 'r.png')
+    elif request.param == 'strip_tiff':
+        Image.fromarray(array).save(tmp_path / 'r.tif')
+        source = open_raster(tmp_path / 'r.tif')
+        assert isinstance(source, TiffRasterSource)
+    else:
+        write_tiled_tiff(tmp_path / 'r.tif', array)
+        source = open_raster(tmp_path / 'r.tif')
+        assert source.tiled and source.native
+    with source:
+        yield source, array
+
+
+@pytest.mark.parametrize('window', [(0, 0, 130, 90), (31, 17, 40, 50), (100, 60, 30, 30), (64, 32, 1, 1)])
+def test_window_matches_array(source, window):
+    source, array = source
+    x, y, w, h = window
+    assert (source.width, source.height) == (130, 90)
+    np.testing.assert_array_equal(source.read_window(x, y, w, h), array[y:y + h, x:x + w])
+
+
+def test_window_outside_raster_is_zero_padded(source):
+    source, array = source
+    window = source.read_window(-10, 80, 30, 20)
+    assert window.shape == (20, 30, 3)
+    np.testing.assert_array_equal(window[:10, 10:], array[80:90, 0:20])
+    assert not window[10:].any() and not window[:, :10].any()
+    assert not source.read_window(200, 200, 8, 8).any()
+
+
+@pytest.mark.parametrize('step', [2, 3, 7])
+def test_strided_window_samples_every_step(source, step):
+    source, array = source
+    window = source.read_window(-5, 3, 120, 80, step=step)
+    expected = np.zeros((-(-80 // step), -(-120 // step), 3), dtype=np.uint8)
+    rows = np.arange(3, 83, step)
+    cols = np.arange(-5, 115, step)
+    valid_rows, valid_cols = rows < 90, cols >= 0
+    expected[np.ix_(valid_rows, valid_cols)] = array[np.ix_(rows[valid_rows], cols[valid_cols])]
+    np.testing.assert_array_equal(window, expected)
+
+
+@pytest.mark.parametrize('rows_per_strip', [8, 90])
+def test_strided_tiff_decodes_each_segment_once(tmp_path, monkeypatch, rows_per_strip):
+    array = raster()
+    Image.fromarray(array).save(tmp_path / 'r.tif', tiffinfo={278: rows_per_strip})
+    with open_raster(tmp_path / 'r.tif') as source:
+        assert source.segment_height == rows_per_strip
+        decoded = []
+        segment = source._segment
+        monkeypatch.setattr(source, '_segment', lambda index: decoded.append(index) or segment(index))
+        window = source.read_window(0, 0, 130, 90, step=11)
+    np.testing.assert_array_equal(window, array[::11, ::11])
+    # 每个条带只解码一次，且只读取包含采样行的条带
+    sampled = sorted({row // rows_per_strip for row in range(0, 90, 11)})
+    assert decoded == sampled
+
+
+def test_sixteen_bit_data_is_scaled(tmp_path):
+    array = np.array([[0, 1000], [4000, 65535]], dtype=np.uint16)
+    np.save(tmp_path / 'r.npy', array)
+    with NpyRasterSource(tmp_path / 'r.npy', scale=4000) as source:
+        window = source.read_window(0, 0, 2, 2)
+    assert window.shape == (2, 2, 3)
+    np.testing.assert_array_equal(window[..., 0], [[0, 63], [255, 255]])
+
+
+def test_windows_cover_raster_with_overlap():
+    windows = list(iter_windows(1000, 700, tile_size=256, overlap=32))
+    covered = np.zeros((700, 1000), dtype=bool)
+    for x, y, w, h in windows:
+        assert x + w <= 1000 and y + h <= 700
+        covered[y:y + h, x:x + w] = True
+    assert covered.all()
+    xs = sorted({x for x, _, _, _ in windows})
+    assert all(b - a <= 256 - 32 for a, b in zip(xs, xs[1:]))
+    assert list(iter_windows(100, 50, tile_size=256)) == [(0, 0, 100, 50)]
@@ -0,0 +1,87 @@
+import functools
+import json
+
+import numpy as np
+import pytest
+
+from utils.inference_client import InferenceClient
+from utils.shm_transport import RingFullError, SharedMemoryRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedMemoryRing(n_slots=3, slot_size=4096)
+    # 测试中不等待默认的10秒超时
+    ring.acquire = functools.partial(SharedMemoryRing.acquire, ring, timeout=0.05)
+    yield ring
+    ring.unlink()
+
+
+def test_acquire_release_reuses_slots(ring):
+    slots = [ring.acquire() for _ in range(3)]
+    assert sorted(slots) == [0, 1, 2]
+    with pytest.raises(RingFullError):
+        ring.acquire()
+    ring.release(slots[1])
+    assert ring.acquire() == slots[1]
+
+
+def test_retain_keeps_slot_until_last_release(ring):
+    slot = ring.acquire()
+    ring.retain(slot)
+    ring.release(slot)
+    assert ring.refcount(slot) == 1
+    ring.release(slot)
+    assert ring.refcount(slot) == 0
+    with pytest.raises(ValueError):
+        ring.release(slot)
+
+
+def test_write_view_round_trip(ring):
+    slot = ring.acquire()
+    array = np.arange(2 * 5 * 3, dtype=np.float32).reshape(2, 5, 3)
+    ring.write(slot, array)
+    np.testing.assert_array_equal(ring.view(slot), array)
+    with pytest.raises(ValueError):
+        ring.write(slot, np.zeros(5000, dtype=np.uint8))
+
+
+def test_attached_ring_sees_written_data(ring):
+    slot = ring.acquire()
+    ring.write(slot, np.full((4, 4), 7, dtype=np.uint8))
+    attached = SharedMemoryRing(**ring.describe(), create=False)
+    try:
+        np.testing.assert_array_equal(attached.view(slot), np.full((4, 4), 7, dtype=np.uint8))
+    finally:
+        attached.close()
+
+
+def make_client(ring, request):
+    client = InferenceClient('m', 'http://localhost:1', ring=ring)
+    client._request = request
+    return client
+
+
+def test_client_releases_slots_after_request(ring):
+    def request(method, path, body=None, content_type=None):
+        # 模拟推理服务：把可视化结果写入客户端指定的回复槽位
+        ring.write(json.loads(body)['reply_slot'], np.zeros((2, 2, 3), dtype=np.uint8))
+        return {'detections': []}
+
+    client = make_client(ring, request)
+    detections, plotted = client.detect(np.zeros((4, 4, 3), dtype=np.uint8))
+    assert detections == [] and plotted.shape == (2, 2, 3)
+    assert [ring.refcount(slot) for slot in range(3)] == [0, 0, 0]
+
+
+def test_client_releases_partial_slots_when_ring_full(ring):
+    held = ring.acquire()
+
+    def request(*args, **kwargs):
+        raise AssertionError("槽位不足时不应发送请求")
+
+    client = make_client(ring, request)
+    with pytest.raises(RingFullError):
+        client.detect(np.zeros((4, 4, 3), dtype=np.uint8))
+    # 只有测试自己持有的槽位仍被占用
+    assert [ring.refcount(slot) for slot in range(3)] == [int(slot == held) for slot in range(3)]
@@ -0,0 +1,77 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.batch_io import make_zip_source
+from utils.thumbnails import ThumbnailCache, content_key, paginate
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ThumbnailCache(cache_dir=tmp_path / 'thumbs', size=64, image_format='JPEG')
+
+
+def jpeg_bytes(size=(400, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_thumbnail_is_cached_by_key(cache, tmp_path):
+    data = jpeg_bytes()
+    key = content_key(data)
+    path = cache.get(key, data)
+    assert path.suffix == '.jpg' and path.parent.parent == tmp_path / 'thumbs'
+    with Image.open(path) as thumbnail:
+        assert thumbnail.size == (64, 32)
+        assert thumbnail.getpixel((32, 16))[0] > 150
+    # 缓存命中时不再读取来源
+    mtime = path.stat().st_mtime_ns
+    assert cache.get(key, b'not an image') == path
+    assert path.stat().st_mtime_ns == mtime
+    assert not list(path.parent.glob('*.tmp'))
+    assert ThumbnailCache(cache_dir=tmp_path / 'thumbs', size=128).path_for(key) != path
+
+
+def test_thumbnail_sources(cache, tmp_path):
+    data = jpeg_bytes((100, 300))
+    (tmp_path / 'a.jpg').write_bytes(data)
+    with zipfile.ZipFile(tmp_path / 'upload.zip', 'w') as archive:
+        archive.writestr('dir/b.jpg', data)
+    upload = io.BytesIO(data)
+    upload.read()
+    sources = {'path': str(tmp_path / 'a.jpg'), 'zip': make_zip_source(tmp_path / 'upload.zip', 'dir/b.jpg'),
+               'file': upload}
+    for key, source in sources.items():
+        with Image.open(cache.get(key, source)) as thumbnail:
+            assert thumbnail.size == (21, 64)
+
+
+def test_jpeg_is_downscaled_while_decoding(cache):
+    image = Image.open(io.BytesIO(jpeg_bytes((1024, 1024))))
+    assert cache.make(image).size == (64, 64)
+    # draft 在解码前把JPEG缩小为原来的1/8
+    assert image.size == (128, 128)
+
+
+def test_save_array_converts_bgr(cache, tmp_path):
+    array = np.zeros((10, 10, 3), dtype=np.uint8)
+    array[..., 0] = 255
+    path = cache.save_array(array, tmp_path / 'viz' / 'result.jpg')
+    with Image.open(path) as thumbnail:
+        red, green, blue = thumbnail.getpixel((5, 5))
+    assert blue > 200 and red < 50
+
+
+@pytest.mark.parametrize('total, page, expected', [
+    (0, 1, (0, 0, 1)),
+    (25, 1, (0, 10, 3)),
+    (25, 3, (20, 25, 3)),
+    (25, 9, (20, 25, 3)),
+    (25, 0, (0, 10, 3)),
+])
+def test_paginate(total, page, expected):
+    assert paginate(total, page, 10) == expected
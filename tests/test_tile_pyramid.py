@@ -0,0 +1,131 @@
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.tile_pyramid import TileHTTPServer, TilePyramid, get_leaflet_url, static_file, tile_url_template
+
+
+@pytest.fixture
+def raster(tmp_path):
+    # 300x200 的灰色影像，切成64像素瓦片时最高层级为3
+    path = tmp_path / 'scene.npy'
+    np.save(path, np.full((200, 300, 3), 100, dtype=np.uint8))
+    return path
+
+
+@pytest.fixture
+def pyramid(tmp_path, raster):
+    pyramid = TilePyramid.create(tmp_path / 'scenes' / 'demo', raster, detections=[{'bbox': [10, 10, 50, 40]}],
+                                 tile_size=64, image_format='PNG')
+    yield pyramid
+    pyramid.close()
+
+
+def test_levels(pyramid):
+    assert (pyramid.width, pyramid.height, pyramid.max_zoom) == (300, 200, 3)
+    assert pyramid.level_size(3) == (5, 4)
+    assert pyramid.level_size(2) == (3, 2)
+    assert pyramid.level_size(0) == (1, 1)
+
+
+def test_tile_draws_boxes_and_clips_to_raster(pyramid):
+    tile = np.asarray(pyramid.render_tile(3, 0, 0))
+    assert tile.shape == (64, 64, 4)
+    assert tuple(tile[10, 30]) == (255, 0, 0, 255)      # 检测框上边
+    assert tuple(tile[20, 30]) == (100, 100, 100, 255)  # 检测框内部保持底图
+    # 最右侧一列瓦片只有 300 - 256 = 44 像素在影像范围内，其余透明
+    edge = np.asarray(pyramid.render_tile(3, 4, 0))
+    assert edge[0, 43, 3] == 255 and edge[0, 44, 3] == 0
+    # 第0层整幅影像缩小8倍
+    overview = np.asarray(pyramid.render_tile(0, 0, 0))
+    assert overview[24, 37, 3] == 255 and overview[25, 38, 3] == 0
+
+
+def test_mask_overlay(tmp_path, raster):
+    mask = np.zeros((200, 300), dtype=np.uint8)
+    mask[100:150, 100:150] = 1
+    np.save(tmp_path / 'mask.npy', mask)
+    pyramid = TilePyramid.create(tmp_path / 'masked', raster, mask_path=tmp_path / 'mask.npy', tile_size=64,
+                                 image_format='PNG')
+    tile = np.asarray(pyramid.render_tile(3, 1, 1))
+    assert tuple(tile[40, 40, :3]) == (162, 60, 60)     # 100 * 0.6 + 255 * 0.4
+    assert tuple(tile[10, 10, :3]) == (100, 100, 100)
+    pyramid.close()
+
+
+def test_tiles_are_cached_and_bounded(pyramid):
+    path = pyramid.get_tile(3, 1, 1)
+    assert path == pyramid.tile_path(3, 1, 1) and path.exists()
+    mtime = path.stat().st_mtime_ns
+    assert pyramid.get_tile(3, 1, 1).stat().st_mtime_ns == mtime
+    assert Image.open(path).size == (64, 64)
+    assert pyramid.get_tile(4, 0, 0) is None
+    assert pyramid.get_tile(3, 5, 0) is None
+    assert pyramid.get_tile(-1, 0, 0) is None
+
+
+def test_precompute_stops_at_max_tiles(pyramid):
+    # 第0-2层分别为1、2、6个瓦片，第3层20个瓦片超过上限
+    assert pyramid.precompute(max_tiles=10) == 9
+    assert not pyramid.tile_path(3, 0, 0).exists()
+
+
+def test_rebuild_clears_tiles_and_changes_version(tmp_path, raster, pyramid):
+    pyramid.get_tile(0, 0, 0)
+    rebuilt = TilePyramid.create(pyramid.scene_dir, raster, tile_size=64, image_format='PNG')
+    assert not rebuilt.tile_path(0, 0, 0).exists()
+    assert rebuilt.meta['version'] != pyramid.meta['version']
+    assert len(rebuilt.boxes) == 0
+    rebuilt.close()
+
+
+def test_viewer_uses_configured_leaflet(pyramid, monkeypatch, tmp_path):
+    template = tile_url_template(pyramid, base_url='http://tiles:8601')
+    assert template.startswith('http://tiles:8601/tiles/demo/{z}/{x}/{y}.png?v=')
+    html = pyramid.viewer_html(template, leaflet_url='http://intranet/leaflet')
+    assert 'http://intranet/leaflet/leaflet.js' in html and 'unpkg.com' not in html
+
+    monkeypatch.setenv('BUILDING_LEAFLET_URL', 'http://intranet/leaflet/')
+    assert get_leaflet_url('http://tiles:8601') == 'http://intranet/leaflet'
+    monkeypatch.delenv('BUILDING_LEAFLET_URL')
+    monkeypatch.setattr('utils.tile_pyramid.LEAFLET_DIR', tmp_path / 'missing')
+    assert 'unpkg.com' in get_leaflet_url('http://tiles:8601')
+    (tmp_path / 'leaflet').mkdir()
+    (tmp_path / 'leaflet' / 'leaflet.js').write_text('// leaflet')
+    monkeypatch.setattr('utils.tile_pyramid.LEAFLET_DIR', tmp_path / 'leaflet')
+    assert get_leaflet_url('http://tiles:8601') == 'http://tiles:8601/static/leaflet'
+
+
+def test_static_file_stays_inside_leaflet_dir(tmp_path):
+    root = tmp_path / 'leaflet'
+    (root / 'images').mkdir(parents=True)
+    (root / 'leaflet.js').write_text('// leaflet')
+    (root / 'images' / 'layers.png').write_bytes(b'png')
+    (tmp_path / 'secret.js').write_text('secret')
+    assert static_file(['static', 'leaflet', 'leaflet.js'], root) == (root / 'leaflet.js').resolve()
+    assert static_file(['static', 'leaflet', 'images', 'layers.png'], root) is not None
+    assert static_file(['static', 'leaflet', '..', 'secret.js'], root) is None
+    assert static_file(['static', 'leaflet', 'missing.js'], root) is None
+    assert static_file(['static', 'other', 'leaflet.js'], root) is None
+
+
+def test_server_serves_tiles(pyramid):
+    server = TileHTTPServer(('127.0.0.1', 0), scene_root=pyramid.scene_dir.parent)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/tiles/demo/0/0/0.png") as response:
+            assert response.headers['Content-Type'] == 'image/png'
+            assert response.read().startswith(b'\x89PNG')
+        for path in ('/tiles/demo/9/0/0.png', '/tiles/../0/0/0.png', '/tiles/missing/0/0/0.png', '/static/leaflet/x.js'):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(base + path)
+            assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.video_detector import VideoDetector, prefetch_frames
+
+
+def wait_for_threads(count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while threading.active_count() > count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return threading.active_count()
+
+
+def test_prefetch_preserves_order_and_raises_reader_errors():
+    def frames():
+        yield from range(5)
+        raise IOError("decode failed")
+
+    received = []
+    with pytest.raises(IOError, match="decode failed"):
+        for frame in prefetch_frames(frames(), size=2):
+            received.append(frame)
+    assert received == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('length', [2, 100])
+def test_closing_prefetch_stops_reader(length):
+    # length=2 时读取线程在队列已满的情况下写入结束标记
+    before = threading.active_count()
+    frames = prefetch_frames(iter(range(length)), size=1)
+    next(frames)
+    time.sleep(0.3)
+    frames.close()
+    assert wait_for_threads(before) == before
+
+
+def scene(rng, width):
+    world = cv2.GaussianBlur(rng.normal(80, 25, (600, 900, 3)).clip(0, 255).astype(np.uint8), (5, 5), 0)
+    for _ in range(6):
+        x, y = rng.integers(0, 800), rng.integers(0, 500)
+        world[y:y + 50, x:x + 70] = 230
+    return [world[i * 4:i * 4 + 400, :width].copy() for i in range(6)]
+
+
+def find_buildings(images):
+    results = []
+    for image in images:
+        mask = (np.asarray(image).min(axis=2) > 200).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        results.append(([{'label': 'building', 'confidence': 0.9,
+                          'bbox': [float(x), float(y), float(x + w), float(y + h)]}
+                         for x, y, w, h, area in stats[1:count] if area > 300], None))
+    return results
+
+
+def test_scene_cut_ends_previous_tracks():
+    rng = np.random.default_rng(3)
+    # 第二个镜头的画面尺寸不同，必然判定为场景切换
+    images = scene(rng, 600) + scene(rng, 640)
+    frames = [(index, index / 25, image) for index, image in enumerate(images)]
+    detector = VideoDetector(infer_batch=find_buildings, keyframe_interval=3, min_hits=1)
+    results = [result for result, _ in detector.track(iter(frames))]
+
+    cut = next(result.index for result in results if result.reason == 'scene')
+    assert cut == 6
+    before = {box['track_id'] for result in results[:cut] for box in result.boxes}
+    after = {box['track_id'] for result in results[cut:] for box in result.boxes}
+    assert before and after
+    assert not before & after
+    assert detector.stats['scene_cuts'] == 1
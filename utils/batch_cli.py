@@ -0,0 +1,138 @@
+"""命令行批量检测
+
+    python -m utils.batch_cli data/tiles --model build_V8n.pt --conf 0.5 --iou 0.8 --output results.jsonl
+    python -m utils.batch_cli "data/**/*.png" --output results.parquet
+    python -m utils.batch_cli tiles.zip --output results.jsonl
+    python -m utils.batch_cli data/tiles --processes 16 --threads-per-process 4 --baseline-images 64
+"""
+import argparse
+import itertools
+from pathlib import Path
+
+import cv2
+
+from utils.batch_pipeline import BatchPipeline
+from utils.batch_io import iter_image_paths, make_result_row, update_batch_stats, open_result_writer, open_source
+
+# 与 ModelDetector 加载模型时使用的目录一致（不在此导入 model_detector，列出模型时不必加载torch）
+MODEL_DIR = Path(__file__).parent.parent / 'model'
+
+
+def list_models():
+    return sorted(f.name for f in list(MODEL_DIR.glob('*.pt')) + list(MODEL_DIR.glob('*.pth')))
+
+
+def run_batch(detector, paths, writer, conf_thres=0.5, iou_thres=0.8, batch_size=4, prefetch=8,
+              decode_workers=4, postprocess_workers=2, save_dir=None, on_result=None, prefilter=None):
+    """通过流水线逐张检测并把结果增量写出，返回汇总统计和各阶段利用率"""
+    if save_dir:
+        save_dir = Path(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+
+    def save_visualization(item):
+        # 在后处理线程中保存可视化结果，避免阻塞推理；不同目录中的同名图片以输入序号区分，序号与结果文件的行号一致
+        if save_dir and item.error is None and item.plotted_image is not None:
+            cv2.imwrite(str(save_dir / f"{item.index:06d}_{Path(item.name).stem}_result.jpg"), item.plotted_image)
+        item.plotted_image = None
+
+    pipeline = BatchPipeline(detector, conf_thres=conf_thres, iou_thres=iou_thres, batch_size=batch_size,
+                             decode_workers=decode_workers, postprocess_workers=postprocess_workers,
+                             queue_size=prefetch, load_image=lambda source: detector.preprocess_image(open_source(source)),
+                             on_result=save_visualization, prefilter=prefilter)
+    stats = {'total': 0, 'success': 0, 'failed': 0, 'with_buildings': 0}
+    for item in pipeline.run((str(path), path) for path in paths):
+        row = make_result_row(item.name, item.detections, sum(item.timings.values()), item.error,
+                              skipped=item.extra.get('skipped'))
+        update_batch_stats(stats, row)
+        writer.write(row)
+        if on_result is not None:
+            on_result(stats, row)
+    stats['elapsed'] = pipeline.elapsed
+    stats['images_per_second'] = stats['total'] / stats['elapsed'] if stats['elapsed'] > 0 else 0
+    stats['utilization'] = pipeline.utilization()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量建筑物检测：遍历目录或glob模式，结果增量写出为JSONL/Parquet")
+    parser.add_argument('inputs', nargs='*', help="图片目录、glob模式、ZIP压缩包或图片文件")
+    parser.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    parser.add_argument('--list-models', action='store_true', help="列出可用模型后退出")
+    parser.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    parser.add_argument('--iou', type=float, default=0.8, help="IOU阈值")
+    parser.add_argument('--output', '-o', default='batch_results.jsonl', help="结果文件路径")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help="输出格式，默认根据扩展名判断")
+    parser.add_argument('--append', action='store_true', help="追加到已有的JSONL文件")
+    parser.add_argument('--batch-size', type=int, default=4, help="单次前向推理的最大图片数")
+    parser.add_argument('--prefetch', type=int, default=8, help="流水线各阶段队列长度（预先解码的最大图片数）")
+    parser.add_argument('--decode-workers', type=int, default=4, help="解码线程数")
+    parser.add_argument('--postprocess-workers', type=int, default=2, help="后处理线程数")
+    parser.add_argument('--save-viz', help="保存检测可视化结果的目录")
+    parser.add_argument('--prefilter', action='store_true',
+                        help="检测前预筛选：空白/nodata图片直接判定为无建筑物，近似重复图片复用已有结果")
+    parser.add_argument('--dedup-distance', type=int, default=4, help="近似重复判定的感知哈希汉明距离，小于0时不去重")
+    parser.add_argument('--blank-std', type=float, default=2.0, help="灰度标准差低于该值的图片视为空白")
+    parser.add_argument('--processes', type=int, default=1, help="工作进程数，大于1时按分块分发到多个进程")
+    parser.add_argument('--threads-per-process', type=int, default=1, help="每个工作进程的torch计算线程数")
+    parser.add_argument('--chunk-size', type=int, default=16, help="多进程模式下每个分块的图片数")
+    parser.add_argument('--baseline-images', type=int, default=0,
+                        help="多进程模式下先用单进程检测前N张图片作为基准，用于计算扩展效率")
+    args = parser.parse_args(argv)
+
+    if args.list_models:
+        print('\n'.join(list_models()))
+        return
+    if not args.inputs:
+        parser.error("请指定至少一个输入目录、glob模式或图片文件")
+    if args.model not in list_models():
+        parser.error(f"未找到模型 {args.model}，可用模型: {', '.join(list_models()) or '无'}")
+
+    writer = open_result_writer(args.output, args.format, append=args.append)
+
+    def report(stats, row):
+        if stats['total'] % 100 == 0:
+            print(f"已处理 {stats['total']} 张，成功 {stats['success']}，失败 {stats['failed']}")
+
+    prefilter_params = ({'dedup_distance': args.dedup_distance, 'blank_std': args.blank_std}
+                        if args.prefilter else None)
+    scaling = None
+    if args.processes > 1:
+        if args.save_viz:
+            print("多进程模式不保存可视化结果，已忽略 --save-viz")
+        from utils.parallel_batch import ShardedBatchRunner, scaling_report
+        runner = ShardedBatchRunner(args.model, processes=args.processes,
+                                    threads_per_process=args.threads_per_process, chunk_size=args.chunk_size,
+                                    batch_size=args.batch_size, conf_thres=args.conf, iou_thres=args.iou,
+                                    prefilter_params=prefilter_params)
+        baseline = None
+        if args.baseline_images > 0:
+            sample = list(itertools.islice(iter_image_paths(args.inputs), args.baseline_images))
+            baseline = runner.measure_baseline(sample)
+            print(f"单进程基准: {baseline:.2f} 张/秒")
+        with writer:
+            stats = runner.run(iter_image_paths(args.inputs), writer, on_result=report)
+        scaling = scaling_report(stats, baseline, args.processes)
+    else:
+        from utils.model_detector import ModelDetector
+        from utils.prefilter import PreFilter
+        detector = ModelDetector(args.model)
+        with writer:
+            stats = run_batch(detector, iter_image_paths(args.inputs), writer, args.conf, args.iou,
+                              args.batch_size, args.prefetch, args.decode_workers, args.postprocess_workers,
+                              args.save_viz, on_result=report, prefilter=PreFilter.from_params(prefilter_params))
+    print(f"批量检测完成：共 {stats['total']} 张，成功 {stats['success']}，失败 {stats['failed']}，"
+          f"检测到建筑物 {stats['with_buildings']} 张，耗时 {stats['elapsed']:.1f}秒 "
+          f"({stats['images_per_second']:.2f} 张/秒)，结果已写入 {args.output}")
+    if 'utilization' in stats:
+        print("各阶段利用率: " + ", ".join(f"{name} {value:.0%}" for name, value in stats['utilization'].items()))
+    if args.prefilter:
+        print(f"预筛选跳过推理：空白 {stats.get('skipped_blank', 0)} 张，近似重复 {stats.get('skipped_duplicate', 0)} 张")
+    if stats.get('retried_chunks'):
+        print(f"因工作进程异常退出重试的分块数: {stats['retried_chunks']}")
+    if scaling:
+        print(f"相对单进程基准：加速比 {scaling['speedup']:.2f}x，扩展效率 {scaling['efficiency']:.0%}"
+              f"（{args.processes} 个进程）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+
+# 与批量检测页面的上传控件保持一致
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# ZIP压缩包中的图片以 zip://<压缩包路径>!<条目名> 表示，读取时才解压对应条目
+ZIP_SCHEME = 'zip://'
+
+# 每个线程持有自己的ZipFile句柄，避免并发读取同一文件对象，也避免每个条目重复解析中央目录
+_zip_local = threading.local()
+
+
+def make_zip_source(archive, entry):
+    return f"{ZIP_SCHEME}{archive}!{entry}"
+
+
+def is_zip_source(source):
+    return str(source).startswith(ZIP_SCHEME)
+
+
+def parse_zip_source(source):
+    """拆分为 (压缩包路径, 条目名)"""
+    rest = str(source)[len(ZIP_SCHEME):]
+    split = rest.lower().find('.zip!') + len('.zip')
+    if split < len('.zip'):
+        raise ValueError(f"无效的ZIP条目: {source}")
+    return rest[:split], rest[split + 1:]
+
+
+def _is_image_entry(info, extensions):
+    name = info.filename
+    if info.is_dir() or not name.lower().endswith(extensions):
+        return False
+    # 跳过macOS打包时生成的元数据和隐藏文件
+    return not name.startswith('__MACOSX/') and not Path(name).name.startswith('.')
+
+
+def iter_zip_members(archive, extensions=IMAGE_EXTENSIONS):
+    """逐个返回ZIP压缩包（路径或文件对象）中图片条目的ZipInfo，只读取中央目录，不解压任何条目"""
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if _is_image_entry(info, extensions):
+                yield info
+
+
+def iter_zip_entries(archive, extensions=IMAGE_EXTENSIONS):
+    """逐个返回ZIP压缩包中图片条目的来源字符串"""
+    for info in iter_zip_members(archive, extensions):
+        yield make_zip_source(archive, info.filename)
+
+
+def _get_zip(archive):
+    archives = getattr(_zip_local, 'archives', None)
+    if archives is None:
+        archives = _zip_local.archives = {}
+    if archive not in archives:
+        archives[archive] = zipfile.ZipFile(archive)
+    return archives[archive]
+
+
+def open_source(source):
+    """返回可直接交给 ModelDetector.preprocess_image 的对象：ZIP条目只解压该条目到内存，普通文件返回路径"""
+    if is_zip_source(source):
+        archive, entry = parse_zip_source(source)
+        return io.BytesIO(_get_zip(archive).read(entry))
+    return source
+
+
+def load_image(source):
+    return Image.open(open_source(source)).convert('RGB')
+
+
+def absolute_source(source):
+    """转换为绝对路径，供共享文件系统上的其他机器读取"""
+    if is_zip_source(source):
+        archive, entry = parse_zip_source(source)
+        return make_zip_source(os.path.abspath(archive), entry)
+    return os.path.abspath(source)
+
+
+def source_fingerprint(source):
+    """不读取图片内容的快速指纹，用于恢复作业时跳过已完成的图片
+
+    ZIP条目使用压缩包中记录的CRC32和大小，按内容匹配。普通文件（服务器目录）只使用路径、大小和修改时间：
+    文件被修改或重新拷贝后按新图片重新检测，但保留修改时间替换内容（例如 cp -p、rsync -t）且大小不变时会被当作已完成跳过。
+    """
+    if is_zip_source(source):
+        archive, entry = parse_zip_source(source)
+        info = _get_zip(archive).getinfo(entry)
+        return f"crc32:{info.CRC:08x}-{info.file_size}"
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return f"stat:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+
+def iter_image_paths(inputs, extensions=IMAGE_EXTENSIONS):
+    """逐个返回目录（递归）、glob模式、ZIP压缩包或单个文件中的图片路径，不预先收集完整列表"""
+    for item in inputs:
+        if os.path.isfile(item) and str(item).lower().endswith('.zip'):
+            yield from iter_zip_entries(str(item), extensions)
+        elif os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(extensions):
+                        yield Path(root) / name
+        elif glob.has_magic(str(item)):
+            for path in glob.iglob(str(item), recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(extensions):
+                    yield Path(path)
+        elif os.path.isfile(item):
+            yield Path(item)
+        else:
+            raise FileNotFoundError(f"输入路径不存在: {item}")
+
+
+def summarize_detections(detections):
+    """汇总单张图片的检测结果：目标数量、最高置信度及其类别"""
+    if not detections:
+        return {'detection_count': 0, 'confidence': 0, 'building_type': '未检测到建筑物'}
+    best_detection = max(detections, key=lambda x: x['confidence'])
+    return {
+        'detection_count': len(detections),
+        'confidence': best_detection['confidence'],
+        'building_type': best_detection['label']
+    }
+
+
+def compact_detections(detections):
+    """去掉分割概率图等大字段，便于逐行写出"""
+    return [{k: v for k, v in detection.items() if k != 'segmentation'} for detection in detections]
+
+
+def make_result_row(path, detections=None, process_time=None, error=None, skipped=None):
+    """生成写入结果文件的一行记录；skipped 为预筛选跳过推理的原因（空白或重复）"""
+    row = {'path': str(path)}
+    if error is not None:
+        row['error'] = str(error)
+        return row
+    row.update(summarize_detections(detections))
+    row['process_time'] = round(process_time or 0, 4)
+    row['detections'] = compact_detections(detections)
+    if skipped:
+        row['skipped'] = skipped
+    return row
+
+
+def update_batch_stats(stats, row):
+    """根据一行结果累加批量检测统计"""
+    stats['total'] += 1
+    if 'error' in row:
+        stats['failed'] += 1
+    else:
+        stats['success'] += 1
+        stats['with_buildings'] += int(row['detection_count'] > 0)
+        if row.get('skipped'):
+            key = f"skipped_{row['skipped']}"
+            stats[key] = stats.get(key, 0) + 1
+
+
+class JsonlResultWriter:
+    """每条结果写一行JSON并立即刷新，进程中断时已完成的结果不会丢失"""
+
+    def __init__(self, path, append=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetResultWriter:
+    """按行组增量写出Parquet文件，内存中最多缓存 row_group_size 条结果"""
+
+    COLUMNS = ('path', 'detection_count', 'confidence', 'building_type', 'process_time', 'error', 'skipped',
+               'detections')
+
+    def __init__(self, path, row_group_size=1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("写出Parquet需要安装pyarrow: pip install pyarrow")
+        self._pa = pa
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ('path', pa.string()),
+            ('detection_count', pa.int32()),
+            ('confidence', pa.float64()),
+            ('building_type', pa.string()),
+            ('process_time', pa.float64()),
+            ('error', pa.string()),
+            ('skipped', pa.string()),
+            ('detections', pa.string())
+        ])
+        self._writer = pq.ParquetWriter(str(self.path), self.schema)
+        self._rows = []
+
+    def write(self, row):
+        row = dict(row)
+        row['detections'] = json.dumps(row.get('detections', []), ensure_ascii=False)
+        self._rows.append({column: row.get(column) for column in self.COLUMNS})
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+            self._writer.write_table(table)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_result_writer(path, output_format=None, append=False):
+    """根据格式或文件扩展名创建结果写出器；append 仅对JSONL有效"""
+    output_format = output_format or ('parquet' if str(path).lower().endswith('.parquet') else 'jsonl')
+    if output_format == 'parquet':
+        return ParquetResultWriter(path)
+    if output_format == 'jsonl':
+        return JsonlResultWriter(path, append=append)
+    raise ValueError(f"不支持的输出格式: {output_format}")
@@ -0,0 +1,326 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+from utils.progress_events import ensure_reporter, STAGE_DECODE, STAGE_INFER, STAGE_POSTPROCESS
+
+logger = logging.getLogger(__name__)
+
+_SENTINEL = object()
+
+
+@dataclass
+class PipelineItem:
+    """在各阶段之间传递的单张图片"""
+    index: int
+    name: str
+    source: object
+    image: object = None
+    output: object = None
+    detections: list = None
+    plotted_image: object = None
+    error: Exception = None
+    extra: dict = field(default_factory=dict)
+    timings: dict = field(default_factory=dict)
+
+
+class StageStats:
+    """记录单个阶段的忙碌时间，用于计算利用率"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.busy = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self._lock:
+            self.busy += seconds
+            self.items += items
+
+    def utilization(self, elapsed):
+        return self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+
+
+class BatchPipeline:
+    """生产者/消费者批量检测流水线
+
+    解码线程池 -> 凑批阶段 -> 单线程推理 -> 后处理线程池，阶段之间通过有界队列连接，
+    解码、推理与可视化可以相互重叠。传入 detector 时推理阶段调用 forward_batch、
+    后处理阶段调用 postprocess；也可以用 infer_batch(images) 直接返回 (detections, plotted_image) 列表，
+    例如通过进程级推理执行器排队执行。
+    """
+
+    def __init__(self, detector=None, conf_thres=0.5, iou_thres=0.45, batch_size=4, decode_workers=4,
+                 postprocess_workers=2, queue_size=16, max_batch_wait=0.05, infer_batch=None,
+                 load_image=None, on_result=None, prefilter=None, progress=None):
+        if detector is None and infer_batch is None:
+            raise ValueError("必须提供detector或infer_batch")
+        self.detector = detector
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.postprocess_workers = postprocess_workers
+        self.queue_size = queue_size
+        self.max_batch_wait = max_batch_wait
+        self.infer_batch = infer_batch
+        self.load_image = load_image or (detector.preprocess_image if detector is not None else None)
+        if self.load_image is None:
+            raise ValueError("未提供detector时必须提供load_image")
+        # on_result(item) 在后处理线程中执行，用于缩略图、结果统计等簿记工作
+        self.on_result = on_result
+        # 预筛选在解码线程中执行，空白图片和近似重复图片不进入推理阶段
+        self.prefilter = prefilter
+        # ProgressReporter：每张图片完成解码、推理、后处理时在对应阶段发布进度事件
+        self.progress = ensure_reporter(progress)
+        self.stages = {}
+        self.elapsed = 0.0
+
+    def _put(self, q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, stop, timeout=0.1):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=timeout)
+            except queue.Empty:
+                continue
+        return _SENTINEL
+
+    def _feed(self, items, input_queue, stop, slots, errors):
+        try:
+            for index, (name, source) in enumerate(items):
+                # 限制流水线中同时存在的图片数量，包括等待按序输出的结果
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if not self._put(input_queue, PipelineItem(index, name, source), stop):
+                    return
+        except Exception as e:
+            # 已送入流水线的图片照常处理完，由 run() 在各阶段结束后重新抛出
+            logger.error(f"读取输入失败: {str(e)}")
+            errors.append(e)
+        finally:
+            for _ in range(self.decode_workers):
+                self._put(input_queue, _SENTINEL, stop)
+
+    def _decode(self, input_queue, decoded_queue, stop):
+        stats = self.stages['decode']
+        while True:
+            item = self._get(input_queue, stop)
+            if item is _SENTINEL:
+                self._put(decoded_queue, _SENTINEL, stop)
+                return
+            start = time.perf_counter()
+            try:
+                item.image = self.load_image(item.source)
+                if self.prefilter is not None:
+                    action, reference = self.prefilter.check(item.image, item.index)
+                    if action is not None:
+                        item.extra['skipped'] = action
+                        item.extra['duplicate_of'] = reference
+                        item.detections = []
+            except Exception as e:
+                item.error = e
+            item.source = None
+            item.timings['decode'] = time.perf_counter() - start
+            stats.add(item.timings['decode'])
+            self.progress.advance(STAGE_DECODE)
+            if not self._put(decoded_queue, item, stop):
+                return
+
+    def _batch(self, decoded_queue, batch_queue, stop):
+        stats = self.stages['batch']
+        finished = 0
+        batch = []
+        deadline = None
+        while finished < self.decode_workers:
+            timeout = 0.1 if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = decoded_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if stop.is_set():
+                return
+            start = time.perf_counter()
+            if item is _SENTINEL:
+                finished += 1
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_batch_wait
+            if batch and (len(batch) >= self.batch_size or finished == self.decode_workers
+                          or time.monotonic() >= deadline):
+                if not self._put(batch_queue, batch, stop):
+                    return
+                batch, deadline = [], None
+            stats.add(time.perf_counter() - start, 0)
+        self._put(batch_queue, _SENTINEL, stop)
+
+    def _infer(self, batch_queue, post_queue, stop):
+        stats = self.stages['infer']
+        while True:
+            batch = self._get(batch_queue, stop)
+            if batch is _SENTINEL:
+                break
+            valid = [item for item in batch if item.error is None and 'skipped' not in item.extra]
+            start = time.perf_counter()
+            try:
+                if valid:
+                    images = [item.image for item in valid]
+                    if self.infer_batch is not None:
+                        for item, (detections, plotted_image) in zip(valid, self.infer_batch(images)):
+                            item.detections, item.plotted_image = detections, plotted_image
+                    else:
+                        outputs = self.detector.forward_batch(images, conf_thres=self.conf_thres, iou_thres=self.iou_thres)
+                        for item, output in zip(valid, outputs):
+                            item.output = output
+            except Exception as e:
+                logger.error(f"批量推理失败: {str(e)}")
+                for item in valid:
+                    item.error = e
+            elapsed = time.perf_counter() - start
+            stats.add(elapsed, len(valid))
+            self.progress.advance(STAGE_INFER, len(batch))
+            for item in batch:
+                item.timings['infer'] = elapsed / max(len(valid), 1)
+                item.extra['batch_size'] = len(valid)
+                if not self._put(post_queue, item, stop):
+                    return
+        for _ in range(self.postprocess_workers):
+            self._put(post_queue, _SENTINEL, stop)
+
+    def _postprocess(self, post_queue, output_queue, stop):
+        stats = self.stages['postprocess']
+        while True:
+            item = self._get(post_queue, stop)
+            if item is _SENTINEL:
+                self._put(output_queue, _SENTINEL, stop)
+                return
+            start = time.perf_counter()
+            try:
+                if item.error is None and item.output is not None:
+                    item.detections, item.plotted_image = self.detector.postprocess(
+                        item.image, item.output, conf_thres=self.conf_thres)
+                    item.output = None
+                if self.on_result is not None:
+                    self.on_result(item)
+            except Exception as e:
+                item.error = e
+            item.timings['postprocess'] = time.perf_counter() - start
+            stats.add(item.timings['postprocess'])
+            self.progress.advance(STAGE_POSTPROCESS)
+            if not self._put(output_queue, item, stop):
+                return
+
+    def run(self, items, on_idle=None, idle_interval=0.2, total=None):
+        """items 为 (name, source) 的可迭代对象，按输入顺序逐个返回处理完成的 PipelineItem
+
+        on_idle() 在等待结果期间于调用线程中周期性执行，可用于刷新界面状态。
+        total 为图片总数（未知时为None），用于计算进度事件中的完成比例。
+        读取 items 时出现的异常在已读取的图片全部输出后重新抛出，调用方不会把截断的结果当作完整结果。
+        """
+        self.stages = {
+            'decode': StageStats('decode', self.decode_workers),
+            'batch': StageStats('batch', 1),
+            'infer': StageStats('infer', 1),
+            'postprocess': StageStats('postprocess', self.postprocess_workers),
+        }
+        stop = threading.Event()
+        slots = threading.BoundedSemaphore(self.queue_size * 2)
+        input_queue = queue.Queue(self.queue_size)
+        decoded_queue = queue.Queue(self.queue_size)
+        batch_queue = queue.Queue(2)
+        post_queue = queue.Queue(self.queue_size)
+        output_queue = queue.Queue(self.queue_size)
+        feed_errors = []
+
+        threads = [threading.Thread(target=self._feed, args=(items, input_queue, stop, slots, feed_errors),
+                                    daemon=True)]
+        threads += [threading.Thread(target=self._decode, args=(input_queue, decoded_queue, stop), daemon=True)
+                    for _ in range(self.decode_workers)]
+        threads.append(threading.Thread(target=self._batch, args=(decoded_queue, batch_queue, stop), daemon=True))
+        threads.append(threading.Thread(target=self._infer, args=(batch_queue, post_queue, stop), daemon=True))
+        threads += [threading.Thread(target=self._postprocess, args=(post_queue, output_queue, stop), daemon=True)
+                    for _ in range(self.postprocess_workers)]
+
+        for stage in (STAGE_DECODE, STAGE_INFER, STAGE_POSTPROCESS):
+            self.progress.start(stage, total)
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            pending = {}
+            next_index = 0
+            while finished < self.postprocess_workers:
+                try:
+                    item = output_queue.get(timeout=idle_interval)
+                except queue.Empty:
+                    if on_idle is not None:
+                        on_idle()
+                    continue
+                if item is _SENTINEL:
+                    finished += 1
+                    continue
+                pending[item.index] = item
+                if self.prefilter is not None and item.error is None and 'skipped' not in item.extra:
+                    self.prefilter.remember(item.index, item.detections)
+                while next_index in pending:
+                    if not self._resolve_duplicate(pending[next_index], pending):
+                        # 参考图片尚未完成，按序输出需要等待
+                        break
+                    ready = pending.pop(next_index)
+                    ready.image = None
+                    next_index += 1
+                    slots.release()
+                    self.elapsed = time.perf_counter() - start
+                    yield ready
+            if feed_errors:
+                raise feed_errors[0]
+            for stage in (STAGE_DECODE, STAGE_INFER, STAGE_POSTPROCESS):
+                self.progress.finish(stage)
+        finally:
+            stop.set()
+            self.elapsed = time.perf_counter() - start
+
+    def _resolve_duplicate(self, item, pending):
+        """为近似重复的图片复用参考图片的检测结果，参考图片尚未完成时返回False"""
+        reference = item.extra.get('duplicate_of')
+        if reference is None or item.error is not None:
+            return True
+        detections = self.prefilter.lookup(reference)
+        if detections is not None:
+            item.detections = detections
+            return True
+        reference_item = pending.get(reference)
+        if reference_item is not None and reference_item.error is not None:
+            item.error = RuntimeError(f"参考图片检测失败: {str(reference_item.error)}")
+            return True
+        if reference_item is None and reference < item.index:
+            # 参考图片已输出但结果不可用（检测失败或已被淘汰）
+            item.error = RuntimeError("参考图片的检测结果不可用")
+            return True
+        return False
+
+    def utilization(self):
+        """各阶段利用率：忙碌时间 / (总耗时 × 该阶段线程数)"""
+        return {name: round(stage.utilization(self.elapsed), 3) for name, stage in self.stages.items()}
+
+    def stats(self):
+        return {
+            'elapsed': self.elapsed,
+            'stages': {name: {'workers': stage.workers, 'busy': round(stage.busy, 3), 'items': stage.items,
+                              'utilization': round(stage.utilization(self.elapsed), 3)}
+                       for name, stage in self.stages.items()}
+        }
@@ -0,0 +1,722 @@
+"""建筑物变化检测引擎
+
+    python -m utils.change_detector data/2020 data/2024 --model build_V8n.pt --output changes.jsonl
+    python -m utils.change_detector before/ after/ --match-iou 0.3 --save-viz changes_viz/
+"""
+import argparse
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.batch_io import iter_image_paths, open_source, load_image, compact_detections, JsonlResultWriter
+from utils.batch_pipeline import BatchPipeline
+from utils.change_matcher import match_buildings
+from utils.coregistration import estimate_transform, prepare_image, warp_detections
+from utils.mask_change import align_probability, diff_masks
+from utils.mask_stitcher import MASK_THRESHOLD
+from utils.progress_events import (ensure_reporter, STAGE_COMPARE, STAGE_DECODE, STAGE_PERSIST, STAGE_REGISTER,
+                                   STAGE_RENDER)
+
+# 变化类型，与变化检测页面和历史记录中使用的名称一致
+CHANGE_NEW = '新建筑物'
+CHANGE_DEMOLISHED = '拆除建筑物'
+CHANGE_RESIZED = '建筑物扩建'
+CHANGE_SHRUNK = '建筑物缩小'
+
+# 可视化颜色（RGB）：新增绿色实线，拆除红色虚线，扩建/缩小黄色虚线
+COLOR_NEW = (0, 255, 0)
+COLOR_DEMOLISHED = (255, 0, 0)
+COLOR_RESIZED = (255, 255, 0)
+# 增量检测中沿用的建筑物（没有模型可视化结果时自行绘制）
+COLOR_BUILDING = (0, 131, 184)
+
+
+def to_buildings(detections):
+    """把检测结果转换为带面积和中心点的建筑物列表，没有检测框的结果被忽略"""
+    buildings = []
+    for det in detections:
+        if 'bbox' in det:
+            bbox = det['bbox']
+            buildings.append({
+                'bbox': bbox,
+                'area': (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]),
+                'center': ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2),
+                'confidence': det.get('confidence', 0.0)
+            })
+    return buildings
+
+
+def classify_change_type(changes_count):
+    """根据各类变化的数量确定主要变化类型"""
+    new, demolished, resized = (changes_count[CHANGE_NEW], changes_count[CHANGE_DEMOLISHED],
+                                changes_count[CHANGE_RESIZED])
+    if new > 0 and demolished == 0 and resized == 0:
+        return "新增建筑"
+    if demolished > 0 and new == 0 and resized == 0:
+        return "拆除建筑"
+    if resized > 0 and new == 0 and demolished == 0:
+        return "建筑扩建"
+    return "混合变化"
+
+
+def _position(center):
+    return f"坐标({int(center[0])}, {int(center[1])})"
+
+
+def _area_change(kind, center, area, confidence):
+    return {
+        "类型": kind,
+        "位置": _position(center),
+        "面积": f"约 {int(area)} 平方像素",
+        "置信度": f"{confidence:.2f}"
+    }
+
+
+def draw_dashed_box(image, bbox, color, thickness=2, dash=5, gap=10):
+    x1, y1, x2, y2 = map(int, bbox)
+    for j in range(0, x2 - x1, gap):
+        cv2.line(image, (x1 + j, y1), (min(x1 + j + dash, x2), y1), color, thickness)
+        cv2.line(image, (x1 + j, y2), (min(x1 + j + dash, x2), y2), color, thickness)
+    for j in range(0, y2 - y1, gap):
+        cv2.line(image, (x1, y1 + j), (x1, min(y1 + j + dash, y2)), color, thickness)
+        cv2.line(image, (x2, y1 + j), (x2, min(y1 + j + dash, y2)), color, thickness)
+
+
+def tile_differences(earlier_image, recent_image, tile_size=256, scale=4, pixel_threshold=1.0):
+    """两个时期同尺寸影像逐块的差异分数，返回 (块行数, 块列数) 数组
+
+    灰度图按 scale 倍缩小（同时平滑传感器噪声）后各自标准化，消除两次拍摄的整体亮度和对比度差异；
+    绝对差超过 pixel_threshold 个标准差的像素视为变化，分数为块内变化像素的比例。
+    """
+    width, height = recent_image.size
+
+    def normalized(image):
+        gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+        small = cv2.resize(gray, (max(1, width // scale), max(1, height // scale)),
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+        return (small - small.mean()) / max(float(small.std()), 1.0)
+
+    changed = np.abs(normalized(earlier_image) - normalized(recent_image)) > pixel_threshold
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    cell = max(1, tile_size // scale)
+    changed = changed[:rows * cell, :cols * cell]
+    sums = np.zeros((rows * cell, cols * cell), dtype=np.float32)
+    counts = np.zeros_like(sums)
+    sums[:changed.shape[0], :changed.shape[1]] = changed
+    counts[:changed.shape[0], :changed.shape[1]] = 1
+    sums = sums.reshape(rows, cell, cols, cell).sum(axis=(1, 3))
+    counts = counts.reshape(rows, cell, cols, cell).sum(axis=(1, 3))
+    return sums / np.maximum(counts, 1)
+
+
+def draw_detections(image, detections):
+    """在RGB影像上绘制检测框或分割轮廓，用于没有模型可视化结果的增量检测"""
+    plotted_image = np.array(image)
+    for detection in detections:
+        if 'bbox' in detection:
+            x1, y1, x2, y2 = map(int, detection['bbox'])
+            cv2.rectangle(plotted_image, (x1, y1), (x2, y2), COLOR_BUILDING, 2)
+            cv2.putText(plotted_image, f"building {detection.get('confidence', 0):.2f}", (x1, max(y1 - 4, 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, COLOR_BUILDING, 1)
+        elif 'segmentation' in detection:
+            mask = (np.asarray(detection['segmentation']).squeeze() > MASK_THRESHOLD).astype(np.uint8)
+            if mask.shape != plotted_image.shape[:2]:
+                mask = cv2.resize(mask, plotted_image.shape[1::-1], interpolation=cv2.INTER_NEAREST)
+            contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(plotted_image, contours, -1, COLOR_DEMOLISHED, 2)
+    return plotted_image
+
+
+def _image_size(image):
+    """PIL图片、数组、prepare_image 的结果或 (宽, 高) 的原始尺寸"""
+    if isinstance(image, Image.Image):
+        return image.size
+    if isinstance(image, tuple):
+        return image[1] if isinstance(image[0], np.ndarray) else image
+    return image.shape[1], image.shape[0]
+
+
+def _intersects(bbox, region):
+    return bbox[0] < region[2] and bbox[2] > region[0] and bbox[1] < region[3] and bbox[3] > region[1]
+
+
+def _box_area(bbox):
+    return max(bbox[2] - bbox[0], 0) * max(bbox[3] - bbox[1], 0)
+
+
+def _overlap(a, b):
+    """交集面积占较小框面积的比例，被裁剪边界截断的框与完整框之间也接近1"""
+    inter = _box_area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+    smaller = min(_box_area(a), _box_area(b))
+    return inter / smaller if smaller > 0 else 0.0
+
+
+def _truncated_edges(bbox, crop, size, tolerance=1.0):
+    """检测框贴住的裁剪边界（影像自身的边界除外），贴住边界的框可能只是建筑物的一部分"""
+    width, height = size
+    edges = set()
+    if crop[0] > 0 and bbox[0] <= crop[0] + tolerance:
+        edges.add('left')
+    if crop[1] > 0 and bbox[1] <= crop[1] + tolerance:
+        edges.add('top')
+    if crop[2] < width and bbox[2] >= crop[2] - tolerance:
+        edges.add('right')
+    if crop[3] < height and bbox[3] >= crop[3] - tolerance:
+        edges.add('bottom')
+    return edges
+
+
+def _span_overlap(a1, a2, b1, b2):
+    smaller = min(a2 - a1, b2 - b1)
+    return (min(a2, b2) - max(a1, b1)) / smaller if smaller > 0 else 0.0
+
+
+def _join_fragments(fragments):
+    """合并不同裁剪区域中被截断的同一建筑物：fragments 为 (检测结果, 截断的边) 列表
+
+    两个框相交、至少一个在相应方向上被截断，且另一方向上的范围基本一致时合并为外接框。
+    """
+    fragments = list(fragments)
+    i = 0
+    while i < len(fragments):
+        merged = False
+        for j in range(i + 1, len(fragments)):
+            (a, edges_a), (b, edges_b) = fragments[i], fragments[j]
+            box_a, box_b = a['bbox'], b['bbox']
+            if not _intersects(box_a, box_b):
+                continue
+            edges = edges_a | edges_b
+            horizontal = edges & {'left', 'right'} and _span_overlap(box_a[1], box_a[3], box_b[1], box_b[3]) > 0.5
+            vertical = edges & {'top', 'bottom'} and _span_overlap(box_a[0], box_a[2], box_b[0], box_b[2]) > 0.5
+            if horizontal or vertical:
+                bbox = [min(box_a[0], box_b[0]), min(box_a[1], box_b[1]),
+                        max(box_a[2], box_b[2]), max(box_a[3], box_b[3])]
+                confidence = max(a.get('confidence', 0.0), b.get('confidence', 0.0))
+                fragments[i] = ({**a, 'bbox': bbox, 'confidence': confidence}, edges)
+                del fragments[j]
+                merged = True
+                break
+        if not merged:
+            i += 1
+    return [detection for detection, _ in fragments]
+
+
+@dataclass
+class ChangeResult:
+    """一对影像的变化检测结果：report 为可序列化的变化报告，其余为检测结果和可视化图像"""
+    report: dict
+    earlier_detections: list = field(default_factory=list)
+    recent_detections: list = field(default_factory=list)
+    earlier_viz: object = None
+    recent_viz: object = None
+    change_viz: object = None
+    name: str = None
+    error: Exception = None
+    # 增量检测的统计：缓存命中、分块数量、重新检测的分块数量等
+    stats: dict = field(default_factory=dict)
+
+
+class ChangeDetector:
+    """比较两个时期的检测结果，生成结构化的变化报告
+
+    既可以直接比较已有的检测结果（compare），也可以对影像对执行检测后比较（detect / detect_pairs）。
+    传入 detector 时直接调用模型，传入 infer_batch(images) 时通过进程级推理执行器等外部推理。
+    """
+
+    def __init__(self, detector=None, conf_thres=0.5, iou_thres=0.45, match_iou=0.3, area_change_threshold=0.3,
+                 detect_new=True, detect_demolished=True, detect_resized=True, min_change_area=20, infer_batch=None,
+                 coregister=False, registration_method='auto'):
+        self.detector = detector
+        self.infer_batch = infer_batch
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        # 匹配同一建筑物的IoU阈值，值越低对变化越不敏感
+        self.match_iou = match_iou
+        self.area_change_threshold = area_change_threshold
+        self.detect_new = detect_new
+        self.detect_demolished = detect_demolished
+        self.detect_resized = detect_resized
+        # 分割模型按像素比较掩码时忽略面积小于该值的变化区域（边缘抖动产生的零散像素）
+        self.min_change_area = min_change_area
+        # 比较前估计两个时期影像之间的平移/相似变换，把早期检测结果变换到近期影像坐标
+        self.coregister = coregister
+        self.registration_method = registration_method
+
+    def compare(self, earlier_detections, recent_detections, image_size, return_diff=False):
+        """比较两个时期的检测结果，image_size 为 (宽, 高)，用于计算变化率
+
+        两个时期都是分割结果时按像素比较掩码（mode 为 'mask'），否则按检测框匹配（mode 为 'bbox'）。
+        return_diff 为True时同时返回掩码差分 MaskDiff（检测框模式为None），用于绘制像素级变化。
+        """
+        width, height = image_size
+        earlier_prob = align_probability(earlier_detections, image_size)
+        recent_prob = align_probability(recent_detections, image_size) if earlier_prob is not None else None
+        if recent_prob is not None:
+            diff = diff_masks(earlier_prob, recent_prob, min_area=self.min_change_area)
+            report = self._compare_masks(diff)
+        else:
+            diff = None
+            report = self._compare_boxes(earlier_detections, recent_detections)
+
+        changes_count = report['changes_count']
+        total_change_area = report['total_change_area']
+        change_rate = min(100.0, total_change_area / (width * height) * 100) if width and height else 0.0
+        report.update({
+            'image_size': [width, height],
+            'change_type': classify_change_type(changes_count),
+            'change_rate': change_rate,
+            'changes_detected': {
+                "新建筑物": changes_count[CHANGE_NEW],
+                "拆除建筑物": changes_count[CHANGE_DEMOLISHED],
+                "扩建区域": changes_count[CHANGE_RESIZED],
+                "总变化面积": f"约 {int(total_change_area)} 平方像素",
+                "变化率": f"{change_rate:.1f}%"
+            },
+        })
+        return (report, diff) if return_diff else report
+
+    def _compare_boxes(self, earlier_detections, recent_detections):
+        earlier_buildings = to_buildings(earlier_detections)
+        recent_buildings = to_buildings(recent_detections)
+        match = match_buildings([b['bbox'] for b in earlier_buildings], [b['bbox'] for b in recent_buildings],
+                                iou_threshold=self.match_iou, area_change_threshold=self.area_change_threshold)
+
+        changes_count = {CHANGE_NEW: 0, CHANGE_DEMOLISHED: 0, CHANGE_RESIZED: 0}
+        significant_changes = []
+        total_change_area = 0
+
+        # 匹配的建筑物中面积变化超过阈值的视为扩建或缩小
+        resized = match.resized if self.detect_resized else []
+        for i, j, _, ratio in resized:
+            earlier_building, recent_building = earlier_buildings[i], recent_buildings[j]
+            total_change_area += abs(recent_building['area'] - earlier_building['area'])
+            changes_count[CHANGE_RESIZED] += 1
+            significant_changes.append({
+                "类型": CHANGE_RESIZED if ratio > 0 else CHANGE_SHRUNK,
+                "位置": _position(recent_building['center']),
+                "面积变化": f"从 {int(earlier_building['area'])} 变化到 {int(recent_building['area'])} 平方像素",
+                "变化比例": f"{int(abs(ratio) * 100)}%"
+            })
+        # 没有匹配到早期建筑物的近期建筑物为新建筑
+        new = match.new if self.detect_new else []
+        for j in new:
+            building = recent_buildings[j]
+            total_change_area += building['area']
+            changes_count[CHANGE_NEW] += 1
+            significant_changes.append(_area_change(CHANGE_NEW, building['center'], building['area'],
+                                                    building['confidence']))
+        # 没有匹配到近期建筑物的早期建筑物为拆除建筑
+        demolished = match.demolished if self.detect_demolished else []
+        for i in demolished:
+            building = earlier_buildings[i]
+            total_change_area += building['area']
+            changes_count[CHANGE_DEMOLISHED] += 1
+            significant_changes.append(_area_change(CHANGE_DEMOLISHED, building['center'], building['area'],
+                                                    building['confidence']))
+
+        return {
+            'mode': 'bbox',
+            'earlier_count': len(earlier_buildings),
+            'recent_count': len(recent_buildings),
+            'changes_count': changes_count,
+            'total_change_area': total_change_area,
+            'significant_changes': significant_changes,
+            # 各类变化建筑物的检测框，用于绘制可视化结果
+            'new': [recent_buildings[j]['bbox'] for j in new],
+            'demolished': [earlier_buildings[i]['bbox'] for i in demolished],
+            'resized': [recent_buildings[j]['bbox'] for _, j, _, _ in resized],
+            'matched': len(match.matched),
+        }
+
+    def _compare_masks(self, diff):
+        """由掩码差分的变化区域生成报告：与另一时期建筑物相邻的新增/消失区域为扩建/缩小，其余为新建/拆除"""
+        changes_count = {CHANGE_NEW: 0, CHANGE_DEMOLISHED: 0, CHANGE_RESIZED: 0}
+        significant_changes = []
+        boxes = {'new': [], 'demolished': [], 'resized': []}
+        total_change_area = 0
+        for region in diff.regions:
+            added = region['change'] == 'added'
+            if region['touches']:
+                if not self.detect_resized:
+                    continue
+                kind, key = CHANGE_RESIZED, 'resized'
+                significant_changes.append({
+                    "类型": CHANGE_RESIZED if added else CHANGE_SHRUNK,
+                    "位置": _position(region['centroid']),
+                    "面积变化": f"{'增加' if added else '减少'} {region['area']} 平方像素"
+                })
+            else:
+                if not (self.detect_new if added else self.detect_demolished):
+                    continue
+                kind, key = (CHANGE_NEW, 'new') if added else (CHANGE_DEMOLISHED, 'demolished')
+                significant_changes.append(_area_change(kind, region['centroid'], region['area'],
+                                                        region['confidence']))
+            changes_count[kind] += 1
+            total_change_area += region['area']
+            boxes[key].append(region['bbox'])
+        return {
+            'mode': 'mask',
+            'added_area': int(diff.added.sum()),
+            'removed_area': int(diff.removed.sum()),
+            'changes_count': changes_count,
+            'total_change_area': total_change_area,
+            'significant_changes': significant_changes,
+            **boxes,
+        }
+
+    def visualize(self, report, image, bgr=False, diff=None):
+        """在影像（通常是近期影像的检测结果图）上绘制变化：新增实线、拆除和扩建虚线，返回新数组
+
+        bgr 为True时按BGR通道顺序绘制，用于 cv2.imwrite 直接写出。传入掩码差分 diff 时
+        先把新增像素涂成绿色、消失像素涂成红色。掩码模式的变化区域位于统一尺寸下，影像尺寸不同时按比例缩放。
+        """
+        def color(rgb):
+            return rgb[::-1] if bgr else rgb
+
+        change_viz = np.array(image).copy()
+        height, width = change_viz.shape[:2]
+        scale_x = scale_y = 1.0
+        if report.get('mode') == 'mask':
+            report_width, report_height = report['image_size']
+            scale_x, scale_y = width / max(report_width, 1), height / max(report_height, 1)
+        if diff is not None:
+            for pixels, rgb in ((diff.added, COLOR_NEW), (diff.removed, COLOR_DEMOLISHED)):
+                if pixels.shape != (height, width):
+                    pixels = cv2.resize(pixels.view(np.uint8), (width, height),
+                                        interpolation=cv2.INTER_NEAREST).view(bool)
+                change_viz[pixels] = (change_viz[pixels] * 0.5 + np.array(color(rgb)) * 0.5).astype(change_viz.dtype)
+
+        def scaled(bbox):
+            x1, y1, x2, y2 = bbox
+            return [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+
+        for bbox in report['demolished']:
+            draw_dashed_box(change_viz, scaled(bbox), color(COLOR_DEMOLISHED))
+        for bbox in report['new']:
+            x1, y1, x2, y2 = map(int, scaled(bbox))
+            cv2.rectangle(change_viz, (x1, y1), (x2, y2), color(COLOR_NEW), 3)
+        for bbox in report['resized']:
+            draw_dashed_box(change_viz, scaled(bbox), color(COLOR_RESIZED))
+        return change_viz
+
+    def compare_epochs(self, earlier_detections, recent_detections, earlier_image, recent_image, progress=None):
+        """比较一对影像的检测结果，返回 (report, diff)
+
+        earlier_image / recent_image 为解码后的影像或 coregistration.prepare_image 的结果。启用配准时早期检测结果
+        变换到近期影像坐标后再比较，变化率按近期影像尺寸计算，报告中的 registration 包含变换矩阵和配准耗时；
+        否则按两幅影像中较大的尺寸计算。
+        """
+        progress = ensure_reporter(progress)
+        earlier_size, recent_size = _image_size(earlier_image), _image_size(recent_image)
+        if not self.coregister:
+            image_size = (max(earlier_size[0], recent_size[0]), max(earlier_size[1], recent_size[1]))
+            with progress.stage(STAGE_COMPARE):
+                return self.compare(earlier_detections, recent_detections, image_size, return_diff=True)
+        with progress.stage(STAGE_REGISTER):
+            registration = estimate_transform(earlier_image, recent_image, method=self.registration_method)
+            earlier_detections = warp_detections(earlier_detections, registration, recent_size)
+        with progress.stage(STAGE_COMPARE):
+            report, diff = self.compare(earlier_detections, recent_detections, recent_size, return_diff=True)
+        report['registration'] = registration.to_dict()
+        return report, diff
+
+    def _infer(self, images, progress=None):
+        # infer_batch 由调用方提供，推理阶段的进度由调用方自行发布（例如随请求提交给推理执行器）
+        if self.infer_batch is not None:
+            return self.infer_batch(images)
+        return self.detector.detect_batch(images, conf_thres=self.conf_thres, iou_thres=self.iou_thres,
+                                          progress=progress)
+
+    def _load_images(self, images, progress):
+        with progress.stage(STAGE_DECODE, len(images)):
+            loaded = []
+            for image in images:
+                loaded.append(self._load_image(image))
+                progress.advance(STAGE_DECODE)
+        return loaded
+
+    def _change_result(self, report, earlier, recent, diff, progress, stats=None):
+        (earlier_detections, earlier_viz), (recent_detections, recent_viz) = earlier, recent
+        with progress.stage(STAGE_RENDER):
+            change_viz = self.visualize(report, recent_viz, diff=diff) if recent_viz is not None else None
+        return ChangeResult(report, earlier_detections, recent_detections, earlier_viz, recent_viz, change_viz,
+                            stats=stats or {})
+
+    def detect(self, earlier_image, recent_image, progress=None):
+        """检测一对影像（PIL图片、文件路径或文件对象）并比较
+
+        两个时期在同一次批量推理中完成；传入已解码的RGB图片时直接使用，调用方可以继续用它们显示和保存。
+        progress 为 ProgressReporter 时依次发布解码、推理、配准、变化分析和绘制结果阶段的进度事件。
+        """
+        progress = ensure_reporter(progress)
+        earlier_image, recent_image = self._load_images([earlier_image, recent_image], progress)
+        earlier, recent = self._infer([earlier_image, recent_image], progress)
+        report, diff = self.compare_epochs(earlier[0], recent[0], earlier_image, recent_image, progress)
+        return self._change_result(report, earlier, recent, diff, progress)
+
+    def detect_incremental(self, earlier_image, recent_image, cache, tile_size=256, diff_threshold=0.005,
+                           max_changed_fraction=0.5, margin=32, progress=None):
+        """重复调查的增量变化检测
+
+        早期影像的检测结果从 DetectionCache 中复用；近期影像与早期影像尺寸相同时逐块比较像素差异，
+        只对变化像素比例超过 diff_threshold 的分块（向外扩展 margin 像素作为上下文，并覆盖与该分块相交的早期建筑物）
+        重新推理，其余分块沿用早期的检测结果。变化分块超过 max_changed_fraction 或尺寸不同时对近期影像整体推理。
+        需要推理的早期影像和近期影像在同一次批量推理中完成；变化分块的裁剪范围依赖早期检测结果，
+        早期影像未缓存时先单独推理。两个时期的结果都写入缓存。
+        """
+        progress = ensure_reporter(progress)
+        earlier_image, recent_image = self._load_images([earlier_image, recent_image], progress)
+        earlier_key, recent_key = cache.key(earlier_image), cache.key(recent_image)
+        earlier, recent = cache.get(earlier_key), cache.get(recent_key)
+        width, height = recent_image.size
+        stats = {'earlier_cached': earlier is not None, 'recent_cached': recent is not None,
+                 'tiles': 0, 'changed_tiles': 0, 'full_recent': False}
+
+        earlier_inferred = earlier is None
+        changed = []
+        if recent is None:
+            stats['full_recent'] = earlier_image.size != recent_image.size
+            if not stats['full_recent']:
+                scores = tile_differences(earlier_image, recent_image, tile_size)
+                changed = [tuple(cell) for cell in np.argwhere(scores > diff_threshold).tolist()]
+                stats['tiles'], stats['changed_tiles'] = int(scores.size), len(changed)
+                stats['full_recent'] = len(changed) > max_changed_fraction * scores.size
+        tiled = recent is None and not stats['full_recent']
+        if earlier is None and tiled and changed:
+            earlier = self._infer([earlier_image], progress)[0]
+
+        images = [earlier_image] if earlier is None else []
+        tiles = []
+        if recent is None:
+            if stats['full_recent']:
+                images.append(recent_image)
+            elif changed:
+                tiles = self._changed_tiles(changed, earlier[0], tile_size, margin, (width, height))
+                images += [recent_image.crop(crop) for _, _, crop in tiles]
+
+        outputs = iter(self._infer(images, progress) if images else [])
+        with progress.stage(STAGE_PERSIST, earlier_inferred + (recent is None)):
+            if earlier_inferred:
+                if earlier is None:
+                    earlier = next(outputs)
+                cache.put(earlier_key, *earlier)
+                progress.advance(STAGE_PERSIST)
+            if recent is None:
+                if stats['full_recent']:
+                    recent = next(outputs)
+                else:
+                    recent = self._merge_tiles(earlier[0], recent_image, tiles, list(outputs))
+                cache.put(recent_key, *recent)
+                progress.advance(STAGE_PERSIST)
+
+        report, diff = self.compare_epochs(earlier[0], recent[0], earlier_image, recent_image, progress)
+        report['incremental'] = stats
+        return self._change_result(report, earlier, recent, diff, progress, stats=stats)
+
+    @staticmethod
+    def _changed_tiles(changed, earlier_detections, tile_size, margin, size):
+        """变化分块的 (分块, 核心区域, 裁剪区域)
+
+        与核心区域相交的早期建筑物会被新的检测结果替换，裁剪区域除向外扩展 margin 外还要完整覆盖这些建筑物，
+        避免跨越分块边界的建筑物在重新检测时被截断。
+        """
+        width, height = size
+        boxes = [d['bbox'] for d in earlier_detections if 'bbox' in d]
+        tiles = []
+        for row, col in changed:
+            core = (col * tile_size, row * tile_size,
+                    min((col + 1) * tile_size, width), min((row + 1) * tile_size, height))
+            crop = [core[0] - margin, core[1] - margin, core[2] + margin, core[3] + margin]
+            for bbox in boxes:
+                if _intersects(bbox, core):
+                    crop = [min(crop[0], bbox[0]), min(crop[1], bbox[1]), max(crop[2], bbox[2]), max(crop[3], bbox[3])]
+            crop = (max(int(np.floor(crop[0])), 0), max(int(np.floor(crop[1])), 0),
+                    min(int(np.ceil(crop[2])), width), min(int(np.ceil(crop[3])), height))
+            tiles.append(((row, col), core, crop))
+        return tiles
+
+    def _merge_tiles(self, earlier_detections, recent_image, tiles, outputs):
+        """用变化分块的检测结果替换早期检测结果中的对应区域，返回近期影像的 (detections, plotted_image)"""
+        width, height = recent_image.size
+        earlier_prob = align_probability(earlier_detections, (width, height))
+        if earlier_prob is not None:
+            # 分割模型：在早期概率图上覆盖变化分块的概率
+            prob = np.array(earlier_prob, dtype=np.float32)
+            for (_, core, crop), (detections, _) in zip(tiles, outputs):
+                tile_prob = align_probability(detections, (crop[2] - crop[0], crop[3] - crop[1]))
+                if tile_prob is not None:
+                    prob[core[1]:core[3], core[0]:core[2]] = \
+                        tile_prob[core[1] - crop[1]:core[3] - crop[1], core[0] - crop[0]:core[2] - crop[0]]
+            detections = [{
+                'label': 'building',
+                'class': 'building',
+                'confidence': float(prob.mean()),
+                'segmentation': prob,
+                'width': width,
+                'height': height
+            }]
+            return detections, draw_detections(recent_image, detections)
+
+        # 检测模型：与任一变化分块核心区域相交的早期建筑物都可能已经变化，由变化分块的新检测结果替换
+        cores = [core for _, core, _ in tiles]
+        candidates = []
+        for (_, core, crop), (tile_detections, _) in zip(tiles, outputs):
+            for detection in tile_detections:
+                if 'bbox' not in detection:
+                    continue
+                x1, y1, x2, y2 = detection['bbox']
+                bbox = [x1 + crop[0], y1 + crop[1], x2 + crop[0], y2 + crop[1]]
+                # 只在上下文区域中出现的建筑物属于未变化的分块，沿用早期结果
+                if _intersects(bbox, core):
+                    candidates.append(({**detection, 'bbox': bbox, 'width': width, 'height': height},
+                                       _truncated_edges(bbox, crop, (width, height))))
+        # 相邻变化分块的裁剪区域互相重叠，同一建筑物可能被检测多次：先合并被裁剪边界截断的部分，
+        # 再对重复的框保留面积最大的一个
+        recent = []
+        for detection in sorted(_join_fragments(candidates), key=lambda d: _box_area(d['bbox']), reverse=True):
+            if all(_overlap(detection['bbox'], kept['bbox']) <= 0.5 for kept in recent):
+                recent.append(detection)
+        # 扩建到变化分块中的建筑物，其早期框可能与变化分块不相交，同样由新的检测结果替换
+        detections = [dict(d) for d in earlier_detections if 'bbox' in d
+                      and not any(_intersects(d['bbox'], core) for core in cores)
+                      and all(_overlap(d['bbox'], new['bbox']) <= 0.5 for new in recent)]
+        return detections + recent, draw_detections(recent_image, detections + recent)
+
+    def detect_pairs(self, pairs, batch_size=4, decode_workers=4, prefetch=8, keep_images=True, bgr=False,
+                     on_idle=None, progress=None):
+        """批量处理影像对：pairs 为 (名称, 早期影像来源, 近期影像来源) 的可迭代对象
+
+        两个时期的影像依次进入 BatchPipeline，解码、凑批推理和后处理重叠执行，按输入顺序逐对返回 ChangeResult。
+        keep_images 为False时不保留可视化图像，只返回报告和检测结果；bgr 含义同 visualize。
+        progress 为 ProgressReporter 时流水线按影像发布解码、推理和后处理阶段的进度事件。
+        """
+        if self.detector is None and self.infer_batch is None:
+            raise ValueError("必须提供detector或infer_batch")
+
+        def remember_size(item):
+            # 解码后的图片在按序输出前被释放，只保留尺寸（用于计算变化率）或配准用的缩小灰度图
+            if item.image is not None:
+                item.extra['size'] = prepare_image(item.image) if self.coregister else item.image.size
+            if not keep_images:
+                item.plotted_image = None
+
+        pipeline = BatchPipeline(self.detector, conf_thres=self.conf_thres, iou_thres=self.iou_thres,
+                                 batch_size=batch_size, decode_workers=decode_workers, queue_size=prefetch,
+                                 infer_batch=self.infer_batch, load_image=self._load_image, on_result=remember_size,
+                                 progress=progress)
+        names = []
+
+        def items():
+            for name, earlier, recent in pairs:
+                names.append(name)
+                yield f"{name}:earlier", earlier
+                yield f"{name}:recent", recent
+
+        earlier_item = None
+        for item in pipeline.run(items(), on_idle=on_idle):
+            if item.index % 2 == 0:
+                earlier_item = item
+                continue
+            name = names[item.index // 2]
+            error = earlier_item.error or item.error
+            if error is not None:
+                yield ChangeResult({}, name=name, error=error)
+                continue
+            report, diff = self.compare_epochs(earlier_item.detections, item.detections, earlier_item.extra['size'],
+                                               item.extra['size'])
+            change_viz = None
+            if keep_images and item.plotted_image is not None:
+                change_viz = self.visualize(report, item.plotted_image, bgr=bgr, diff=diff)
+            yield ChangeResult(report, earlier_item.detections, item.detections, earlier_item.plotted_image,
+                               item.plotted_image, change_viz, name=name)
+
+    def _load_image(self, source):
+        if self.detector is not None:
+            return self.detector.preprocess_image(open_source(source))
+        if isinstance(source, Image.Image):
+            # 已解码的图片直接复用，不再复制
+            return source if source.mode == 'RGB' else source.convert('RGB')
+        return load_image(source)
+
+
+def iter_folder_pairs(before_dir, after_dir):
+    """按相对路径（不含扩展名）配对两个目录中的图片，返回 (名称, 早期路径, 近期路径)；缺少对应图片时近期路径为None"""
+    after = {}
+    for path in iter_image_paths([after_dir]):
+        after[str(Path(path).relative_to(after_dir).with_suffix(''))] = path
+    for path in iter_image_paths([before_dir]):
+        name = str(Path(path).relative_to(before_dir).with_suffix(''))
+        yield name, path, after.get(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="建筑物变化检测：按文件名配对两个时期的图片目录，逐对输出变化报告")
+    parser.add_argument('before', help="早期影像目录")
+    parser.add_argument('after', help="近期影像目录")
+    parser.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    parser.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    parser.add_argument('--iou', type=float, default=0.45, help="检测的IOU阈值")
+    parser.add_argument('--match-iou', type=float, default=0.3, help="判定为同一建筑物的IoU阈值")
+    parser.add_argument('--area-change', type=float, default=0.3, help="面积变化比例超过该值时视为扩建或缩小")
+    parser.add_argument('--min-change-area', type=int, default=20, help="分割模型：忽略面积小于该值（像素）的变化区域")
+    parser.add_argument('--coregister', action='store_true', help="比较前配准两个时期的影像（平移/相似变换）")
+    parser.add_argument('--registration-method', choices=['auto', 'phase', 'orb'], default='auto', help="配准方法")
+    parser.add_argument('--batch-size', type=int, default=4, help="单次前向推理的最大图片数")
+    parser.add_argument('--output', '-o', default='changes.jsonl', help="变化报告JSONL文件路径")
+    parser.add_argument('--save-viz', help="保存变化可视化图片的目录")
+    args = parser.parse_args(argv)
+
+    for path in (args.before, args.after):
+        if not os.path.isdir(path):
+            parser.error(f"目录不存在: {path}")
+
+    from utils.model_detector import ModelDetector
+    engine = ChangeDetector(ModelDetector(args.model), conf_thres=args.conf, iou_thres=args.iou,
+                            match_iou=args.match_iou, area_change_threshold=args.area_change,
+                            min_change_area=args.min_change_area, coregister=args.coregister,
+                            registration_method=args.registration_method)
+    if args.save_viz:
+        Path(args.save_viz).mkdir(parents=True, exist_ok=True)
+
+    missing = []
+
+    def pairs():
+        for name, before, after in iter_folder_pairs(args.before, args.after):
+            if after is None:
+                missing.append(name)
+                continue
+            yield name, before, after
+
+    stats = {'pairs': 0, 'failed': 0, 'changed': 0}
+    with JsonlResultWriter(args.output) as writer:
+        for result in engine.detect_pairs(pairs(), batch_size=args.batch_size, keep_images=bool(args.save_viz),
+                                            bgr=True):
+            stats['pairs'] += 1
+            if result.error is not None:
+                stats['failed'] += 1
+                writer.write({'name': result.name, 'error': str(result.error)})
+                continue
+            report = result.report
+            stats['changed'] += int(bool(report['significant_changes']))
+            writer.write({'name': result.name, **report,
+                          'earlier_detections': compact_detections(result.earlier_detections),
+                          'recent_detections': compact_detections(result.recent_detections)})
+            if args.save_viz and result.change_viz is not None:
+                # 模型的可视化结果为BGR，变化也按BGR绘制
+                path = Path(args.save_viz) / f"{result.name.replace(os.sep, '_')}_change.jpg"
+                cv2.imwrite(str(path), result.change_viz)
+            if stats['pairs'] % 100 == 0:
+                print(f"已处理 {stats['pairs']} 对，失败 {stats['failed']}")
+    print(f"变化检测完成：共 {stats['pairs']} 对影像，失败 {stats['failed']}，有变化 {stats['changed']} 对，"
+          f"结果已写入 {args.output}")
+    if missing:
+        print(f"近期目录中缺少对应图片，已跳过 {len(missing)} 张: {', '.join(missing[:10])}"
+              f"{' ...' if len(missing) > 10 else ''}")
+
+
+if __name__ == '__main__':
+    main()
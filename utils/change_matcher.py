@@ -0,0 +1,168 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def to_boxes(detections):
+    """把检测结果中的 bbox 转换为 (N, 4) 的float数组，没有 bbox 的结果（分割结果）被忽略"""
+    boxes = [d['bbox'] for d in detections if 'bbox' in d]
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """两组框的IoU矩阵 (len(a), len(b))，通过广播一次计算所有框对"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = box_areas(boxes_a)[:, None] + box_areas(boxes_b)[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+@dataclass
+class MatchResult:
+    """建筑物匹配结果，下标分别对应早期和近期的框
+
+    matched 为所有一一匹配的 (早期下标, 近期下标, IoU)；resized 是其中面积变化比例超过阈值的
+    (早期下标, 近期下标, IoU, 面积变化比例)，比例为正表示扩建、为负表示缩小；
+    new 为近期新增的建筑，demolished 为早期存在、近期消失的建筑。
+    """
+    matched: list = field(default_factory=list)
+    resized: list = field(default_factory=list)
+    new: list = field(default_factory=list)
+    demolished: list = field(default_factory=list)
+
+
+def _grid_cells(boxes, origin, cell_size, columns):
+    """每个框覆盖的网格单元，返回 (框下标数组, 单元键数组)"""
+    first = np.floor((boxes[:, :2] - origin) / cell_size).astype(np.int64)
+    last = np.floor((boxes[:, 2:] - origin) / cell_size).astype(np.int64)
+    nx = last[:, 0] - first[:, 0] + 1
+    ny = last[:, 1] - first[:, 1] + 1
+    counts = nx * ny
+    index = np.repeat(np.arange(len(boxes)), counts)
+    # 每个框内按行优先枚举覆盖的单元
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = first[index, 0] + offset % nx[index]
+    cy = first[index, 1] + offset // nx[index]
+    return index, cy * columns + cx
+
+
+def candidate_pairs(boxes_a, boxes_b, cell_size=None):
+    """用均匀网格索引找出所有相交的框对，返回 (a下标数组, b下标数组)
+
+    每个框登记到它覆盖的网格单元中，只在同一单元内的框之间比较，时间和内存与相交的框对数量成正比，
+    而不是 len(a) * len(b)。cell_size 默认取框边长中位数的2倍，大多数框只覆盖1-4个单元。
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(boxes_a) or not len(boxes_b):
+        return empty, empty
+    boxes = np.vstack([boxes_a, boxes_b])
+    if cell_size is None:
+        sizes = np.concatenate([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+        cell_size = max(float(np.median(sizes)) * 2, 1.0)
+    origin = boxes[:, :2].min(axis=0)
+    columns = int((boxes[:, 2].max() - origin[0]) // cell_size) + 1
+
+    index_a, keys_a = _grid_cells(boxes_a, origin, cell_size, columns)
+    index_b, keys_b = _grid_cells(boxes_b, origin, cell_size, columns)
+    # 按单元键连接两组登记项：b 的每一项与 a 中同一单元的所有项组成候选对
+    order = np.argsort(keys_a, kind='stable')
+    keys_a, index_a = keys_a[order], index_a[order]
+    lo = np.searchsorted(keys_a, keys_b, side='left')
+    counts = np.searchsorted(keys_a, keys_b, side='right') - lo
+    pair_b = np.repeat(index_b, counts)
+    pair_a = index_a[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+    # 同时覆盖多个公共单元的框对只保留一次
+    pair_ids = np.unique(pair_a * len(boxes_b) + pair_b)
+    pair_a, pair_b = pair_ids // len(boxes_b), pair_ids % len(boxes_b)
+    a, b = boxes_a[pair_a], boxes_b[pair_b]
+    overlap = (np.minimum(a[:, 2], b[:, 2]) > np.maximum(a[:, 0], b[:, 0])) & \
+              (np.minimum(a[:, 3], b[:, 3]) > np.maximum(a[:, 1], b[:, 1]))
+    return pair_a[overlap], pair_b[overlap]
+
+
+def pair_ious(boxes_a, boxes_b, index_a, index_b):
+    """只计算指定框对的IoU（稀疏IoU）"""
+    a, b = boxes_a[index_a], boxes_b[index_b]
+    intersection = (np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None) *
+                    np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None))
+    union = box_areas(a) + box_areas(b) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def _assign(index_a, index_b, ious, size_a):
+    """在候选对组成的二分图上按连通分量分别求解最优匹配
+
+    不同连通分量之间没有可匹配的框对，分别求解与整体求解结果相同；只有一个候选对的分量直接匹配，
+    其余分量在各自的小型稠密矩阵上调用 linear_sum_assignment。
+    """
+    if not len(ious):
+        return []
+    size = size_a + int(index_b.max()) + 1
+    graph = coo_matrix((np.ones(len(ious)), (index_a, size_a + index_b)), shape=(size, size))
+    _, labels = connected_components(graph, directed=False)
+    component = labels[index_a]
+    single = np.bincount(component)[component] == 1
+    pairs = list(zip(index_a[single].tolist(), index_b[single].tolist(), ious[single].tolist()))
+
+    order = np.argsort(component[~single], kind='stable')
+    multi_a, multi_b, multi_iou = index_a[~single][order], index_b[~single][order], ious[~single][order]
+    bounds = np.flatnonzero(np.diff(component[~single][order])) + 1
+    for group_a, group_b, group_iou in zip(np.split(multi_a, bounds), np.split(multi_b, bounds),
+                                           np.split(multi_iou, bounds)):
+        rows, row_index = np.unique(group_a, return_inverse=True)
+        cols, col_index = np.unique(group_b, return_inverse=True)
+        gain = np.zeros((len(rows), len(cols)))
+        gain[row_index, col_index] = group_iou
+        assigned_rows, assigned_cols = linear_sum_assignment(gain, maximize=True)
+        keep = gain[assigned_rows, assigned_cols] > 0
+        pairs.extend(zip(rows[assigned_rows[keep]].tolist(), cols[assigned_cols[keep]].tolist(),
+                         gain[assigned_rows[keep], assigned_cols[keep]].tolist()))
+    return pairs
+
+
+def match_buildings(earlier_boxes, recent_boxes, iou_threshold=0.3, area_change_threshold=0.3, cell_size=None):
+    """求解早期与近期建筑物的最优一一匹配（匈牙利算法），一次得到匹配、扩建/缩小、新增和拆除的建筑
+
+    只有IoU大于 iou_threshold 的框对才能匹配；匹配使总IoU最大，而不是按遍历顺序贪心匹配。
+    通过网格索引只计算相交框对的IoU，并按连通分量分别求解，密集的大场景中内存和时间与相交框对数量成正比。
+    """
+    earlier_boxes = np.asarray(earlier_boxes, dtype=np.float64).reshape(-1, 4)
+    recent_boxes = np.asarray(recent_boxes, dtype=np.float64).reshape(-1, 4)
+    index_a, index_b = candidate_pairs(earlier_boxes, recent_boxes, cell_size)
+    ious = pair_ious(earlier_boxes, recent_boxes, index_a, index_b)
+    # 低于阈值的框对不能匹配，直接从候选中去掉
+    valid = ious > iou_threshold
+    pairs = _assign(index_a[valid], index_b[valid], ious[valid], len(earlier_boxes))
+    return _classify(MatchResult(), pairs, earlier_boxes, recent_boxes, area_change_threshold)
+
+
+def _classify(result, pairs, earlier_boxes, recent_boxes, area_change_threshold):
+    """根据匹配的框对填充 MatchResult"""
+    earlier_areas = box_areas(earlier_boxes)
+    recent_areas = box_areas(recent_boxes)
+    matched_earlier, matched_recent = set(), set()
+    for i, j, iou in sorted(pairs, key=lambda pair: pair[1]):
+        result.matched.append((i, j, iou))
+        matched_earlier.add(i)
+        matched_recent.add(j)
+        if earlier_areas[i] > 0:
+            ratio = float((recent_areas[j] - earlier_areas[i]) / earlier_areas[i])
+            if abs(ratio) > area_change_threshold:
+                result.resized.append((i, j, iou, ratio))
+    result.new = [j for j in range(len(recent_boxes)) if j not in matched_recent]
+    result.demolished = [i for i in range(len(earlier_boxes)) if i not in matched_earlier]
+    return result
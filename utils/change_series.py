@@ -0,0 +1,244 @@
+"""多时期建筑物变化分析
+
+    python -m utils.change_series 2019.jpg 2020.jpg 2021.jpg 2022.jpg --model build_V8n.pt --output series.json
+    python -m utils.change_series data/site_a/*.png --coregister
+"""
+import argparse
+import json
+import time
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.batch_io import load_image
+from utils.change_matcher import box_areas, match_buildings, to_boxes
+from utils.coregistration import estimate_transform, prepare_image
+from utils.mask_change import align_probability
+from utils.mask_stitcher import MASK_THRESHOLD
+
+# 建筑物生命周期中的事件类型
+EVENT_EXISTING = '已存在'
+EVENT_NEW = '新建'
+EVENT_EXTENDED = '扩建'
+EVENT_SHRUNK = '缩小'
+EVENT_DEMOLISHED = '拆除'
+
+
+def footprints(detections, size, min_area=20):
+    """单个时期的建筑物外接框 (N, 4) 和置信度 (N,)
+
+    检测模型直接使用检测框；分割模型把概率图缩放到影像尺寸后二值化，每个连通域作为一个建筑物。
+    """
+    prob = align_probability(detections, size)
+    if prob is None:
+        boxes = to_boxes(detections)
+        confidences = np.array([d.get('confidence', 0.0) for d in detections if 'bbox' in d], dtype=np.float64)
+        return boxes, confidences
+    count, labels, stats, _ = cv2.connectedComponentsWithStats((prob > MASK_THRESHOLD).astype(np.uint8),
+                                                               connectivity=8)
+    confidences = np.bincount(labels.ravel(), weights=prob.ravel(), minlength=count) / np.maximum(stats[:, 4], 1)
+    keep = np.flatnonzero(stats[:, 4] >= min_area)
+    keep = keep[keep > 0]
+    x, y, w, h = (stats[keep, i].astype(np.float64) for i in range(4))
+    return np.stack([x, y, x + w, y + h], axis=1).reshape(-1, 4), confidences[keep]
+
+
+def _load_rgb(image):
+    if isinstance(image, Image.Image):
+        return image if image.mode == 'RGB' else image.convert('RGB')
+    return load_image(image)
+
+
+def transform_boxes(boxes, matrix):
+    """用 2x3 仿射矩阵变换外接框，返回四个角点变换后的外接框"""
+    if not len(boxes):
+        return boxes
+    corners = np.stack([boxes[:, [0, 1]], boxes[:, [2, 1]], boxes[:, [0, 3]], boxes[:, [2, 3]]], axis=1)
+    moved = corners @ matrix[:, :2].T + matrix[:, 2]
+    return np.concatenate([moved.min(axis=1), moved.max(axis=1)], axis=1)
+
+
+@dataclass
+class SeriesResult:
+    """多时期分析结果
+
+    timelines 为每个建筑物的生命周期（首次出现、最后出现、拆除时期、事件和各时期的外接框），
+    intervals 为相邻两个时期之间的统计，detections / plotted_images 为各时期的检测结果和可视化图像。
+    """
+    names: list
+    timelines: list = field(default_factory=list)
+    intervals: list = field(default_factory=list)
+    detections: list = field(default_factory=list)
+    plotted_images: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+class ChangeSeries:
+    """同一地点N个时期的变化分析
+
+    每个时期只检测一次，检测结果按影像内容缓存在 DetectionCache 中，新增一个时期只需要对该时期推理；
+    相邻时期的建筑物用 match_buildings 最优匹配，串联成每个建筑物的生命周期。
+    """
+
+    def __init__(self, detector=None, infer_batch=None, cache=None, conf_thres=0.5, iou_thres=0.45, match_iou=0.3,
+                 area_change_threshold=0.3, min_area=20, coregister=False, registration_method='auto'):
+        if detector is None and infer_batch is None:
+            raise ValueError("必须提供detector或infer_batch")
+        self.detector = detector
+        self.infer_batch = infer_batch
+        self.cache = cache
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.match_iou = match_iou
+        self.area_change_threshold = area_change_threshold
+        # 分割模型中面积小于该值的连通域不作为建筑物
+        self.min_area = min_area
+        self.coregister = coregister
+        self.registration_method = registration_method
+
+    def _infer(self, images):
+        if self.infer_batch is not None:
+            return self.infer_batch(images)
+        return self.detector.detect_batch(images, conf_thres=self.conf_thres, iou_thres=self.iou_thres)
+
+    def detect_epochs(self, images):
+        """检测各时期影像，返回 ((detections, plotted_image) 列表, 推理的时期数)
+
+        缓存命中的时期直接复用，未命中的时期在同一次批量推理中完成并写入缓存。
+        """
+        results = [None] * len(images)
+        keys = [None] * len(images)
+        if self.cache is not None:
+            for index, image in enumerate(images):
+                keys[index] = self.cache.key(image)
+                results[index] = self.cache.get(keys[index])
+        pending = [index for index, result in enumerate(results) if result is None]
+        if pending:
+            for index, result in zip(pending, self._infer([images[i] for i in pending])):
+                results[index] = result
+                if self.cache is not None:
+                    self.cache.put(keys[index], *result)
+        return results, len(pending)
+
+    def analyze(self, images, names=None):
+        """按时间顺序分析各时期的影像（PIL图片、文件路径或文件对象），names 为各时期的名称（例如日期）"""
+        start = time.perf_counter()
+        images = [_load_rgb(image) for image in images]
+        names = list(names) if names is not None else [f"时期{i + 1}" for i in range(len(images))]
+        if len(names) != len(images):
+            raise ValueError("时期名称与影像数量不一致")
+        results, inferred = self.detect_epochs(images)
+        detections = [result[0] for result in results]
+        result = SeriesResult(names, detections=detections, plotted_images=[r[1] for r in results])
+        registration_images = [prepare_image(image) for image in images] if self.coregister else None
+        result.timelines, result.intervals = self.link(
+            [footprints(d, image.size, self.min_area) for d, image in zip(detections, images)], names,
+            registration_images)
+        result.stats = {'epochs': len(images), 'inferred': inferred, 'cached': len(images) - inferred,
+                        'buildings': len(result.timelines), 'elapsed': time.perf_counter() - start}
+        return result
+
+    def link(self, epoch_footprints, names, registration_images=None):
+        """把相邻时期的建筑物串联为生命周期，epoch_footprints 为各时期 footprints() 的结果
+
+        返回 (timelines, intervals)。传入 registration_images（prepare_image 的结果）时先把前一时期的外接框
+        变换到后一时期的坐标再匹配，外接框仍按各自时期的坐标保存。
+        """
+        timelines = []
+        current = []  # 当前时期每个外接框对应的生命周期
+
+        def footprint(index, box, confidence):
+            return {'epoch': names[index], 'bbox': [round(float(v), 2) for v in box],
+                    'area': round(float(box_areas(box[None])[0]), 2), 'confidence': round(float(confidence), 4)}
+
+        boxes, confidences = epoch_footprints[0] if epoch_footprints else (np.zeros((0, 4)), np.zeros(0))
+        for box, confidence in zip(boxes, confidences):
+            timeline = {'id': len(timelines) + 1, 'first_seen': names[0], 'last_seen': names[0],
+                        'demolished_at': None, 'events': [{'epoch': names[0], 'type': EVENT_EXISTING}],
+                        'footprints': [footprint(0, box, confidence)]}
+            timelines.append(timeline)
+            current.append(timeline)
+
+        intervals = []
+        for index in range(1, len(epoch_footprints)):
+            previous_boxes = boxes
+            boxes, confidences = epoch_footprints[index]
+            interval = {'from': names[index - 1], 'to': names[index], 'buildings_before': len(previous_boxes),
+                        'buildings_after': len(boxes), EVENT_NEW: 0, EVENT_DEMOLISHED: 0, EVENT_EXTENDED: 0,
+                        EVENT_SHRUNK: 0, 'change_area': 0.0}
+            if registration_images is not None:
+                registration = estimate_transform(registration_images[index - 1], registration_images[index],
+                                                  method=self.registration_method)
+                previous_boxes = transform_boxes(previous_boxes, registration.matrix)
+                interval['registration'] = registration.to_dict()
+            match = match_buildings(previous_boxes, boxes, iou_threshold=self.match_iou,
+                                    area_change_threshold=self.area_change_threshold)
+            areas, previous_areas = box_areas(boxes), box_areas(previous_boxes)
+
+            following = [None] * len(boxes)
+            for i, j, _ in match.matched:
+                timeline = current[i]
+                timeline['last_seen'] = names[index]
+                timeline['footprints'].append(footprint(index, boxes[j], confidences[j]))
+                following[j] = timeline
+            for i, j, _, ratio in match.resized:
+                event = EVENT_EXTENDED if ratio > 0 else EVENT_SHRUNK
+                current[i]['events'].append({'epoch': names[index], 'type': event, 'ratio': round(ratio, 4)})
+                interval[event] += 1
+                interval['change_area'] += float(abs(areas[j] - previous_areas[i]))
+            for j in match.new:
+                timeline = {'id': len(timelines) + 1, 'first_seen': names[index], 'last_seen': names[index],
+                            'demolished_at': None, 'events': [{'epoch': names[index], 'type': EVENT_NEW}],
+                            'footprints': [footprint(index, boxes[j], confidences[j])]}
+                timelines.append(timeline)
+                following[j] = timeline
+                interval[EVENT_NEW] += 1
+                interval['change_area'] += float(areas[j])
+            for i in match.demolished:
+                current[i]['demolished_at'] = names[index]
+                current[i]['events'].append({'epoch': names[index], 'type': EVENT_DEMOLISHED})
+                interval[EVENT_DEMOLISHED] += 1
+                interval['change_area'] += float(previous_areas[i])
+            interval['change_area'] = round(interval['change_area'], 2)
+            intervals.append(interval)
+            current = following
+        return timelines, intervals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多时期建筑物变化分析：按给定顺序（时间先后）输入同一地点的各期影像")
+    parser.add_argument('images', nargs='+', help="各时期影像，按时间先后排列")
+    parser.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    parser.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    parser.add_argument('--iou', type=float, default=0.45, help="检测的IOU阈值")
+    parser.add_argument('--match-iou', type=float, default=0.3, help="判定为同一建筑物的IoU阈值")
+    parser.add_argument('--area-change', type=float, default=0.3, help="面积变化比例超过该值时视为扩建或缩小")
+    parser.add_argument('--coregister', action='store_true', help="匹配前配准相邻时期的影像")
+    parser.add_argument('--no-cache', action='store_true', help="不使用检测结果缓存")
+    parser.add_argument('--output', '-o', default='series.json', help="生命周期和时期间统计的JSON文件路径")
+    args = parser.parse_args(argv)
+    if len(args.images) < 2:
+        parser.error("至少需要两个时期的影像")
+
+    from pathlib import Path
+    from utils.detection_cache import DetectionCache
+    from utils.model_detector import ModelDetector
+    cache = None if args.no_cache else DetectionCache(args.model, conf_thres=args.conf, iou_thres=args.iou)
+    series = ChangeSeries(ModelDetector(args.model), cache=cache, conf_thres=args.conf, iou_thres=args.iou,
+                          match_iou=args.match_iou, area_change_threshold=args.area_change, coregister=args.coregister)
+    result = series.analyze(args.images, names=[Path(path).stem for path in args.images])
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'epochs': result.names, 'intervals': result.intervals, 'timelines': result.timelines}, f,
+                  ensure_ascii=False, indent=2)
+    stats = result.stats
+    for interval in result.intervals:
+        print(f"{interval['from']} -> {interval['to']}: 新建 {interval[EVENT_NEW]}，拆除 {interval[EVENT_DEMOLISHED]}，"
+              f"扩建 {interval[EVENT_EXTENDED]}，缩小 {interval[EVENT_SHRUNK]}")
+    print(f"共 {stats['epochs']} 个时期（推理 {stats['inferred']} 个，复用缓存 {stats['cached']} 个），"
+          f"{stats['buildings']} 个建筑物，耗时 {stats['elapsed']:.1f}秒，结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""前后时期影像配准
+
+    python -m utils.coregistration before.jpg after.jpg
+    python -m utils.coregistration before.jpg after.jpg --method orb
+"""
+import argparse
+import time
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 配准在最长边不超过该值的灰度图上进行，结果换算回原始分辨率
+REGISTRATION_SIZE = 1024
+# 金字塔最粗层级的最长边
+COARSE_SIZE = 128
+# 细层级只在中心窗口内估计残差平移
+REFINE_WINDOW = 256
+# 上一层级估计放大2倍后的误差只有几个像素，细层级残差超过该值时视为局部变化（如新建建筑）造成的误匹配，保留上一层级的估计
+MAX_RESIDUAL = 4.0
+# 相位相关响应低于该值时认为平移估计不可靠，auto 模式改用ORB特征匹配
+MIN_RESPONSE = 0.05
+
+
+@dataclass
+class Registration:
+    """配准结果：matrix 为 2x3 仿射矩阵，把早期影像的像素坐标映射到近期影像的像素坐标"""
+    matrix: np.ndarray
+    method: str
+    response: float = 0.0
+    elapsed: float = 0.0
+    extra: dict = field(default_factory=dict)
+
+    @property
+    def shift(self):
+        """早期影像中心在近期影像中的位移 (dx, dy)，用于显示"""
+        return self.extra.get('shift', (float(self.matrix[0, 2]), float(self.matrix[1, 2])))
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'matrix': np.round(self.matrix, 6).tolist(),
+            'shift': [round(v, 2) for v in self.shift],
+            'response': round(float(self.response), 4),
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+        }
+
+
+def prepare_image(image, max_size=REGISTRATION_SIZE):
+    """缩小为最长边不超过 max_size 的float32灰度图，返回 (灰度图, 原始尺寸)
+
+    批量处理时可以只保留该结果，原始影像解码后即可释放。
+    """
+    if isinstance(image, tuple):
+        return image
+    if isinstance(image, Image.Image):
+        size = image.size
+        scale = min(1.0, max_size / max(size))
+        small = image.convert('L')
+        if scale < 1.0:
+            small = small.resize((max(1, round(size[0] * scale)), max(1, round(size[1] * scale))),
+                                 Image.Resampling.BILINEAR)
+        return np.asarray(small, dtype=np.float32), size
+    array = np.asarray(image)
+    size = (array.shape[1], array.shape[0])
+    gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY) if array.ndim == 3 else array
+    scale = min(1.0, max_size / max(size))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return gray.astype(np.float32), size
+
+
+def _center_window(image, size):
+    height, width = image.shape
+    h, w = min(height, size), min(width, size)
+    y, x = (height - h) // 2, (width - w) // 2
+    return image[y:y + h, x:x + w]
+
+
+def _phase_shift(earlier, recent):
+    window = cv2.createHanningWindow(earlier.shape[::-1], cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(earlier, recent, window)
+    return np.array([dx, dy]), response
+
+
+def phase_correlation(earlier, recent, coarse_size=COARSE_SIZE, refine_window=REFINE_WINDOW,
+                      max_residual=MAX_RESIDUAL):
+    """金字塔由粗到细的相位相关平移估计，earlier 与 recent 为同尺寸灰度图
+
+    最粗层级在整幅图上估计平移，逐级放大2倍后把近期影像按当前估计反向平移，只在中心窗口内估计残差，
+    细层级的计算量与影像大小无关。中心窗口较小，窗口内的局部变化可能让残差跳到几十像素之外，
+    残差超过 max_residual 时丢弃该层级的残差。返回 (平移 (dx, dy), 最粗层级的响应)，近期影像中 x + d 处对应早期影像的 x。
+    """
+    pyramid = [(earlier, recent)]
+    while max(pyramid[-1][0].shape) > coarse_size * 2 and min(pyramid[-1][0].shape) >= 32:
+        e, r = pyramid[-1]
+        pyramid.append((cv2.pyrDown(e), cv2.pyrDown(r)))
+
+    shift, response = _phase_shift(*pyramid[-1])
+    for level in range(len(pyramid) - 2, -1, -1):
+        e, r = pyramid[level]
+        shift = shift * 2
+        # 近期影像按当前估计反向平移后与早期影像对齐，只剩残差
+        aligned = cv2.warpAffine(r, np.float32([[1, 0, shift[0]], [0, 1, shift[1]]]), r.shape[::-1],
+                                 flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REFLECT)
+        residual, _ = _phase_shift(_center_window(e, refine_window), _center_window(aligned, refine_window))
+        if np.abs(residual).max() <= max_residual:
+            shift = shift + residual
+    return shift, response
+
+
+def orb_affine(earlier, recent, max_features=2000):
+    """ORB特征匹配 + RANSAC估计相似变换（平移、旋转、等比缩放），返回 (2x3矩阵, 内点比例)，失败时矩阵为None"""
+    orb = cv2.ORB_create(max_features)
+    earlier_u8, recent_u8 = np.clip(earlier, 0, 255).astype(np.uint8), np.clip(recent, 0, 255).astype(np.uint8)
+    kp_e, des_e = orb.detectAndCompute(earlier_u8, None)
+    kp_r, des_r = orb.detectAndCompute(recent_u8, None)
+    if des_e is None or des_r is None or len(kp_e) < 6 or len(kp_r) < 6:
+        return None, 0.0
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des_e, des_r)
+    if len(matches) < 6:
+        return None, 0.0
+    src = np.float32([kp_e[m.queryIdx].pt for m in matches])
+    dst = np.float32([kp_r[m.trainIdx].pt for m in matches])
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers is None or inliers.sum() < 6:
+        return None, 0.0
+    return matrix, float(inliers.mean())
+
+
+def estimate_transform(earlier_image, recent_image, method='auto', max_size=REGISTRATION_SIZE):
+    """估计早期影像到近期影像的变换
+
+    earlier_image / recent_image 可以是PIL图片、RGB数组或 prepare_image 的结果。近期影像缩放到早期影像的工作尺寸，
+    两幅影像尺寸不同时的缩放也包含在返回的矩阵中。method 为 'phase'（平移）、'orb'（相似变换）或
+    'auto'（先相位相关，响应过低时改用ORB）。
+    """
+    start = time.perf_counter()
+    earlier, earlier_size = prepare_image(earlier_image, max_size)
+    recent, recent_size = prepare_image(recent_image, max_size)
+    height, width = earlier.shape
+    if recent.shape != earlier.shape:
+        recent = cv2.resize(recent, (width, height), interpolation=cv2.INTER_AREA)
+
+    response = 0.0
+    working = None
+    used = method
+    if method in ('phase', 'auto'):
+        shift, response = phase_correlation(earlier, recent)
+        working = np.float64([[1, 0, shift[0]], [0, 1, shift[1]]])
+        used = 'phase'
+    if method == 'orb' or (method == 'auto' and response < MIN_RESPONSE):
+        matrix, inlier_ratio = orb_affine(earlier, recent)
+        if matrix is not None:
+            working, response, used = matrix.astype(np.float64), inlier_ratio, 'orb'
+        elif working is None:
+            working, used = np.float64([[1, 0, 0], [0, 1, 0]]), 'identity'
+
+    # 原始早期坐标 -> 工作尺寸 -> 工作尺寸下的变换 -> 原始近期坐标
+    to_working = np.diag([width / earlier_size[0], height / earlier_size[1], 1.0])
+    from_working = np.diag([recent_size[0] / width, recent_size[1] / height, 1.0])
+    matrix = (from_working @ np.vstack([working, [0, 0, 1]]) @ to_working)[:2]
+    center = np.array([earlier_size[0] / 2, earlier_size[1] / 2, 1.0])
+    moved = matrix @ center
+    scaled_center = np.array([center[0] * recent_size[0] / earlier_size[0], center[1] * recent_size[1] / earlier_size[1]])
+    return Registration(matrix, used, response, time.perf_counter() - start,
+                        extra={'shift': tuple(float(v) for v in moved - scaled_center)})
+
+
+def warp_detections(detections, registration, recent_size):
+    """把早期影像的检测结果变换到近期影像坐标（只变换检测结果，不重采样影像）
+
+    检测框取四个角点变换后的外接框并裁剪到近期影像范围内，完全移出影像的检测框被丢弃；
+    分割概率图按同一变换重采样到近期影像尺寸。
+    """
+    matrix = registration.matrix
+    width, height = recent_size
+    warped = []
+    for detection in detections:
+        detection = dict(detection)
+        if 'bbox' in detection:
+            x1, y1, x2, y2 = detection['bbox']
+            corners = np.array([[x1, y1, 1], [x2, y1, 1], [x1, y2, 1], [x2, y2, 1]], dtype=np.float64) @ matrix.T
+            x1, y1 = np.clip(corners.min(axis=0), 0, [width, height])
+            x2, y2 = np.clip(corners.max(axis=0), 0, [width, height])
+            if x2 <= x1 or y2 <= y1:
+                continue
+            detection['bbox'] = [float(x1), float(y1), float(x2), float(y2)]
+        if 'segmentation' in detection:
+            prob = np.asarray(detection['segmentation'], dtype=np.float32).squeeze()
+            source_width, source_height = detection.get('width', prob.shape[1]), detection.get('height', prob.shape[0])
+            # 概率图网格 -> 早期影像像素 -> 近期影像像素
+            to_image = np.diag([source_width / prob.shape[1], source_height / prob.shape[0], 1.0])
+            grid_matrix = (np.vstack([matrix, [0, 0, 1]]) @ to_image)[:2]
+            detection['segmentation'] = cv2.warpAffine(prob, grid_matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                                       borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        detection['width'], detection['height'] = width, height
+        warped.append(detection)
+    return warped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="估计两个时期影像之间的平移/相似变换并输出耗时")
+    parser.add_argument('earlier', help="早期影像")
+    parser.add_argument('recent', help="近期影像")
+    parser.add_argument('--method', choices=['auto', 'phase', 'orb'], default='auto', help="配准方法")
+    parser.add_argument('--max-size', type=int, default=REGISTRATION_SIZE, help="配准工作尺寸（最长边）")
+    args = parser.parse_args(argv)
+    with Image.open(args.earlier) as earlier, Image.open(args.recent) as recent:
+        registration = estimate_transform(earlier, recent, method=args.method, max_size=args.max_size)
+    result = registration.to_dict()
+    print(f"方法: {result['method']}，位移: ({result['shift'][0]}, {result['shift'][1]}) 像素，"
+          f"响应: {result['response']}，耗时: {result['elapsed_ms']} 毫秒")
+    print(f"仿射矩阵: {result['matrix']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+DETECTION_CACHE_DIR = Path(__file__).parent.parent / 'data' / 'detection_cache'
+
+
+class DetectionCache:
+    """按图片内容缓存的检测结果
+
+    缓存键由模型、阈值和解码后的像素内容决定，同一幅影像再次参与变化检测时直接复用检测结果和可视化图像。
+    每个条目是一个目录：detections.json、分割概率图 segmentation.npz（float16）和可视化图像 viz.png。
+    """
+
+    def __init__(self, model_name, conf_thres=0.5, iou_thres=0.45, cache_dir=None):
+        self.cache_dir = Path(cache_dir) if cache_dir else DETECTION_CACHE_DIR
+        self.namespace = f"{model_name}|{conf_thres}|{iou_thres}"
+
+    def key(self, image):
+        """PIL图片的缓存键，按像素内容计算，与文件名和编码方式无关"""
+        digest = hashlib.sha1(self.namespace.encode('utf-8'))
+        digest.update(f"{image.mode}|{image.size}".encode('utf-8'))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key):
+        """返回 (detections, plotted_image)，未命中时返回None"""
+        path = self.path_for(key)
+        try:
+            with open(path / 'detections.json', encoding='utf-8') as f:
+                detections = json.load(f)
+            if (path / 'segmentation.npz').exists():
+                with np.load(path / 'segmentation.npz') as segmentation:
+                    masked = [d for d in detections if d.pop('segmentation', False)]
+                    for index, detection in enumerate(masked):
+                        detection['segmentation'] = segmentation[f'arr_{index}'].astype(np.float32)
+            plotted_image = cv2.imread(str(path / 'viz.png'), cv2.IMREAD_UNCHANGED) \
+                if (path / 'viz.png').exists() else None
+        except (OSError, ValueError):
+            return None
+        return detections, plotted_image
+
+    def put(self, key, detections, plotted_image=None):
+        """写入临时目录后原子替换，多个会话同时写入同一条目时不会读到不完整的结果"""
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.mkdir()
+        try:
+            rows, segmentation = [], []
+            for detection in detections:
+                row = {k: v for k, v in detection.items() if k != 'segmentation'}
+                if 'segmentation' in detection:
+                    # 只保存标记，概率图集中写入 segmentation.npz
+                    row['segmentation'] = True
+                    segmentation.append(np.asarray(detection['segmentation'], dtype=np.float16))
+                rows.append(row)
+            with open(tmp_path / 'detections.json', 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False)
+            if segmentation:
+                np.savez(tmp_path / 'segmentation.npz', *segmentation)
+            if plotted_image is not None:
+                # 按原样保存通道顺序，读回的数组与写入时一致
+                cv2.imwrite(str(tmp_path / 'viz.png'), np.asarray(plotted_image))
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # 其他会话已写入同一条目，内容相同，保留已有的结果
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return path
@@ -0,0 +1,166 @@
+import base64
+import http.client
+import io
+import json
+import os
+import socket
+import threading
+from pathlib import Path
+from urllib.parse import urlencode, urlparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 设置该环境变量后，页面通过推理服务检测，例如 http://127.0.0.1:8600 或 unix:///tmp/building.sock
+INFERENCE_URL_ENV = 'BUILDING_INFERENCE_URL'
+# 设置为1时，图片和结果通过共享内存传递（仅适用于与推理服务位于同一台机器的情况）
+INFERENCE_SHM_ENV = 'BUILDING_INFERENCE_SHM'
+
+_process_ring = None
+_process_ring_lock = threading.Lock()
+
+
+def get_process_ring():
+    """当前进程共用的共享内存环，首次使用时创建"""
+    global _process_ring
+    with _process_ring_lock:
+        if _process_ring is None:
+            from utils.shm_transport import SharedMemoryRing
+            _process_ring = SharedMemoryRing()
+        return _process_ring
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """推理服务的轻量客户端，接口与 ModelDetector.detect 保持一致"""
+
+    def __init__(self, model_name, url, timeout=300, ring=None):
+        self.model_name = model_name
+        self.url = url
+        self.timeout = timeout
+        self.ring = ring
+        parsed = urlparse(url)
+        if parsed.scheme == 'unix':
+            self._connect = lambda: _UnixHTTPConnection(parsed.path, timeout=self.timeout)
+        elif parsed.scheme == 'http':
+            self._connect = lambda: http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+        else:
+            raise ValueError(f"不支持的推理服务地址: {url}")
+
+    def _request(self, method, path, body=None, content_type='application/octet-stream'):
+        conn = self._connect()
+        try:
+            conn.request(method, path, body=body, headers={'Content-Type': content_type})
+            response = conn.getresponse()
+            payload = json.loads(response.read().decode('utf-8'))
+        finally:
+            conn.close()
+        if response.status == 404:
+            raise FileNotFoundError(payload.get('error'))
+        if response.status != 200:
+            raise ValueError(f"推理服务返回错误({response.status}): {payload.get('error')}")
+        return payload
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    @staticmethod
+    def encode_image(image):
+        """把页面中出现的各类图片输入编码为字节流"""
+        if isinstance(image, (str, Path)):
+            if not Path(image).exists():
+                raise FileNotFoundError(f"Image file not found: {image}")
+            return Path(image).read_bytes()
+        if isinstance(image, np.ndarray):
+            # 与 ModelDetector 一致，ndarray 按 BGR 处理
+            ok, buffer = cv2.imencode('.png', image)
+            if not ok:
+                raise ValueError("图像编码失败")
+            return buffer.tobytes()
+        if isinstance(image, Image.Image):
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, format='PNG')
+            return buffer.getvalue()
+        if hasattr(image, 'getvalue'):
+            return image.getvalue()
+        if hasattr(image, 'read'):
+            position = image.tell() if hasattr(image, 'tell') else None
+            data = image.read()
+            if position is not None:
+                image.seek(position)
+            return data
+        raise TypeError(f"Unsupported image type: {type(image)}")
+
+    @staticmethod
+    def decode_image(image):
+        """解码为RGB uint8数组，用于共享内存传输"""
+        if isinstance(image, np.ndarray):
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if not isinstance(image, Image.Image):
+            image = Image.open(io.BytesIO(InferenceClient.encode_image(image)))
+        return np.asarray(image.convert('RGB'))
+
+    def detect(self, image, conf_thres=0.5, iou_thres=0.45, preview_size=None):
+        if self.ring is not None:
+            array = self.decode_image(image)
+            if self.ring.fits(array.shape):
+                return self._detect_shm(array, conf_thres, iou_thres, preview_size)
+        params = {'model': self.model_name, 'conf': conf_thres, 'iou': iou_thres}
+        if preview_size:
+            params['preview'] = f"{preview_size[0]}x{preview_size[1]}"
+        payload = self._request('POST', f"/detect?{urlencode(params)}", body=self.encode_image(image))
+        buffer = np.frombuffer(base64.b64decode(payload['plotted_image']), dtype=np.uint8)
+        plotted_image = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+        return payload['detections'], plotted_image
+
+    def _detect_shm(self, array, conf_thres, iou_thres, preview_size):
+        ring = self.ring
+        slots = []
+        try:
+            # 逐个获取槽位，某次获取失败时 finally 只释放已经拿到的槽位
+            for _ in range(3):
+                slots.append(ring.acquire())
+            image_slot, reply_slot, mask_slot = slots
+            ring.write(image_slot, array)
+            request = {
+                'model': self.model_name, 'conf': conf_thres, 'iou': iou_thres,
+                'preview': list(preview_size) if preview_size else None,
+                'ring': ring.describe(), 'slot': image_slot,
+                'reply_slot': reply_slot, 'mask_slot': mask_slot
+            }
+            payload = self._request('POST', '/detect_shm', body=json.dumps(request).encode('utf-8'),
+                                    content_type='application/json')
+            detections = payload['detections']
+            # 结果从槽位中复制出来后即可回收槽位
+            plotted_image = ring.view(reply_slot).copy()
+            for detection in detections:
+                if 'segmentation_slot' in detection:
+                    mask = ring.view(detection.pop('segmentation_slot'))
+                    # 与 ModelDetector 的输出格式保持一致
+                    detection['segmentation'] = mask.reshape((1, 1) + mask.shape).tolist()
+            return detections, plotted_image
+        finally:
+            for slot in slots:
+                ring.release(slot)
+
+
+def create_detector(model_name):
+    """配置了推理服务地址时返回客户端，否则在当前进程中加载 ModelDetector"""
+    url = os.environ.get(INFERENCE_URL_ENV)
+    if url:
+        ring = get_process_ring() if os.environ.get(INFERENCE_SHM_ENV) == '1' else None
+        return InferenceClient(model_name, url, ring=ring)
+    from utils.model_detector import ModelDetector
+    return ModelDetector(model_name=model_name)
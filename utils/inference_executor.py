@@ -0,0 +1,273 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from utils.inference_client import create_detector
+from utils.progress_events import ensure_reporter, STAGE_INFER, STAGE_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# 优先级数值越小越先执行：交互式单图请求优先于批量任务
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+WORKERS_ENV = 'BUILDING_INFERENCE_WORKERS'
+QUEUE_SIZE_ENV = 'BUILDING_INFERENCE_QUEUE_SIZE'
+
+
+class QueueFullError(RuntimeError):
+    """推理队列已满，调用方应稍后重试"""
+
+
+class InferenceTicket:
+    """已提交的推理请求，可查询排队位置并等待结果"""
+
+    def __init__(self, executor, session_id, priority, model_name, image, conf_thres, iou_thres, preview_size,
+                 batch=False, progress=None):
+        self.executor = executor
+        self.session_id = session_id
+        self.priority = priority
+        self.model_name = model_name
+        self.image = image
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.preview_size = preview_size
+        # batch为True时image是图片列表，结果为 (detections, plotted_image) 列表
+        self.batch = batch
+        # ProgressReporter，在工作线程中发布预处理、推理、后处理等阶段的进度事件
+        self.progress = progress
+        self.future = Future()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def position(self):
+        """当前排队位置（从1开始），已开始执行或已结束时返回0"""
+        return self.executor.position(self)
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        return self.executor.cancel(self)
+
+    def result(self, timeout=None, on_wait=None, poll_interval=0.2):
+        """等待检测结果；on_wait(position) 在排队期间被周期性调用，可用于界面提示"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while on_wait is not None and not self.future.done():
+            on_wait(self.position())
+            wait = poll_interval if deadline is None else min(poll_interval, max(0, deadline - time.monotonic()))
+            try:
+                return self.future.result(timeout=wait)
+            except FutureTimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+        return self.future.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+
+
+class _SharedDetector:
+    """工作线程共享的检测器
+
+    本地模型不保证线程安全，前向推理由锁串行执行；每个线程各加载一份权重会让显存/内存占用随
+    BUILDING_INFERENCE_WORKERS 成倍增长，而单个模型的前向推理本身已占满计算资源，多份副本并不能提高吞吐。
+    多个工作线程的并发体现在不同模型之间，以及推理服务客户端（每个请求独立连接，不需要加锁）。
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.detector = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """返回 (检测器, 推理锁)，首次调用时加载模型；加载期间同一模型的其它线程等待，不重复加载"""
+        with self.lock:
+            if self.detector is None:
+                self.detector = create_detector(self.model_name)
+        return self.detector, self.lock
+
+
+class InferenceExecutor:
+    """进程级推理执行器
+
+    所有会话共享一个有界队列和固定数量的工作线程；同一优先级内按会话轮询出队，
+    避免某个会话的大批量任务独占计算资源。
+    """
+
+    def __init__(self, max_workers=2, max_queue_size=64):
+        if max_workers < 1 or max_queue_size < 1:
+            raise ValueError("max_workers和max_queue_size必须是正整数")
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        # priority -> OrderedDict(session_id -> deque[ticket])，OrderedDict的顺序即轮询顺序
+        self._queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BATCH: OrderedDict()}
+        self._queued = 0
+        self._running = 0
+        self._condition = threading.Condition()
+        self._shutdown = False
+        # model_name -> _SharedDetector，同一模型只加载一份权重，由所有工作线程共享
+        self._detectors = {}
+        self._detectors_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"inference-worker-{i}", daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, session_id, model_name, image, conf_thres=0.5, iou_thres=0.45,
+               priority=PRIORITY_BATCH, preview_size=None, progress=None):
+        ticket = InferenceTicket(self, session_id, priority, model_name, image, conf_thres, iou_thres, preview_size,
+                                 progress=progress)
+        return self._enqueue(ticket)
+
+    def submit_batch(self, session_id, model_name, images, conf_thres=0.5, iou_thres=0.45,
+                     priority=PRIORITY_BATCH, preview_size=None, progress=None):
+        """把多张图片作为一个请求提交，在同一次批量前向推理中完成"""
+        ticket = InferenceTicket(self, session_id, priority, model_name, list(images), conf_thres, iou_thres,
+                                 preview_size, batch=True, progress=progress)
+        return self._enqueue(ticket)
+
+    def _enqueue(self, ticket):
+        if ticket.priority not in self._queues:
+            raise ValueError(f"未知的优先级: {ticket.priority}")
+        session_id, priority = ticket.session_id, ticket.priority
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("推理执行器已关闭")
+            if self._queued >= self.max_queue_size:
+                raise QueueFullError(f"推理队列已满（{self.max_queue_size}），请稍后重试")
+            self._queues[priority].setdefault(session_id, deque()).append(ticket)
+            self._queued += 1
+            self._condition.notify()
+        if ticket.progress is not None:
+            ticket.progress.start(STAGE_QUEUE)
+        return ticket
+
+    def _iter_order(self):
+        """按实际出队顺序遍历排队中的请求：先按优先级，再在会话之间轮询"""
+        for priority in sorted(self._queues):
+            sessions = list(self._queues[priority].values())
+            for round_items in itertools.zip_longest(*sessions):
+                for ticket in round_items:
+                    if ticket is not None:
+                        yield ticket
+
+    def position(self, ticket):
+        with self._condition:
+            for index, queued in enumerate(self._iter_order(), start=1):
+                if queued is ticket:
+                    return index
+        return 0
+
+    def cancel(self, ticket):
+        with self._condition:
+            sessions = self._queues[ticket.priority]
+            queue = sessions.get(ticket.session_id)
+            if queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del sessions[ticket.session_id]
+            self._queued -= 1
+        return ticket.future.cancel()
+
+    def stats(self):
+        with self._condition:
+            sessions = {}
+            for priority_sessions in self._queues.values():
+                for session_id, queue in priority_sessions.items():
+                    sessions[session_id] = sessions.get(session_id, 0) + len(queue)
+            return {'queued': self._queued, 'running': self._running, 'max_workers': self.max_workers,
+                    'max_queue_size': self.max_queue_size, 'sessions': sessions}
+
+    def _next_ticket(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            session_id, queue = next(iter(sessions.items()))
+            ticket = queue.popleft()
+            # 取出一个请求后把该会话移到队尾，实现会话间轮询
+            del sessions[session_id]
+            if queue:
+                sessions[session_id] = queue
+            self._queued -= 1
+            return ticket
+        return None
+
+    def _get_detector(self, model_name):
+        with self._detectors_lock:
+            shared = self._detectors.get(model_name)
+            if shared is None:
+                shared = self._detectors[model_name] = _SharedDetector(model_name)
+        return shared.get()
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while not self._shutdown and self._queued == 0:
+                    self._condition.wait()
+                if self._shutdown and self._queued == 0:
+                    return
+                ticket = self._next_ticket()
+                self._running += 1
+            try:
+                if not ticket.future.set_running_or_notify_cancel():
+                    continue
+                ticket.started_at = time.time()
+                try:
+                    detector, lock = self._get_detector(ticket.model_name)
+                    kwargs = {'conf_thres': ticket.conf_thres, 'iou_thres': ticket.iou_thres,
+                              'preview_size': ticket.preview_size}
+                    progress = ensure_reporter(ticket.progress)
+                    progress.finish(STAGE_QUEUE)
+                    images = ticket.image if ticket.batch else [ticket.image]
+                    if hasattr(detector, 'detect_batch'):
+                        # 本地检测器逐阶段发布进度
+                        if ticket.progress is not None:
+                            kwargs['progress'] = ticket.progress
+                        with lock:
+                            results = detector.detect_batch(images, **kwargs)
+                    else:
+                        # 推理服务客户端只能按图片发布进度
+                        results = []
+                        with progress.stage(STAGE_INFER, len(images)):
+                            for image in images:
+                                results.append(detector.detect(image, **kwargs))
+                                progress.advance(STAGE_INFER)
+                    ticket.future.set_result(results if ticket.batch else results[0])
+                except Exception as e:
+                    logger.error(f"推理请求失败: {str(e)}")
+                    ticket.future.set_exception(e)
+            finally:
+                ticket.finished_at = time.time()
+                ticket.image = None
+                ticket.progress = None
+                with self._condition:
+                    self._running -= 1
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """进程内所有Streamlit会话共享的推理执行器，并发数和队列长度可通过环境变量配置"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = InferenceExecutor(
+                max_workers=int(os.environ.get(WORKERS_ENV, 2)),
+                max_queue_size=int(os.environ.get(QUEUE_SIZE_ENV, 64))
+            )
+        return _executor
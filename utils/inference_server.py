@@ -0,0 +1,330 @@
+"""独立的本地推理服务
+
+将 ModelDetector 封装为 HTTP / Unix socket 服务。并发到达的请求会被收集为微批次
+（受最大批次大小和最大等待时间约束），一次批量前向推理后再按请求拆分结果返回。
+
+启动方式：
+    python -m utils.inference_server --model build_V8n.pt --port 8600
+    python -m utils.inference_server --model build_V8n.pt --unix-socket /tmp/building.sock
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.model_detector import ModelDetector
+from utils.shm_transport import RingRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """把并发请求合并为微批次并在单个工作线程中执行批量推理"""
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size必须是正整数")
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._deferred = []
+        self._stopped = threading.Event()
+        self.stats = {'requests': 0, 'batches': 0, 'max_batch': 0}
+        self._worker = threading.Thread(target=self._run, name=f"micro-batcher-{detector.model_name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, image, conf_thres=0.5, iou_thres=0.45, preview_size=None):
+        """提交单张图片，返回 concurrent.futures.Future，结果为 (detections, plotted_image)"""
+        if self._stopped.is_set():
+            raise RuntimeError("推理服务已停止")
+        future = Future()
+        key = (conf_thres, iou_thres, tuple(preview_size) if preview_size else None)
+        self._queue.put((key, image, future))
+        return future
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def _next_batch(self):
+        """收集一个微批次：阈值参数相同的请求才能合并，其余请求留到下一批"""
+        if self._deferred:
+            first = self._deferred.pop(0)
+        else:
+            first = self._queue.get()
+            if first is None:
+                return None
+        batch = [first]
+        remaining = []
+        for item in self._deferred:
+            if item[0] == first[0] and len(batch) < self.max_batch_size:
+                batch.append(item)
+            else:
+                remaining.append(item)
+        self._deferred = remaining
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            if item[0] == first[0]:
+                batch.append(item)
+            else:
+                self._deferred.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._process(batch)
+            if self._stopped.is_set() and self._queue.empty() and not self._deferred:
+                break
+
+    def _process(self, batch):
+        conf_thres, iou_thres, preview_size = batch[0][0]
+        images, futures = [], []
+        for _, image, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                images.append(self.detector.preprocess_image(image))
+                futures.append(future)
+            except Exception as e:
+                future.set_exception(e)
+        if not images:
+            return
+
+        self.stats['requests'] += len(images)
+        self.stats['batches'] += 1
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(images))
+        try:
+            outputs = self.detector.forward_batch(images, conf_thres=conf_thres, iou_thres=iou_thres)
+        except Exception as e:
+            logger.error(f"批量推理失败: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        for image, output, future in zip(images, outputs, futures):
+            try:
+                future.set_result(self.detector.postprocess(image, output, conf_thres=conf_thres, preview_size=preview_size))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class InferenceService:
+    """按模型名称懒加载检测器，每个模型对应一个微批处理器"""
+
+    def __init__(self, max_batch_size=8, max_wait_ms=10, device=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.device = device
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def get_batcher(self, model_name):
+        with self._lock:
+            if model_name not in self._batchers:
+                detector = ModelDetector(model_name, device=self.device)
+                self._batchers[model_name] = MicroBatcher(detector, self.max_batch_size, self.max_wait_ms)
+            return self._batchers[model_name]
+
+    def detect(self, model_name, image, conf_thres=0.5, iou_thres=0.45, preview_size=None):
+        return self.get_batcher(model_name).submit(image, conf_thres, iou_thres, preview_size).result()
+
+    def health(self):
+        with self._lock:
+            models = {name: {'model_type': batcher.detector.model_type, **batcher.stats}
+                      for name, batcher in self._batchers.items()}
+        return {'status': 'ok', 'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms, 'models': models}
+
+    def shutdown(self):
+        with self._lock:
+            for batcher in self._batchers.values():
+                batcher.stop()
+            self._batchers.clear()
+
+
+def encode_array(array):
+    """无损编码可视化结果（保持原有的通道顺序）"""
+    ok, buffer = cv2.imencode('.png', array)
+    if not ok:
+        raise ValueError("可视化图像编码失败")
+    return base64.b64encode(buffer.tobytes()).decode('ascii')
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """POST /detect?model=...&conf=...&iou=... 请求体为原始图片字节；
+    POST /detect_shm 请求体为JSON，图片与结果通过共享内存环传递；GET /health 返回服务状态"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket 的客户端地址为空字符串
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s" % (self.address_string(), format % args))
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, self.server.service.health())
+        else:
+            self._send_json(404, {'error': f"未知路径: {self.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/detect_shm':
+            self._detect_shm()
+            return
+        if url.path != '/detect':
+            self._send_json(404, {'error': f"未知路径: {self.path}"})
+            return
+        params = parse_qs(url.query)
+        try:
+            model_name = params['model'][0]
+            conf_thres = float(params.get('conf', [0.5])[0])
+            iou_thres = float(params.get('iou', [0.45])[0])
+            preview_size = params.get('preview', [None])[0]
+            if preview_size:
+                preview_size = tuple(int(v) for v in preview_size.split('x'))
+            length = int(self.headers.get('Content-Length', 0))
+            image = io.BytesIO(self.rfile.read(length))
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {'error': f"请求参数错误: {str(e)}"})
+            return
+
+        try:
+            detections, plotted_image = self.server.service.detect(model_name, image, conf_thres, iou_thres, preview_size)
+        except FileNotFoundError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.error(f"推理请求失败: {str(e)}")
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'detections': detections, 'plotted_image': encode_array(plotted_image)})
+
+    def _detect_shm(self):
+        """图片以RGB uint8数组形式放在客户端的共享内存槽位中，可视化结果和分割掩码写回客户端预留的槽位"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            ring = self.server.rings.get(**request['ring'])
+            image = Image.fromarray(ring.view(request['slot']))
+            preview_size = tuple(request['preview']) if request.get('preview') else None
+        except (KeyError, ValueError, TypeError, FileNotFoundError) as e:
+            self._send_json(400, {'error': f"请求参数错误: {str(e)}"})
+            return
+
+        try:
+            detections, plotted_image = self.server.service.detect(
+                request['model'], image, request.get('conf', 0.5), request.get('iou', 0.45), preview_size)
+            ring.write(request['reply_slot'], plotted_image)
+            masks = 0
+            mask_slot = request.get('mask_slot')
+            for detection in detections:
+                if 'segmentation' in detection and mask_slot is not None and masks == 0:
+                    ring.write(mask_slot, np.asarray(detection.pop('segmentation'), dtype=np.float32).squeeze())
+                    detection['segmentation_slot'] = mask_slot
+                    masks += 1
+        except FileNotFoundError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.error(f"共享内存推理请求失败: {str(e)}")
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'detections': detections})
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        self.rings = RingRegistry()
+        super().__init__(address, InferenceRequestHandler)
+
+
+class InferenceUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        self.rings = RingRegistry()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, InferenceRequestHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="建筑物检测推理服务（动态微批处理）")
+    parser.add_argument('--model', action='append', default=[], help="启动时预加载的模型文件名，可重复指定")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--unix-socket', help="监听Unix socket路径而非TCP端口")
+    parser.add_argument('--max-batch-size', type=int, default=8, help="单个微批次的最大图片数")
+    parser.add_argument('--max-wait-ms', type=float, default=10, help="凑批的最长等待时间（毫秒）")
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = InferenceService(args.max_batch_size, args.max_wait_ms, args.device)
+    for model_name in args.model:
+        service.get_batcher(model_name)
+
+    if args.unix_socket:
+        server = InferenceUnixServer(args.unix_socket, service)
+        print(f"推理服务已启动: unix://{args.unix_socket}")
+    else:
+        server = InferenceHTTPServer((args.host, args.port), service)
+        print(f"推理服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.rings.close_all()
+        service.shutdown()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,499 @@
+import sqlite3
+import json
+import time
+import uuid
+import logging
+from pathlib import Path
+from sqlite3 import Error as SQLiteError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_DB = Path(__file__).parent.parent / 'data' / 'jobs.db'
+# WAL依赖同一主机上的共享内存索引，数据库位于NFS/SMB等共享文件系统时不安全，默认使用回滚日志
+DEFAULT_JOURNAL_MODE = 'DELETE'
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'WAL')
+
+# 任务状态
+TASK_QUEUED = 'queued'
+TASK_LEASED = 'leased'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+
+# 作业状态
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+
+
+class JobManager:
+    """基于SQLite文件的批量检测作业队列
+
+    一个作业拆分为若干图片任务存放在 job_tasks 表中。任意数量的工作进程（可以位于共享同一文件系统的多台机器上）
+    通过租约领取任务并定期续约，租约过期未完成的任务会被重新放回队列。不依赖任何外部消息中间件。
+
+    租约到期时间由领取和续约任务的机器按本机 time.time() 写入，再由其他机器按各自的时钟判断是否过期，
+    多台机器共享数据库时各机器的时钟必须同步（NTP），时钟偏差应远小于租约时长，否则任务可能被提前接管而重复处理。
+    journal_mode 默认为 DELETE；只有所有工作进程都在同一台机器上时才可以使用 WAL。
+    """
+
+    def __init__(self, db_path=None, journal_mode=DEFAULT_JOURNAL_MODE):
+        journal_mode = journal_mode.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"不支持的日志模式: {journal_mode}")
+        self.journal_mode = journal_mode
+        try:
+            self.db_path = Path(db_path) if db_path else DEFAULT_JOB_DB
+            logger.info(f"初始化作业队列数据库，路径: {self.db_path}")
+            self._init_db()
+        except (SQLiteError, PermissionError, OSError) as e:
+            logger.error(f"作业队列数据库初始化失败: {str(e)}")
+            raise Exception(f"作业队列数据库初始化失败: {str(e)}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        """创建作业表和任务表（如果不存在）"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            self._set_journal_mode(conn)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    status TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    conf_thres REAL NOT NULL,
+                    iou_thres REAL NOT NULL,
+                    total_tasks INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    params TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL REFERENCES jobs(id),
+                    seq INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    name TEXT,
+                    content_hash TEXT,
+                    status TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    heartbeat_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    UNIQUE (job_id, seq)
+                )
+            ''')
+            self._migrate(conn)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_tasks_status ON job_tasks (job_id, status, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_tasks_lease ON job_tasks (status, lease_expires)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_tasks_hash ON job_tasks (job_id, content_hash)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, created_at)')
+        finally:
+            conn.close()
+
+    def _set_journal_mode(self, conn):
+        """日志模式持久保存在数据库文件中；旧版本创建的WAL数据库在没有其他连接时切换回来"""
+        current = conn.execute('PRAGMA journal_mode').fetchone()[0].upper()
+        if current == self.journal_mode:
+            return
+        try:
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        except SQLiteError as e:
+            # 退出WAL需要独占数据库，其他工作进程仍在运行时保持原模式
+            logger.warning(f"无法把日志模式从 {current} 切换为 {self.journal_mode}: {str(e)}")
+
+    def _migrate(self, conn):
+        """为旧版本创建的表补充新增的列"""
+        for table, new_columns in (('jobs', ('owner',)), ('job_tasks', ('name', 'content_hash'))):
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            for column in new_columns:
+                if column not in columns:
+                    logger.info(f"{table} 表添加列: {column}")
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+
+    @staticmethod
+    def _task_fields(source):
+        """任务来源可以是路径，也可以是包含 source、name、content_hash 的字典"""
+        if isinstance(source, dict):
+            return str(source['source']), source.get('name') or Path(source['source']).name, source.get('content_hash')
+        return str(source), Path(source).name, None
+
+    def create_job(self, model_name, sources, conf_thres=0.5, iou_thres=0.8, params=None, chunk_size=1000,
+                   job_id=None, owner=None):
+        """创建作业并把图片任务分批写入队列，返回作业ID；owner 用于按提交者列出作业"""
+        job_id = job_id or uuid.uuid4().hex
+        logger.info(f"开始创建作业 {job_id}，模型: {model_name}")
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO jobs (id, created_at, status, model_name, conf_thres, iou_thres, owner, params) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, time.time(), JOB_PENDING, model_name, conf_thres, iou_thres, owner, json.dumps(params or {}))
+            )
+            total = 0
+            rows = []
+            for seq, source in enumerate(sources):
+                rows.append((job_id, seq, *self._task_fields(source), TASK_QUEUED))
+                if len(rows) >= chunk_size:
+                    self._insert_tasks(conn, rows)
+                    total += len(rows)
+                    rows = []
+            if rows:
+                self._insert_tasks(conn, rows)
+                total += len(rows)
+            conn.execute('UPDATE jobs SET total_tasks = ? WHERE id = ?', (total, job_id))
+            conn.execute('COMMIT')
+            logger.info(f"成功创建作业 {job_id}，任务数: {total}")
+            return job_id
+        except SQLiteError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"创建作业失败: {str(e)}")
+            raise Exception(f"创建作业失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def _insert_tasks(self, conn, rows):
+        conn.executemany('INSERT INTO job_tasks (job_id, seq, source, name, content_hash, status) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def resume_job(self, job_id, sources=None):
+        """恢复中断的作业
+
+        失败和租约已过期的任务重新入队；传入 sources 时按内容哈希跳过已完成或已在队列中的图片，
+        其余图片作为新任务追加。返回 {'requeued', 'skipped', 'added'}。
+        """
+        logger.info(f"开始恢复作业 {job_id}")
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM jobs WHERE id = ?', (job_id,)).fetchone() is None:
+                raise ValueError(f"作业不存在: {job_id}")
+            self.requeue_expired(conn)
+            requeued = conn.execute(
+                'UPDATE job_tasks SET status = ?, attempts = 0, error = NULL, finished_at = NULL '
+                'WHERE job_id = ? AND status = ?', (TASK_QUEUED, job_id, TASK_FAILED)
+            ).rowcount
+            skipped = added = 0
+            if sources is not None:
+                known = {row['content_hash'] for row in conn.execute(
+                    'SELECT content_hash FROM job_tasks WHERE job_id = ? AND content_hash IS NOT NULL', (job_id,))}
+                next_seq = conn.execute('SELECT COALESCE(MAX(seq), -1) + 1 FROM job_tasks WHERE job_id = ?',
+                                        (job_id,)).fetchone()[0]
+                rows = []
+                for source in sources:
+                    source, name, content_hash = self._task_fields(source)
+                    if content_hash is not None and content_hash in known:
+                        skipped += 1
+                        continue
+                    known.add(content_hash)
+                    rows.append((job_id, next_seq + len(rows), source, name, content_hash, TASK_QUEUED))
+                if rows:
+                    self._insert_tasks(conn, rows)
+                added = len(rows)
+            total = conn.execute('SELECT COUNT(*) FROM job_tasks WHERE job_id = ?', (job_id,)).fetchone()[0]
+            pending = conn.execute('SELECT COUNT(*) FROM job_tasks WHERE job_id = ? AND status IN (?, ?)',
+                                   (job_id, TASK_QUEUED, TASK_LEASED)).fetchone()[0]
+            status = JOB_PENDING if pending else JOB_COMPLETED
+            conn.execute('UPDATE jobs SET status = ?, total_tasks = ?, finished_at = CASE WHEN ? THEN NULL '
+                         'ELSE COALESCE(finished_at, ?) END WHERE id = ?',
+                         (status, total, pending > 0, time.time(), job_id))
+            conn.execute('COMMIT')
+            logger.info(f"作业 {job_id} 已恢复：重新入队 {requeued}，跳过已完成 {skipped}，新增 {added}")
+            return {'requeued': requeued, 'skipped': skipped, 'added': added}
+        except SQLiteError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"恢复作业失败: {str(e)}")
+            raise Exception(f"恢复作业失败: {str(e)}")
+        except ValueError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def requeue_expired(self, conn=None):
+        """把租约已过期的任务放回队列，返回重新入队的任务数"""
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            cursor = conn.execute(
+                'UPDATE job_tasks SET status = ?, lease_owner = NULL, lease_expires = NULL '
+                'WHERE status = ? AND lease_expires < ?',
+                (TASK_QUEUED, TASK_LEASED, time.time())
+            )
+            if cursor.rowcount:
+                logger.warning(f"{cursor.rowcount} 个任务租约过期，已重新入队")
+            return cursor.rowcount
+        finally:
+            if own_conn:
+                conn.close()
+
+    def claim_tasks(self, worker_id, limit=4, lease_seconds=120, job_id=None):
+        """领取同一作业中最多 limit 个排队任务，返回任务列表（包含作业的模型和阈值参数）"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self.requeue_expired(conn)
+            # 按创建时间优先处理较早的作业
+            query = ('SELECT j.id FROM jobs j WHERE j.status IN (?, ?) AND EXISTS '
+                     '(SELECT 1 FROM job_tasks t WHERE t.job_id = j.id AND t.status = ?)')
+            params = [JOB_PENDING, JOB_RUNNING, TASK_QUEUED]
+            if job_id:
+                query += ' AND j.id = ?'
+                params.append(job_id)
+            query += ' ORDER BY j.created_at LIMIT 1'
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return []
+            claimed_job = row['id']
+            now = time.time()
+            tasks = conn.execute(
+                'SELECT id FROM job_tasks WHERE job_id = ? AND status = ? ORDER BY seq LIMIT ?',
+                (claimed_job, TASK_QUEUED, limit)
+            ).fetchall()
+            task_ids = [task['id'] for task in tasks]
+            conn.executemany(
+                'UPDATE job_tasks SET status = ?, lease_owner = ?, lease_expires = ?, heartbeat_at = ?, '
+                'started_at = ?, attempts = attempts + 1 WHERE id = ?',
+                [(TASK_LEASED, worker_id, now + lease_seconds, now, now, task_id) for task_id in task_ids]
+            )
+            conn.execute('UPDATE jobs SET status = ? WHERE id = ? AND status = ?', (JOB_RUNNING, claimed_job, JOB_PENDING))
+            placeholders = ','.join('?' * len(task_ids))
+            claimed = conn.execute(
+                f'SELECT t.id, t.job_id, t.seq, t.source, t.name, t.content_hash, t.attempts, j.model_name, j.conf_thres, j.iou_thres '
+                f'FROM job_tasks t JOIN jobs j ON j.id = t.job_id WHERE t.id IN ({placeholders}) ORDER BY t.seq',
+                task_ids
+            ).fetchall()
+            conn.execute('COMMIT')
+            return [dict(task) for task in claimed]
+        except SQLiteError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"领取任务失败: {str(e)}")
+            raise Exception(f"领取任务失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def heartbeat(self, worker_id, task_ids, lease_seconds=120):
+        """为工作进程持有的任务续约，返回续约成功的任务数"""
+        if not task_ids:
+            return 0
+        now = time.time()
+        conn = self._connect()
+        try:
+            placeholders = ','.join('?' * len(task_ids))
+            cursor = conn.execute(
+                f'UPDATE job_tasks SET lease_expires = ?, heartbeat_at = ? '
+                f'WHERE lease_owner = ? AND status = ? AND id IN ({placeholders})',
+                [now + lease_seconds, now, worker_id, TASK_LEASED] + list(task_ids)
+            )
+            return cursor.rowcount
+        except SQLiteError as e:
+            logger.error(f"任务续约失败: {str(e)}")
+            raise Exception(f"任务续约失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def complete_task(self, worker_id, task_id, result):
+        """提交任务结果；租约已被其他工作进程接管时返回False"""
+        return self._finish_task(worker_id, task_id, TASK_DONE, result=json.dumps(result, ensure_ascii=False))
+
+    def fail_task(self, worker_id, task_id, error, max_attempts=3):
+        """任务执行失败：未达到最大尝试次数时重新入队，否则标记为失败"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT attempts FROM job_tasks WHERE id = ? AND lease_owner = ? AND status = ?',
+                               (task_id, worker_id, TASK_LEASED)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return False
+            if row['attempts'] < max_attempts:
+                conn.execute('UPDATE job_tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, error = ? '
+                             'WHERE id = ?', (TASK_QUEUED, str(error), task_id))
+                conn.execute('COMMIT')
+                return True
+            conn.execute('COMMIT')
+        except SQLiteError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise Exception(f"更新任务状态失败: {str(e)}")
+        finally:
+            conn.close()
+        return self._finish_task(worker_id, task_id, TASK_FAILED, error=str(error))
+
+    def _finish_task(self, worker_id, task_id, status, result=None, error=None):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute(
+                'UPDATE job_tasks SET status = ?, result = ?, error = ?, finished_at = ?, '
+                'lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ? AND status = ?',
+                (status, result, error, time.time(), task_id, worker_id, TASK_LEASED)
+            )
+            if cursor.rowcount:
+                self._update_job_status(conn, task_id)
+            conn.execute('COMMIT')
+            return cursor.rowcount > 0
+        except SQLiteError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"提交任务结果失败: {str(e)}")
+            raise Exception(f"提交任务结果失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def _update_job_status(self, conn, task_id):
+        """所有任务都已结束时把作业标记为完成"""
+        job_id = conn.execute('SELECT job_id FROM job_tasks WHERE id = ?', (task_id,)).fetchone()['job_id']
+        remaining = conn.execute('SELECT COUNT(*) FROM job_tasks WHERE job_id = ? AND status IN (?, ?)',
+                                 (job_id, TASK_QUEUED, TASK_LEASED)).fetchone()[0]
+        if remaining == 0:
+            conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                         (JOB_COMPLETED, time.time(), job_id, JOB_RUNNING))
+
+    def get_job(self, job_id):
+        """获取作业信息及各状态任务数"""
+        conn = self._connect()
+        try:
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            job = dict(job)
+            counts = conn.execute('SELECT status, COUNT(*) AS count FROM job_tasks WHERE job_id = ? GROUP BY status',
+                                  (job_id,)).fetchall()
+            job['counts'] = {row['status']: row['count'] for row in counts}
+            job['params'] = json.loads(job['params'] or '{}')
+            return job
+        except SQLiteError as e:
+            logger.error(f"获取作业信息失败: {str(e)}")
+            raise Exception(f"获取作业信息失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def get_job_status(self, job_id, recent_failures=5, rate_window=50):
+        """轻量的作业进度查询：完成数/总数、吞吐量、预计剩余时间和最近的失败记录
+
+        吞吐量根据最近 rate_window 个完成任务的完成时间计算，作业中途暂停后恢复也能反映当前速度。
+        """
+        job = self.get_job(job_id)
+        if job is None:
+            return None
+        conn = self._connect()
+        try:
+            finished_times = [row[0] for row in conn.execute(
+                'SELECT finished_at FROM job_tasks WHERE job_id = ? AND finished_at IS NOT NULL '
+                'ORDER BY finished_at DESC LIMIT ?', (job_id, rate_window))]
+            failures = conn.execute(
+                'SELECT source, name, status, attempts, error FROM job_tasks WHERE job_id = ? AND error IS NOT NULL '
+                'ORDER BY COALESCE(finished_at, started_at) DESC LIMIT ?', (job_id, recent_failures)
+            ).fetchall()
+        except SQLiteError as e:
+            logger.error(f"获取作业进度失败: {str(e)}")
+            raise Exception(f"获取作业进度失败: {str(e)}")
+        finally:
+            conn.close()
+
+        counts = job['counts']
+        done = counts.get(TASK_DONE, 0) + counts.get(TASK_FAILED, 0)
+        remaining = counts.get(TASK_QUEUED, 0) + counts.get(TASK_LEASED, 0)
+        throughput = None
+        if len(finished_times) >= 2 and finished_times[0] > finished_times[-1]:
+            throughput = (len(finished_times) - 1) / (finished_times[0] - finished_times[-1])
+        eta = remaining / throughput if throughput and job['status'] in (JOB_PENDING, JOB_RUNNING) else None
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'model_name': job['model_name'],
+            'created_at': job['created_at'],
+            'finished_at': job['finished_at'],
+            'done': done,
+            'total': job['total_tasks'],
+            'succeeded': counts.get(TASK_DONE, 0),
+            'failed': counts.get(TASK_FAILED, 0),
+            'running': counts.get(TASK_LEASED, 0),
+            'queued': counts.get(TASK_QUEUED, 0),
+            'throughput': throughput,
+            'eta': eta,
+            'recent_failures': [dict(row) for row in failures]
+        }
+
+    def list_jobs(self, owner=None, limit=20):
+        """按创建时间倒序列出作业及各状态任务数，指定 owner 时只列出该提交者的作业"""
+        conn = self._connect()
+        try:
+            query = 'SELECT * FROM jobs'
+            params = []
+            if owner is not None:
+                query += ' WHERE owner = ?'
+                params.append(owner)
+            query += ' ORDER BY created_at DESC LIMIT ?'
+            params.append(limit)
+            jobs = [dict(row) for row in conn.execute(query, params)]
+            for job in jobs:
+                counts = conn.execute('SELECT status, COUNT(*) AS count FROM job_tasks WHERE job_id = ? GROUP BY status',
+                                      (job['id'],)).fetchall()
+                job['counts'] = {row['status']: row['count'] for row in counts}
+                job['params'] = json.loads(job['params'] or '{}')
+            return jobs
+        except SQLiteError as e:
+            logger.error(f"获取作业列表失败: {str(e)}")
+            raise Exception(f"获取作业列表失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def cancel_job(self, job_id):
+        """取消未结束的作业：排队中的任务不再被领取，正在执行的任务完成后结束；返回是否取消成功"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)',
+                                  (JOB_CANCELLED, time.time(), job_id, JOB_PENDING, JOB_RUNNING))
+            if cursor.rowcount:
+                logger.info(f"作业 {job_id} 已取消")
+            return cursor.rowcount > 0
+        except SQLiteError as e:
+            logger.error(f"取消作业失败: {str(e)}")
+            raise Exception(f"取消作业失败: {str(e)}")
+        finally:
+            conn.close()
+
+    def iter_results(self, job_id, batch_size=500):
+        """按输入顺序逐批读取已结束任务的结果，避免一次性加载全部结果"""
+        last_seq = -1
+        while True:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    'SELECT seq, source, name, status, result, error FROM job_tasks '
+                    'WHERE job_id = ? AND seq > ? AND status IN (?, ?) ORDER BY seq LIMIT ?',
+                    (job_id, last_seq, TASK_DONE, TASK_FAILED, batch_size)
+                ).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                return
+            for row in rows:
+                if row['status'] == TASK_DONE:
+                    result = json.loads(row['result'])
+                else:
+                    result = {'path': row['source'], 'error': row['error']}
+                result.setdefault('name', row['name'])
+                result.setdefault('seq', row['seq'])
+                yield result
+            last_seq = rows[-1]['seq']
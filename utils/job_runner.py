@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+from pathlib import Path
+
+from utils.batch_io import load_image
+from utils.inference_executor import get_executor, QueueFullError
+from utils.job_manager import JobManager, JOB_COMPLETED
+from utils.job_worker import JobWorker
+from utils.prefilter import SKIP_BLANK, SKIP_DUPLICATE
+from utils.thumbnails import ThumbnailCache
+
+logger = logging.getLogger(__name__)
+
+# 批量检测页面上传的图片和预览结果按作业保存在该目录下
+JOB_DATA_DIR = Path(__file__).parent.parent / 'data' / 'jobs'
+
+# 当前进程中正在运行的作业，job_id -> BackgroundJobRunner
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_job_dir(job_id):
+    return JOB_DATA_DIR / job_id
+
+
+# 检测可视化结果只保存缩略图，结果画廊可以分页浏览任意一张
+result_thumbnails = ThumbnailCache(size=320)
+
+
+def get_result_thumbnail_path(job_id, seq):
+    return get_job_dir(job_id) / 'thumbnails' / f"{seq:05d}{result_thumbnails.extension}"
+
+
+SKIP_LABELS = {SKIP_BLANK: '空白跳过', SKIP_DUPLICATE: '重复复用'}
+
+
+def results_to_table(rows):
+    """把作业结果转换为页面表格和历史记录使用的格式，检测失败的图片不计入"""
+    return [{
+        '文件名': row.get('name') or Path(row['path']).name,
+        '建筑物类型': row['building_type'],
+        '检测目标数量': row['detection_count'],
+        '置信度': row['confidence'],
+        '检测时间': f"{row['process_time']:.1f}秒",
+        '预筛选': SKIP_LABELS.get(row.get('skipped'), '')
+    } for row in rows if 'error' not in row]
+
+
+class BackgroundJobRunner(JobWorker):
+    """在Streamlit进程的后台线程中执行单个作业
+
+    推理通过进程级推理执行器排队，与其他会话公平共享计算资源；每张图片的结果完成后立即提交到作业数据库，
+    关闭页面不会中断作业，进程退出后可以通过 resume_job 恢复。
+    """
+
+    def __init__(self, job_manager, job_id, session_id, batch_size=4):
+        super().__init__(job_manager, worker_id=f"{socket.gethostname()}-{os.getpid()}-{job_id[:8]}",
+                         batch_size=batch_size, job_id=job_id)
+        self.session_id = session_id
+        self.thread = None
+
+    def _submit(self, model_name, images, conf_thres, iou_thres):
+        while True:
+            try:
+                return get_executor().submit_batch(self.session_id, model_name, images,
+                                                   conf_thres=conf_thres, iou_thres=iou_thres, progress=self.progress)
+            except QueueFullError:
+                if self._stop.wait(0.5):
+                    raise RuntimeError("作业已停止")
+
+    def _load(self, task):
+        return load_image(task['source'])
+
+    def _infer(self, task, images):
+        return self._submit(task['model_name'], images, task['conf_thres'], task['iou_thres']).result()
+
+    def _on_result(self, task, image, plotted_image, reference=None):
+        path = get_result_thumbnail_path(task['job_id'], task['seq'])
+        try:
+            reference_path = get_result_thumbnail_path(task['job_id'], reference) if reference is not None else None
+            if plotted_image is not None:
+                result_thumbnails.save_array(plotted_image, path)
+            elif reference_path is not None and reference_path.exists():
+                # 近似重复的图片直接复用参考图片的结果缩略图
+                shutil.copyfile(reference_path, path)
+            else:
+                result_thumbnails.save(image, path)
+        except Exception as e:
+            logger.warning(f"保存结果缩略图失败: {str(e)}")
+
+    def _run_job(self):
+        try:
+            self.run(exit_when_idle=True)
+            job = self.job_manager.get_job(self.job_id)
+            # 只有完成了任务的运行器保存历史记录，避免恢复后的空运行重复保存
+            if job and job['status'] == JOB_COMPLETED and self.stats['completed']:
+                self._save_history()
+        except Exception as e:
+            logger.error(f"作业 {self.job_id} 执行失败: {str(e)}")
+        finally:
+            with _runners_lock:
+                if _runners.get(self.job_id) is self:
+                    del _runners[self.job_id]
+
+    def _save_history(self):
+        from utils.db_manager import DBManager
+        results = results_to_table(self.job_manager.iter_results(self.job_id))
+        DBManager().add_batch_detection(
+            total_images=len(results),
+            success_count=len([r for r in results if r['检测目标数量'] > 0]),
+            failed_count=len([r for r in results if r['检测目标数量'] == 0]),
+            confidence=results[-1]['置信度'] if results else 0,
+            batch_result=results
+        )
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run_job, daemon=True, name=f"job-{self.job_id[:8]}")
+        self.thread.start()
+        return self
+
+
+def start_job(job_id, session_id, job_manager=None, batch_size=4):
+    """在后台线程中运行作业；该作业已在当前进程中运行时直接返回已有的运行器"""
+    with _runners_lock:
+        runner = _runners.get(job_id)
+        if runner is None:
+            runner = BackgroundJobRunner(job_manager or JobManager(), job_id, session_id, batch_size=batch_size)
+            _runners[job_id] = runner
+            runner.start()
+        return runner
+
+
+def cancel_job(job_id, job_manager=None):
+    """取消作业并停止当前进程中对应的运行器，正在推理的批次完成后退出"""
+    cancelled = (job_manager or JobManager()).cancel_job(job_id)
+    with _runners_lock:
+        runner = _runners.get(job_id)
+    if runner is not None:
+        runner.stop()
+    return cancelled
+
+
+def is_job_running(job_id):
+    with _runners_lock:
+        return job_id in _runners
+
+
+def get_job_progress(job_id):
+    """当前进程中运行该作业的最近一个阶段进度事件，作业未在当前进程中运行时返回None"""
+    with _runners_lock:
+        runner = _runners.get(job_id)
+    return runner.progress.latest() if runner is not None else None
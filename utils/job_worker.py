@@ -0,0 +1,328 @@
+"""作业队列工作进程与命令行
+
+    python -m utils.job_worker submit data/tiles --model build_V8n.pt --db /mnt/shared/jobs.db
+    python -m utils.job_worker work --db /mnt/shared/jobs.db --exit-when-idle
+    python -m utils.job_worker status <job_id> --db /mnt/shared/jobs.db
+    python -m utils.job_worker resume <job_id> --db /mnt/shared/jobs.db
+    python -m utils.job_worker list --db /mnt/shared/jobs.db
+    python -m utils.job_worker cancel <job_id> --db /mnt/shared/jobs.db
+    python -m utils.job_worker export <job_id> results.jsonl --db /mnt/shared/jobs.db
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+
+from utils.batch_io import iter_image_paths, make_result_row, open_result_writer, open_source, absolute_source
+from utils.batch_pipeline import BatchPipeline
+from utils.job_manager import JobManager, JOURNAL_MODES, DEFAULT_JOURNAL_MODE
+from utils.prefilter import PreFilter, SKIP_DUPLICATE
+from utils.progress_events import (ProgressReporter, STAGE_DECODE, STAGE_INFER, STAGE_PERSIST, STAGE_POSTPROCESS,
+                                   STAGE_PREPROCESS, STAGE_RENDER)
+
+# 单批任务的进度阶段：读取图片 -> 预处理/推理/后处理/绘制（检测器发布）-> 写入作业数据库
+BATCH_STAGES = (STAGE_DECODE, STAGE_PREPROCESS, STAGE_INFER, STAGE_POSTPROCESS, STAGE_RENDER, STAGE_PERSIST)
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """从作业队列领取任务并执行检测
+
+    后台心跳线程为当前持有的任务定期续约；工作进程异常退出时租约到期，任务由其他工作进程重新领取。
+    """
+
+    def __init__(self, job_manager, worker_id=None, lease_seconds=120, batch_size=4, max_attempts=3,
+                 detector_factory=None, job_id=None):
+        self.job_manager = job_manager
+        # 指定 job_id 时只处理该作业的任务
+        self.job_id = job_id
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.detector_factory = detector_factory
+        self._detectors = {}
+        self._prefilters = {}
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {'completed': 0, 'failed': 0, 'lost': 0}
+        # 当前批次的阶段进度，每领取一批任务重置一次
+        self.progress = ProgressReporter(BATCH_STAGES)
+
+    def _get_detector(self, model_name):
+        if model_name not in self._detectors:
+            factory = self.detector_factory
+            if factory is None:
+                from utils.model_detector import ModelDetector
+                factory = ModelDetector
+            logger.info(f"工作进程 {self.worker_id} 加载模型: {model_name}")
+            self._detectors[model_name] = factory(model_name)
+        return self._detectors[model_name]
+
+    def _heartbeat_loop(self):
+        # 续约间隔取租约时长的三分之一，留出两次重试的余量
+        interval = max(self.lease_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            with self._held_lock:
+                task_ids = list(self._held)
+            if not task_ids:
+                continue
+            try:
+                self.job_manager.heartbeat(self.worker_id, task_ids, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"工作进程 {self.worker_id} 续约失败: {str(e)}")
+
+    def _get_prefilter(self, job_id):
+        """按作业参数中的 prefilter 配置创建预筛选器，同一作业的任务共享去重记录"""
+        if job_id not in self._prefilters:
+            job = self.job_manager.get_job(job_id)
+            self._prefilters[job_id] = PreFilter.from_params(job['params'].get('prefilter') if job else None)
+        return self._prefilters[job_id]
+
+    def _load(self, task):
+        return self._get_detector(task['model_name']).preprocess_image(open_source(task['source']))
+
+    def _infer(self, task, images):
+        """检测同一作业的一批图片，返回 (detections, plotted_image) 列表；推理进度由 BatchPipeline 发布"""
+        detector = self._get_detector(task['model_name'])
+        outputs = detector.forward_batch(images, conf_thres=task['conf_thres'], iou_thres=task['iou_thres'])
+        return [detector.postprocess(image, output, conf_thres=task['conf_thres'])
+                for image, output in zip(images, outputs)]
+
+    def _on_result(self, task, image, plotted_image, reference=None):
+        """单张图片得到结果后在后处理线程中调用，plotted_image 为None表示被预筛选跳过；子类可用于保存可视化结果"""
+
+    def _run_tasks(self, tasks):
+        """通过 BatchPipeline 检测同一作业的一批任务，按领取顺序逐个产生 (task, row, error)
+
+        解码、推理与结果保存（_on_result）相互重叠，每个任务的结果产生后即可提交到作业数据库。
+        """
+        first = tasks[0]
+        prefilter = _TaskPrefilter(self._get_prefilter(first['job_id']), tasks)
+
+        def on_result(item):
+            if item.error is not None:
+                return
+            reference = item.extra.get('duplicate_of')
+            self._on_result(tasks[item.index], item.image, item.plotted_image,
+                            prefilter.seq(reference) if reference is not None else None)
+
+        pipeline = BatchPipeline(infer_batch=lambda images: self._infer(first, images), load_image=self._load,
+                                 batch_size=self.batch_size, decode_workers=min(len(tasks), 4),
+                                 on_result=on_result, prefilter=prefilter if prefilter.enabled else None,
+                                 progress=self.progress)
+        for item in pipeline.run([(task['name'], task) for task in tasks], total=len(tasks)):
+            task = tasks[item.index]
+            if item.error is not None:
+                yield task, None, item.error
+            else:
+                yield task, make_result_row(task['source'], item.detections, sum(item.timings.values()),
+                                            skipped=item.extra.get('skipped')), None
+
+    def run_once(self):
+        """领取并处理一批任务，返回处理的任务数"""
+        tasks = self.job_manager.claim_tasks(self.worker_id, limit=self.batch_size,
+                                             lease_seconds=self.lease_seconds, job_id=self.job_id)
+        if not tasks:
+            return 0
+        with self._held_lock:
+            self._held.update(task['id'] for task in tasks)
+        self.progress.reset()
+        try:
+            self.progress.start(STAGE_PERSIST, len(tasks))
+            for task, row, error in self._run_tasks(tasks):
+                if error is None:
+                    row['name'] = task['name']
+                    accepted = self.job_manager.complete_task(self.worker_id, task['id'], row)
+                else:
+                    logger.error(f"任务 {task['source']} 检测失败: {str(error)}")
+                    accepted = self.job_manager.fail_task(self.worker_id, task['id'], error, self.max_attempts)
+                if not accepted:
+                    # 租约已过期并被其他工作进程接管，丢弃本次结果
+                    self.stats['lost'] += 1
+                elif error is None:
+                    self.stats['completed'] += 1
+                else:
+                    self.stats['failed'] += 1
+                with self._held_lock:
+                    self._held.discard(task['id'])
+                self.progress.advance(STAGE_PERSIST)
+            self.progress.complete()
+        finally:
+            with self._held_lock:
+                self._held.difference_update(task['id'] for task in tasks)
+        return len(tasks)
+
+    def run(self, exit_when_idle=False, poll_interval=5.0):
+        """持续领取任务直到 stop() 被调用；exit_when_idle 为True时队列为空即退出"""
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        logger.info(f"工作进程 {self.worker_id} 开始领取任务")
+        try:
+            while not self._stop.is_set():
+                if self.run_once() == 0:
+                    if exit_when_idle:
+                        break
+                    self._stop.wait(poll_interval)
+        finally:
+            self._stop.set()
+            heartbeat.join()
+        logger.info(f"工作进程 {self.worker_id} 退出，完成 {self.stats['completed']}，失败 {self.stats['failed']}")
+        return self.stats
+
+    def stop(self):
+        self._stop.set()
+
+
+class _TaskPrefilter:
+    """BatchPipeline 以批内序号作为预筛选键，同一作业的预筛选器跨批次以任务序号 seq 去重，二者在此转换
+
+    批外的参考图片用负数表示；其检测结果已不可用时照常检测并补全参考结果，与 detect_with_prefilter 一致。
+    """
+
+    def __init__(self, prefilter, tasks):
+        self.prefilter = prefilter
+        self._seqs = [task['seq'] for task in tasks]
+        self._indices = {seq: index for index, seq in enumerate(self._seqs)}
+        self._fills = {}
+
+    @property
+    def enabled(self):
+        return self.prefilter is not None
+
+    def seq(self, key):
+        return self._seqs[key] if key >= 0 else -1 - key
+
+    def check(self, image, index):
+        action, reference = self.prefilter.check(image, self._seqs[index])
+        if action != SKIP_DUPLICATE:
+            return action, reference
+        if reference in self._indices:
+            return action, self._indices[reference]
+        if self.prefilter.lookup(reference) is not None:
+            return action, -1 - reference
+        self._fills[index] = reference
+        return None, None
+
+    def remember(self, index, detections):
+        self.prefilter.remember(self._seqs[index], detections)
+        if index in self._fills:
+            self.prefilter.remember(self._fills[index], detections)
+
+    def lookup(self, key):
+        return self.prefilter.lookup(self.seq(key))
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}小时{minutes}分" if hours else f"{minutes}分{seconds}秒"
+
+
+def format_job_status(status):
+    """把 JobManager.get_job_status 的结果格式化为一行文字"""
+    text = (f"作业 {status['id']} [{status['status']}] 模型 {status['model_name']}：已完成 {status['done']}/{status['total']}，"
+            f"成功 {status['succeeded']}，失败 {status['failed']}，处理中 {status['running']}，排队 {status['queued']}")
+    if status['throughput']:
+        text += f"，{status['throughput']:.2f} 张/秒"
+    if status['eta'] is not None:
+        text += f"，预计剩余 {format_duration(status['eta'])}"
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基于共享SQLite文件的分布式批量检测作业队列")
+    parser.add_argument('--db', help="作业数据库路径，多台机器需指向共享文件系统上的同一文件")
+    parser.add_argument('--journal-mode', choices=JOURNAL_MODES, default=DEFAULT_JOURNAL_MODE,
+                        help="SQLite日志模式；WAL只适用于所有工作进程位于同一台机器、数据库不在网络文件系统上的情况")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit = subparsers.add_parser('submit', help="创建作业")
+    submit.add_argument('inputs', nargs='+', help="图片目录、glob模式、ZIP压缩包或图片文件")
+    submit.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    submit.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    submit.add_argument('--iou', type=float, default=0.8, help="IOU阈值")
+    submit.add_argument('--prefilter', action='store_true',
+                        help="检测前预筛选：空白/nodata图片直接判定为无建筑物，近似重复图片复用已有结果")
+    submit.add_argument('--dedup-distance', type=int, default=4, help="近似重复判定的感知哈希汉明距离，小于0时不去重")
+
+    work = subparsers.add_parser('work', help="启动工作进程领取任务")
+    work.add_argument('--worker-id', help="工作进程标识，默认为 主机名-进程号")
+    work.add_argument('--job-id', help="只处理指定作业的任务")
+    work.add_argument('--batch-size', type=int, default=4, help="每次领取的任务数（同时也是前向推理批大小）")
+    work.add_argument('--lease-seconds', type=float, default=120, help="任务租约时长")
+    work.add_argument('--max-attempts', type=int, default=3, help="单个任务的最大尝试次数")
+    work.add_argument('--poll-interval', type=float, default=5.0, help="队列为空时的轮询间隔（秒）")
+    work.add_argument('--exit-when-idle', action='store_true', help="队列为空时退出")
+
+    status = subparsers.add_parser('status', help="查看作业进度")
+    status.add_argument('job_id')
+
+    jobs = subparsers.add_parser('list', help="列出最近的作业")
+    jobs.add_argument('--limit', type=int, default=20)
+
+    cancel = subparsers.add_parser('cancel', help="取消作业，排队中的任务不再被领取")
+    cancel.add_argument('job_id')
+
+    resume = subparsers.add_parser('resume', help="恢复中断的作业：失败和租约过期的任务重新入队")
+    resume.add_argument('job_id')
+
+    export = subparsers.add_parser('export', help="按输入顺序导出作业结果")
+    export.add_argument('job_id')
+    export.add_argument('output', help="结果文件路径（.jsonl 或 .parquet）")
+    export.add_argument('--format', choices=['jsonl', 'parquet'], help="输出格式，默认根据扩展名判断")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    manager = JobManager(args.db, journal_mode=args.journal_mode)
+
+    if args.command == 'submit':
+        # 保存绝对路径，其他机器需以相同路径挂载共享目录
+        sources = (absolute_source(path) for path in iter_image_paths(args.inputs))
+        params = {'prefilter': {'dedup_distance': args.dedup_distance}} if args.prefilter else None
+        job_id = manager.create_job(args.model, sources, conf_thres=args.conf, iou_thres=args.iou, params=params)
+        print(job_id)
+    elif args.command == 'work':
+        worker = JobWorker(manager, worker_id=args.worker_id, lease_seconds=args.lease_seconds,
+                           batch_size=args.batch_size, max_attempts=args.max_attempts, job_id=args.job_id)
+        stats = worker.run(exit_when_idle=args.exit_when_idle, poll_interval=args.poll_interval)
+        print(f"工作进程 {worker.worker_id} 完成 {stats['completed']} 个任务，失败 {stats['failed']} 个")
+    elif args.command == 'status':
+        status = manager.get_job_status(args.job_id)
+        if status is None:
+            parser.error(f"作业不存在: {args.job_id}")
+        print(format_job_status(status))
+        for failure in status['recent_failures']:
+            print(f"  失败: {failure['name'] or failure['source']}（第{failure['attempts']}次尝试）{failure['error']}")
+    elif args.command == 'list':
+        for job in manager.list_jobs(limit=args.limit):
+            finished = job['counts'].get('done', 0) + job['counts'].get('failed', 0)
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created_at']))
+            print(f"{job['id']}  {created}  {job['status']:<9}  {finished}/{job['total_tasks']}  {job['model_name']}")
+    elif args.command == 'cancel':
+        if manager.get_job(args.job_id) is None:
+            parser.error(f"作业不存在: {args.job_id}")
+        print("作业已取消" if manager.cancel_job(args.job_id) else "作业已结束，无需取消")
+    elif args.command == 'resume':
+        try:
+            result = manager.resume_job(args.job_id)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"已重新入队 {result['requeued']} 个任务，使用 work 命令继续处理")
+    elif args.command == 'export':
+        if manager.get_job(args.job_id) is None:
+            parser.error(f"作业不存在: {args.job_id}")
+        count = 0
+        with open_result_writer(args.output, args.format) as writer:
+            for row in manager.iter_results(args.job_id):
+                writer.write(row)
+                count += 1
+        print(f"已导出 {count} 条结果到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+from utils.mask_stitcher import MASK_THRESHOLD
+
+
+def align_probability(detections, size):
+    """把分割结果的概率图缩放到统一尺寸 size=(宽, 高)，多个分割结果取最大值；没有分割结果时返回None"""
+    width, height = size
+    prob = None
+    for detection in detections:
+        if 'segmentation' not in detection:
+            continue
+        current = np.asarray(detection['segmentation'], dtype=np.float32).squeeze()
+        if current.shape != (height, width):
+            current = cv2.resize(current, (width, height), interpolation=cv2.INTER_LINEAR)
+        prob = current if prob is None else np.maximum(prob, current)
+    return prob
+
+
+def block_any(mask, factor):
+    """按 factor x factor 的块做最大值池化，块内任一像素为True时该块为True"""
+    height, width = mask.shape
+    rows, cols = -(-height // factor), -(-width // factor)
+    padded = np.zeros((rows * factor, cols * factor), dtype=bool)
+    padded[:height, :width] = mask
+    return padded.reshape(rows, factor, cols, factor).any(axis=(1, 3))
+
+
+@dataclass
+class MaskDiff:
+    """掩码差分结果：added/removed 为统一尺寸下的新增/消失像素图，regions 为变化区域
+
+    每个区域包含 change（'added' 或 'removed'）、area、bbox、centroid、confidence，以及 touches：
+    区域是否与另一时期的建筑物相邻（相邻的新增/消失区域是扩建/缩小，而不是新建/拆除）。
+    """
+    added: np.ndarray
+    removed: np.ndarray
+    regions: list = field(default_factory=list)
+
+
+def diff_masks(earlier_prob, recent_prob, threshold=MASK_THRESHOLD, min_area=0, factor=8):
+    """比较两个时期对齐后的概率图，返回 MaskDiff
+
+    先在 factor 倍下采样的粗层级上找出有变化的块，没有变化的影像对在粗层级即可结束；否则按粗层级的连通域裁出
+    感兴趣区域，新增/消失像素、相邻判断的膨胀和连通域统计都只在这些区域内以全分辨率计算。粗层级按块取最大值，
+    任何全分辨率的变化像素都落在某个有变化的块中，精化结果与直接在全图上计算一致。
+    """
+    earlier = earlier_prob > threshold
+    recent = recent_prob > threshold
+    changed = earlier != recent
+    coarse = block_any(changed, factor)
+    # np.zeros 按需分配物理内存，未变化的区域不产生额外开销
+    result = MaskDiff(np.zeros(changed.shape, dtype=bool), np.zeros(changed.shape, dtype=bool))
+    if not coarse.any():
+        return result
+
+    # 相邻的建筑物像素，用于区分扩建/缩小与新建/拆除
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    count, coarse_labels, stats, _ = cv2.connectedComponentsWithStats(coarse.view(np.uint8), connectivity=8)
+    height, width = changed.shape
+    for label in range(1, count):
+        cx, cy, cw, ch = (int(v) for v in stats[label, :4])
+        x0, y0 = cx * factor, cy * factor
+        x1, y1 = min((cx + cw) * factor, width), min((cy + ch) * factor, height)
+        # 只保留属于当前粗层级连通域的块，重叠的外接框不会重复计数
+        own = np.repeat(np.repeat(coarse_labels[cy:cy + ch, cx:cx + cw] == label, factor, axis=0), factor, axis=1)
+        own = own[:y1 - y0, :x1 - x0]
+        crop = changed[y0:y1, x0:x1] & own
+        # 膨胀时向外多取1像素，裁剪区域边缘的相邻判断与全图膨胀一致
+        py0, px0 = max(y0 - 1, 0), max(x0 - 1, 0)
+        py1, px1 = min(y1 + 1, height), min(x1 + 1, width)
+        inner = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+        for change, mask, other, prob, output in (
+                ('added', recent, earlier, recent_prob, result.added),
+                ('removed', earlier, recent, earlier_prob, result.removed)):
+            pixels = crop & mask[y0:y1, x0:x1]
+            if not pixels.any():
+                continue
+            output[y0:y1, x0:x1] |= pixels
+            near = cv2.dilate(other[py0:py1, px0:px1].view(np.uint8), kernel).view(bool)[inner]
+            n, labels, region_stats, centroids = cv2.connectedComponentsWithStats(pixels.view(np.uint8),
+                                                                                  connectivity=8)
+            flat = labels.ravel()
+            confidence = np.bincount(flat, weights=prob[y0:y1, x0:x1].ravel(), minlength=n)
+            touches = np.bincount(flat, weights=near.ravel(), minlength=n) > 0
+            for k in range(1, n):
+                rx, ry, rw, rh, area = (int(v) for v in region_stats[k])
+                if area < min_area:
+                    continue
+                result.regions.append({
+                    'change': change,
+                    'area': area,
+                    'bbox': [x0 + rx, y0 + ry, x0 + rx + rw, y0 + ry + rh],
+                    'centroid': [float(x0 + centroids[k][0]), float(y0 + centroids[k][1])],
+                    'confidence': float(confidence[k] / area),
+                    'touches': bool(touches[k]),
+                })
+    return result
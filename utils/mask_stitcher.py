@@ -0,0 +1,158 @@
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# 与 ModelDetector 中分割结果的二值化阈值一致
+MASK_THRESHOLD = 0.39
+
+
+class MaskStitcher:
+    """大幅拼接影像的全分辨率分割概率累加器
+
+    概率和（float16）与覆盖次数（uint8）保存在磁盘上的 np.memmap 文件中，各分块把概率图写入对应窗口，
+    重叠区域取平均。finalize 按行分块流式读取，输出二值掩码和连通域统计，不会把整幅数组载入内存。
+    """
+
+    def __init__(self, width, height, work_dir=None, threshold=MASK_THRESHOLD, block_pixels=1 << 24):
+        self.width = width
+        self.height = height
+        self.threshold = threshold
+        # finalize 每次处理的行数，使单个分块的像素数不超过 block_pixels
+        self.block_rows = max(1, block_pixels // max(width, 1))
+        self._own_dir = work_dir is None
+        self.work_dir = Path(tempfile.mkdtemp(prefix='mask_stitch_') if work_dir is None else work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.sums = np.memmap(self.work_dir / 'sums.f16', dtype=np.float16, mode='w+', shape=(height, width))
+        self.counts = np.memmap(self.work_dir / 'counts.u8', dtype=np.uint8, mode='w+', shape=(height, width))
+        self._lock = threading.Lock()
+
+    def add(self, window, prob):
+        """把分块的概率图累加到 window=(x, y, w, h)，尺寸与窗口不一致时先缩放到窗口大小"""
+        x, y, w, h = window
+        prob = np.asarray(prob, dtype=np.float32).squeeze()
+        if prob.shape != (h, w):
+            prob = cv2.resize(prob, (w, h), interpolation=cv2.INTER_LINEAR)
+        # 裁掉超出影像范围的部分
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        prob = prob[:y1 - y, :x1 - x]
+        with self._lock:
+            sums = self.sums[y:y1, x:x1]
+            sums[:] = (sums.astype(np.float32) + prob).astype(np.float16)
+            counts = self.counts[y:y1, x:x1]
+            # 覆盖次数在255处饱和
+            np.minimum(counts.astype(np.uint16) + 1, 255, out=counts, casting='unsafe')
+
+    def iter_blocks(self):
+        """按行分块返回 (起始行, 平均概率)，未被任何分块覆盖的像素概率为0"""
+        for start in range(0, self.height, self.block_rows):
+            end = min(start + self.block_rows, self.height)
+            sums = np.asarray(self.sums[start:end], dtype=np.float32)
+            counts = np.asarray(self.counts[start:end])
+            yield start, np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+    def finalize(self, mask_path=None, min_area=0):
+        """流式生成二值掩码和连通域统计
+
+        mask_path 不为空时把掩码写入 .npy 文件（内存映射逐块写出）。连通域按8邻域计算，
+        跨越分块边界的连通域通过并查集合并。返回按面积从大到小排列的连通域列表。
+        """
+        mask_out = None
+        if mask_path is not None:
+            mask_out = np.lib.format.open_memmap(mask_path, mode='w+', dtype=np.uint8, shape=(self.height, self.width))
+
+        parent = [0]   # 并查集，0 为背景
+        stats = [None]
+        previous_row = None
+
+        def find(label):
+            while parent[label] != label:
+                parent[label] = parent[parent[label]]
+                label = parent[label]
+            return label
+
+        for start, prob in self.iter_blocks():
+            mask = (prob > self.threshold).astype(np.uint8)
+            if mask_out is not None:
+                mask_out[start:start + mask.shape[0]] = mask
+            count, labels, block_stats, centroids = cv2.connectedComponentsWithStats(
+                mask, connectivity=8, ltype=cv2.CV_32S)
+            offset = len(parent) - 1
+            prob_sums = np.bincount(labels.ravel(), weights=prob.ravel(), minlength=count)
+            for label in range(1, count):
+                left, top, width, height, area = (int(v) for v in block_stats[label])
+                parent.append(offset + label)
+                # 质心按面积加权累加，合并跨块连通域后再求平均
+                stats.append({
+                    'area': area,
+                    'bbox': [left, start + top, left + width, start + top + height],
+                    'prob_sum': float(prob_sums[label]),
+                    'x_sum': float(centroids[label][0]) * area,
+                    'y_sum': (float(centroids[label][1]) + start) * area,
+                })
+
+            if previous_row is not None:
+                # 上一块最后一行与本块第一行在8邻域内相邻的前景像素属于同一连通域
+                current_row = labels[0]
+                for shift in (-1, 0, 1):
+                    upper = previous_row[max(shift, 0):len(previous_row) + min(shift, 0)]
+                    lower = current_row[max(-shift, 0):len(current_row) + min(-shift, 0)]
+                    both = (upper > 0) & (lower > 0)
+                    for a, b in set(zip(upper[both].tolist(), lower[both].tolist())):
+                        root_a, root_b = find(a), find(b + offset)
+                        if root_a != root_b:
+                            parent[max(root_a, root_b)] = min(root_a, root_b)
+            last = labels[-1]
+            previous_row = np.where(last > 0, last + offset, 0)
+
+        if mask_out is not None:
+            mask_out.flush()
+            del mask_out
+
+        merged = {}
+        for label in range(1, len(parent)):
+            root = find(label)
+            item = stats[label]
+            target = merged.get(root)
+            if target is None:
+                merged[root] = dict(item)
+                continue
+            target['area'] += item['area']
+            target['prob_sum'] += item['prob_sum']
+            target['x_sum'] += item['x_sum']
+            target['y_sum'] += item['y_sum']
+            box = target['bbox']
+            target['bbox'] = [min(box[0], item['bbox'][0]), min(box[1], item['bbox'][1]),
+                              max(box[2], item['bbox'][2]), max(box[3], item['bbox'][3])]
+
+        components = [{
+            'label': 'building',
+            'class': 'building',
+            'area': item['area'],
+            'bbox': item['bbox'],
+            'centroid': [item['x_sum'] / item['area'], item['y_sum'] / item['area']],
+            'confidence': item['prob_sum'] / item['area'],
+            'width': self.width,
+            'height': self.height,
+        } for item in merged.values() if item['area'] >= min_area]
+        components.sort(key=lambda c: c['area'], reverse=True)
+        return components
+
+    def close(self):
+        """释放内存映射并删除临时文件"""
+        self.sums = None
+        self.counts = None
+        if self._own_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        else:
+            for name in ('sums.f16', 'counts.u8'):
+                (self.work_dir / name).unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -5,31 +5,39 @@ import cv2
 from pathlib import Path
 from ultralytics import YOLO
 from torchvision import transforms
+from utils.progress_events import ensure_reporter, STAGE_PREPROCESS, STAGE_INFER, STAGE_POSTPROCESS, STAGE_RENDER
 # import matplotlib.pyplot as plt
 
+# 模型文件目录，按仓库位置解析，与启动时的工作目录无关
+MODEL_DIR = Path(__file__).parent.parent / 'model'
+
+
+def get_model_type(model_name):
+    """从文件名判断模型类型：yolo为目标检测模型，unet/upp/fcn为分割模型"""
+    model_name_lower = model_name.lower()
+    if 'yolo' in model_name_lower or 'v8n' in model_name_lower or '12s' in model_name_lower:
+        return 'yolo'
+    elif 'unet' in model_name_lower:
+        return 'unet'
+    elif 'upp' in model_name_lower:
+        return 'upp'
+    elif 'fcn' in model_name_lower:
+        return 'fcn'
+    raise ValueError(f"无法从文件名 {model_name} 中识别模型类型，文件名必须包含 'yolo'、'unet'、'upp' 或 'fcn' 关键字")
+
+
 class ModelDetector:
     def __init__(self, model_name, device=None):
         self.device = device or ('cuda' if torch.cuda.is_available() else 'mps' if torch.backends.mps.is_available() else 'cpu')
         self.model_name = model_name
         
-        model_path = Path(f"model/{self.model_name}")
+        model_path = MODEL_DIR / self.model_name
         if not model_path.exists():
             raise FileNotFoundError(f"Model file not found: {model_path}")
         
         print(f"Loading model: {model_path}")
 
-        # 从文件名判断模型类型
-        model_name_lower = self.model_name.lower()
-        if 'yolo' in model_name_lower or 'v8n' in model_name_lower or '12s' in model_name_lower:
-            self.model_type = 'yolo'
-        elif 'unet' in model_name_lower:
-            self.model_type = 'unet'
-        elif 'upp' in model_name_lower:
-            self.model_type = 'upp'
-        elif 'fcn' in model_name_lower:
-            self.model_type = 'fcn'
-        else:
-            raise ValueError(f"无法从文件名 {self.model_name} 中识别模型类型，文件名必须包含 'yolo'、'unet'、'upp' 或 'fcn' 关键字")
+        self.model_type = get_model_type(self.model_name)
         
         self._load_model(model_path)
         print(f"Successfully loaded {self.model_type} model: {self.model_name}")
@@ -110,12 +118,66 @@ class ModelDetector:
         except Exception as e:
             raise ValueError(f"Error processing image: {str(e)}")
     
-    def detect(self, image, conf_thres=0.5, iou_thres=0.45, preview_size=None):
-        image = self.preprocess_image(image)
+    def detect(self, image, conf_thres=0.5, iou_thres=0.45, preview_size=None, progress=None):
+        return self.detect_batch([image], conf_thres=conf_thres, iou_thres=iou_thres, preview_size=preview_size,
+                                 progress=progress)[0]
+    
+    def detect_batch(self, images, conf_thres=0.5, iou_thres=0.45, preview_size=None, progress=None):
+        """对多张图片执行批量检测，返回与输入顺序一致的 (detections, plotted_image) 列表
+
+        progress 为 ProgressReporter 时依次发布预处理、推理、后处理和绘制结果阶段的进度事件。
+        """
+        progress = ensure_reporter(progress)
+        with progress.stage(STAGE_PREPROCESS, len(images)):
+            prepared = []
+            for image in images:
+                prepared.append(self.preprocess_image(image))
+                progress.advance(STAGE_PREPROCESS)
+        with progress.stage(STAGE_INFER, len(images)):
+            outputs = self.forward_batch(prepared, conf_thres=conf_thres, iou_thres=iou_thres)
+        progress.start(STAGE_POSTPROCESS, len(images))
+        progress.start(STAGE_RENDER, len(images))
+        results = [self.postprocess(image, output, conf_thres=conf_thres, preview_size=preview_size, progress=progress)
+                   for image, output in zip(prepared, outputs)]
+        progress.finish(STAGE_POSTPROCESS)
+        progress.finish(STAGE_RENDER)
+        return results
+    
+    def forward_batch(self, images, conf_thres=0.5, iou_thres=0.45):
+        """对已预处理的PIL图片执行一次批量前向推理，返回每张图片对应的原始模型输出"""
         print(f'model_type: {self.model_type}')
         if self.model_type == 'yolo':
             print(f'Using IOU threshold: {iou_thres}')
-            results = self.model(image, conf=conf_thres, iou=iou_thres, imgsz=image.size, verbose=False)
+            # YOLO按imgsz缩放输入，只有尺寸相同的图片才能合并为同一批次
+            outputs = [None] * len(images)
+            size_groups = {}
+            for index, image in enumerate(images):
+                size_groups.setdefault(image.size, []).append(index)
+            for size, indices in size_groups.items():
+                results = self.model([images[i] for i in indices], conf=conf_thres, iou=iou_thres, imgsz=size, verbose=False)
+                for index, result in zip(indices, results):
+                    outputs[index] = result
+            return outputs
+        
+        transform = transforms.Compose([
+            transforms.Resize((512, 512)),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        input_tensor = torch.stack([transform(image) for image in images]).to(self.device)
+        
+        with torch.no_grad():
+            output = self.model(input_tensor)
+            if self.model_type == 'fcn':
+                output = output['out']
+            pred = output.sigmoid().cpu().numpy()
+        # 保持单张推理时 (1, 1, H, W) 的输出形状
+        return [pred[i:i + 1] for i in range(len(images))]
+    
+    def postprocess(self, image, output, conf_thres=0.5, preview_size=None, progress=None):
+        """将单张图片的原始模型输出转换为检测结果列表和可视化图像"""
+        progress = ensure_reporter(progress)
+        if self.model_type == 'yolo':
             detections = [{
                 'label': 'building',
                 'class': 'building',
@@ -123,26 +185,13 @@ class ModelDetector:
                 'bbox': box.cpu().numpy().tolist(),
                 'width': image.width,
                 'height': image.height
-            } for result in results[0] for box, cls, conf in zip(result.boxes.xyxy, result.boxes.cls, result.boxes.conf)
+            } for result in output for box, cls, conf in zip(result.boxes.xyxy, result.boxes.cls, result.boxes.conf)
               if conf >= conf_thres]
-            # 计算平均置信度
-            avg_confidence = sum(d['confidence'] for d in detections) / len(detections) if detections else 0
-            plotted_image = results[0].plot()
+            progress.advance(STAGE_POSTPROCESS)
+            plotted_image = output.plot()
         
         else:
-            transform = transforms.Compose([
-                transforms.Resize((512, 512)),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ])
-            input_tensor = transform(image).unsqueeze(0).to(self.device)
-            
-            with torch.no_grad():
-                output = self.model(input_tensor)
-                if self.model_type == 'fcn':
-                    output = output['out']
-                pred = torch.argmax(output, dim=1).squeeze().cpu().numpy()
-                pred = output.sigmoid().cpu().numpy()
+            pred = output
             
             # 计算平均置信度
             avg_confidence = float(pred.mean())
@@ -154,6 +203,7 @@ class ModelDetector:
                 'width': image.width,
                 'height': image.height
             }]
+            progress.advance(STAGE_POSTPROCESS)
             
             original_image = np.array(image)
 
@@ -177,5 +227,6 @@ class ModelDetector:
         
         if preview_size:
             plotted_image = cv2.resize(plotted_image, preview_size, interpolation=cv2.INTER_AREA)
+        progress.advance(STAGE_RENDER)
         
         return detections, plotted_image
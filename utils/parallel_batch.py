@@ -0,0 +1,235 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.batch_io import make_result_row, update_batch_stats, open_source
+from utils.prefilter import PreFilter, detect_with_prefilter
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内的检测器和预筛选器，由 _init_worker 创建；预筛选只在同一进程处理的图片之间去重
+_worker_detector = None
+_worker_prefilter = None
+
+
+def _init_worker(model_name, threads, detector_factory=None, prefilter_params=None):
+    """每个工作进程加载自己的检测器，并限制进程内的计算线程数"""
+    global _worker_detector, _worker_prefilter
+    import cv2
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    if detector_factory is None:
+        from utils.model_detector import ModelDetector
+        detector_factory = ModelDetector
+    _worker_detector = detector_factory(model_name)
+    _worker_prefilter = PreFilter.from_params(prefilter_params)
+
+
+def _infer(images, conf_thres, iou_thres):
+    outputs = _worker_detector.forward_batch(images, conf_thres=conf_thres, iou_thres=iou_thres)
+    return [_worker_detector.postprocess(image, output, conf_thres=conf_thres) for image, output in zip(images, outputs)]
+
+
+def _process_chunk(chunk_index, paths, conf_thres, iou_thres, batch_size):
+    """在工作进程中检测一个分块，返回 (chunk_index, rows, 耗时)"""
+    start = time.perf_counter()
+    rows = [None] * len(paths)
+    for offset in range(0, len(paths), batch_size):
+        images, positions = [], []
+        for position in range(offset, min(offset + batch_size, len(paths))):
+            image_start = time.perf_counter()
+            try:
+                images.append((_worker_detector.preprocess_image(open_source(paths[position])), image_start))
+                positions.append(position)
+            except Exception as e:
+                rows[position] = make_result_row(paths[position], error=e)
+        if not images:
+            continue
+        try:
+            outcomes = detect_with_prefilter(_worker_prefilter, [(paths[position], image) for position, (image, _)
+                                                                 in zip(positions, images)],
+                                             lambda batch: _infer(batch, conf_thres, iou_thres))
+            for position, (_, image_start), (detections, _, skipped, _) in zip(positions, images, outcomes):
+                rows[position] = make_result_row(paths[position], detections, time.perf_counter() - image_start,
+                                                 skipped=skipped)
+        except Exception as e:
+            for position in positions:
+                if rows[position] is None:
+                    rows[position] = make_result_row(paths[position], error=e)
+    return chunk_index, rows, time.perf_counter() - start
+
+
+def _warm_up():
+    # 占用工作进程一小段时间，使同一轮的预热任务分散到不同进程
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _iter_chunks(paths, chunk_size):
+    paths = iter(paths)
+    for chunk_index in itertools.count():
+        chunk = [str(path) for path in itertools.islice(paths, chunk_size)]
+        if not chunk:
+            return
+        yield chunk_index, chunk
+
+
+class ShardedBatchRunner:
+    """多进程分片批量检测
+
+    图片列表按小分块动态分发给 N 个工作进程，结果按输入顺序合并写出；
+    某个工作进程异常退出时，重建进程池并重新提交未完成的分块。进程池损坏时无法区分是哪个分块导致的，
+    同时在处理中的分块不计重试次数；第二次遇到进程池损坏的分块改为单独运行，单独运行时仍然损坏才计一次重试，
+    超过 max_retries 次后该分块的图片记为失败。
+    """
+
+    def __init__(self, model_name, processes=None, threads_per_process=1, chunk_size=16, batch_size=4,
+                 conf_thres=0.5, iou_thres=0.8, max_retries=2, detector_factory=None, prefilter_params=None):
+        self.model_name = model_name
+        self.processes = processes or os.cpu_count() or 1
+        self.threads_per_process = threads_per_process
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_retries = max_retries
+        self.detector_factory = detector_factory
+        self.prefilter_params = prefilter_params
+
+    def _create_pool(self, processes, threads):
+        # 使用spawn避免fork后torch线程池和CUDA状态不一致
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_name, threads, self.detector_factory, self.prefilter_params)
+        )
+
+    def run(self, paths, writer=None, on_result=None):
+        """检测所有图片，按输入顺序写出结果，返回汇总统计"""
+        stats = {'total': 0, 'success': 0, 'failed': 0, 'with_buildings': 0, 'retried_chunks': 0}
+        chunks = _iter_chunks(paths, self.chunk_size)
+        max_in_flight = self.processes * 2
+        in_flight = {}      # future -> (chunk_index, chunk)
+        retries = {}        # chunk_index -> 已重试次数
+        completed = {}      # chunk_index -> rows，等待按序写出
+        next_to_write = 0
+        exhausted = False
+        suspects = {}       # chunk_index -> 遇到进程池损坏的次数
+        isolated = []       # 等待单独运行的可疑分块
+        pool = self._create_pool(self.processes, self.threads_per_process)
+        self._warm_up_pool(pool, self.processes)
+        start = time.perf_counter()
+
+        def submit(chunk_index, chunk):
+            future = pool.submit(_process_chunk, chunk_index, chunk, self.conf_thres, self.iou_thres, self.batch_size)
+            in_flight[future] = (chunk_index, chunk)
+
+        try:
+            while True:
+                if isolated:
+                    # 等其他分块处理完后单独运行可疑分块，再次损坏即可确定是该分块导致的
+                    if not in_flight:
+                        submit(*isolated.pop(0))
+                while not isolated and not exhausted and len(in_flight) < max_in_flight:
+                    item = next(chunks, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    submit(*item)
+                if not in_flight:
+                    break
+
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                broken = []
+                for future in done:
+                    chunk_index, chunk = in_flight.pop(future)
+                    try:
+                        _, rows, _ = future.result()
+                        completed[chunk_index] = rows
+                    except BrokenProcessPool:
+                        broken.append((chunk_index, chunk))
+                    except Exception as e:
+                        logger.error(f"分块 {chunk_index} 检测失败: {str(e)}")
+                        completed[chunk_index] = [make_result_row(path, error=e) for path in chunk]
+
+                if broken:
+                    # 进程池损坏后所有未完成的分块都需要重新提交
+                    broken += list(in_flight.values())
+                    in_flight.clear()
+                    pool.shutdown(wait=False)
+                    pool = self._create_pool(self.processes, self.threads_per_process)
+                    for chunk_index, chunk in sorted(broken):
+                        if len(broken) > 1:
+                            # 无法确定损坏由哪个分块导致，不计重试次数；再次遇到损坏的分块改为单独运行
+                            suspects[chunk_index] = suspects.get(chunk_index, 0) + 1
+                            stats['retried_chunks'] += 1
+                            if suspects[chunk_index] >= 2:
+                                isolated.append((chunk_index, chunk))
+                            else:
+                                submit(chunk_index, chunk)
+                            continue
+                        retries[chunk_index] = retries.get(chunk_index, 0) + 1
+                        if retries[chunk_index] > self.max_retries:
+                            logger.error(f"分块 {chunk_index} 重试 {self.max_retries} 次后仍失败")
+                            error = RuntimeError("工作进程异常退出")
+                            completed[chunk_index] = [make_result_row(path, error=error) for path in chunk]
+                        else:
+                            stats['retried_chunks'] += 1
+                            submit(chunk_index, chunk)
+
+                while next_to_write in completed:
+                    for row in completed.pop(next_to_write):
+                        update_batch_stats(stats, row)
+                        if writer is not None:
+                            writer.write(row)
+                        if on_result is not None:
+                            on_result(stats, row)
+                    next_to_write += 1
+        finally:
+            pool.shutdown(wait=True)
+
+        stats['elapsed'] = time.perf_counter() - start
+        stats['images_per_second'] = stats['total'] / stats['elapsed'] if stats['elapsed'] > 0 else 0
+        return stats
+
+    @staticmethod
+    def _warm_up_pool(pool, processes, timeout=600.0):
+        """等待全部工作进程启动并加载模型，吞吐量统计不包含模型加载时间
+
+        进程池按需启动进程，先完成初始化的进程可能执行多个预热任务，因此按轮提交，直到收到每个进程的pid。
+        """
+        pids = set()
+        deadline = time.monotonic() + timeout
+        while len(pids) < processes and time.monotonic() < deadline:
+            pids.update(future.result() for future in [pool.submit(_warm_up) for _ in range(processes)])
+        return pids
+
+    def measure_baseline(self, paths):
+        """用单个工作进程（线程数等于全部进程的线程总和）检测样本，返回每秒图片数"""
+        pool = self._create_pool(1, self.threads_per_process * self.processes)
+        try:
+            # 预热：加载模型不计入基准耗时
+            pool.submit(_warm_up).result()
+            _, rows, elapsed = pool.submit(_process_chunk, 0, [str(path) for path in paths],
+                                           self.conf_thres, self.iou_thres, self.batch_size).result()
+        finally:
+            pool.shutdown(wait=True)
+        return len(rows) / elapsed if elapsed > 0 else 0
+
+
+def scaling_report(stats, baseline_images_per_second, processes):
+    """相对单进程基准的加速比与扩展效率"""
+    if not baseline_images_per_second:
+        return None
+    speedup = stats['images_per_second'] / baseline_images_per_second
+    return {'baseline_images_per_second': baseline_images_per_second,
+            'speedup': speedup, 'efficiency': speedup / processes}
@@ -0,0 +1,158 @@
+import copy
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from utils.batch_io import compact_detections
+
+# 预筛选跳过的原因，写入结果行的 skipped 字段
+SKIP_BLANK = 'blank'
+SKIP_DUPLICATE = 'duplicate'
+
+# 统计和感知哈希都在缩小后的图片上计算
+STATS_SIZE = 64
+
+
+def image_stats(image):
+    """缩小到 64x64 后计算灰度均值、标准差和nodata（纯黑或纯白）像素比例"""
+    small = np.asarray(image.convert('RGB').resize((STATS_SIZE, STATS_SIZE), Image.Resampling.BOX), dtype=np.uint8)
+    gray = small.mean(axis=2)
+    # 缩小时按块取平均，只有整块都是0或255时才会被计为nodata
+    nodata = np.all(small == 0, axis=2) | np.all(small == 255, axis=2)
+    return {'mean': float(gray.mean()), 'std': float(gray.std()), 'nodata_ratio': float(nodata.mean())}
+
+
+def dhash(image, hash_size=8):
+    """差值感知哈希：比较相邻像素的亮度，返回 hash_size*hash_size 位整数"""
+    small = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class PreFilter:
+    """检测前的内容预筛选
+
+    空白或nodata图片直接判定为“未检测到建筑物”，不做前向推理；与已处理图片的感知哈希汉明距离
+    不超过 dedup_distance 的图片复用已有结果（dedup_distance < 0 时不去重）。
+    近似查找使用分段索引：距离不超过k的两个哈希，划分为k+1段后至少有一段完全相同。线程安全。
+    """
+
+    def __init__(self, dedup_distance=4, blank_std=2.0, nodata_ratio=0.98, skip_blank=True, max_entries=100000):
+        self.dedup_distance = dedup_distance
+        self.blank_std = blank_std
+        self.nodata_ratio = nodata_ratio
+        self.skip_blank = skip_blank
+        self.max_entries = max_entries
+        bands = min(max(dedup_distance, 0) + 1, 64)
+        self._bands = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+        self._index = [{} for _ in self._bands]
+        self._hashes = OrderedDict()   # key -> hash，按登记顺序淘汰
+        self._results = {}             # key -> 精简后的检测结果
+        self._lock = threading.Lock()
+        self.stats = {SKIP_BLANK: 0, SKIP_DUPLICATE: 0, 'checked': 0}
+
+    @classmethod
+    def from_params(cls, params):
+        """根据作业参数中的 prefilter 配置创建，未启用时返回None"""
+        if not params:
+            return None
+        return cls(**params)
+
+    def is_blank(self, stats):
+        return stats['std'] < self.blank_std or stats['nodata_ratio'] >= self.nodata_ratio
+
+    def _band_values(self, value):
+        return [(value >> start) & ((1 << (end - start)) - 1) for start, end in self._bands]
+
+    def _find(self, value):
+        for band_index, band_value in zip(self._index, self._band_values(value)):
+            for key in band_index.get(band_value, ()):
+                if hamming(value, self._hashes[key]) <= self.dedup_distance:
+                    return key
+        return None
+
+    def _register(self, key, value):
+        self._hashes[key] = value
+        for band_index, band_value in zip(self._index, self._band_values(value)):
+            band_index.setdefault(band_value, set()).add(key)
+        while len(self._hashes) > self.max_entries:
+            old_key, old_value = self._hashes.popitem(last=False)
+            self._results.pop(old_key, None)
+            for band_index, band_value in zip(self._index, self._band_values(old_value)):
+                keys = band_index.get(band_value)
+                keys.discard(old_key)
+                if not keys:
+                    del band_index[band_value]
+
+    def check(self, image, key):
+        """返回 (动作, 参考键)：(SKIP_BLANK, None)、(SKIP_DUPLICATE, 参考图片的键) 或 (None, None)
+
+        未被跳过的图片以 key 登记为后续图片的去重参考。
+        """
+        skip_blank = self.skip_blank and self.is_blank(image_stats(image))
+        value = dhash(image) if not skip_blank and self.dedup_distance >= 0 else None
+        with self._lock:
+            self.stats['checked'] += 1
+            if skip_blank:
+                self.stats[SKIP_BLANK] += 1
+                return SKIP_BLANK, None
+            if value is None:
+                return None, None
+            reference = self._find(value)
+            if reference is not None:
+                self.stats[SKIP_DUPLICATE] += 1
+                return SKIP_DUPLICATE, reference
+            self._register(key, value)
+            return None, None
+
+    def remember(self, key, detections):
+        with self._lock:
+            if key in self._hashes:
+                self._results[key] = compact_detections(detections)
+
+    def lookup(self, key):
+        """返回参考图片的检测结果副本，结果尚未完成或已被淘汰时返回None"""
+        with self._lock:
+            detections = self._results.get(key)
+        return copy.deepcopy(detections) if detections is not None else None
+
+
+def detect_with_prefilter(prefilter, items, infer):
+    """对一批 (key, image) 执行预筛选后只对需要的图片调用 infer(images)
+
+    infer 返回与输入对应的 (detections, plotted_image) 列表。返回与 items 对应的
+    (detections, plotted_image, skipped, reference) 列表；infer 抛出的异常直接向上传递。
+    """
+    if prefilter is None:
+        outputs = infer([image for _, image in items]) if items else []
+        return [(detections, plotted_image, None, None) for detections, plotted_image in outputs]
+
+    outcomes = [None] * len(items)
+    to_infer, duplicates = [], []
+    batch_keys = set()
+    for i, (key, image) in enumerate(items):
+        action, reference = prefilter.check(image, key)
+        if action == SKIP_BLANK:
+            outcomes[i] = ([], None, SKIP_BLANK, None)
+        elif action == SKIP_DUPLICATE and (reference in batch_keys or prefilter.lookup(reference) is not None):
+            duplicates.append((i, reference))
+        else:
+            # 参考图片的结果不可用（检测失败或已被淘汰）时照常检测，并补全参考结果
+            to_infer.append((i, reference))
+            batch_keys.add(key)
+    if to_infer:
+        outputs = infer([items[i][1] for i, _ in to_infer])
+        for (i, reference), (detections, plotted_image) in zip(to_infer, outputs):
+            outcomes[i] = (detections, plotted_image, None, None)
+            prefilter.remember(items[i][0], detections)
+            if reference is not None:
+                prefilter.remember(reference, detections)
+    for i, reference in duplicates:
+        outcomes[i] = (prefilter.lookup(reference) or [], None, SKIP_DUPLICATE, reference)
+    return outcomes
@@ -0,0 +1,179 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# 检测流程的阶段
+STAGE_QUEUE = 'queue'
+STAGE_DECODE = 'decode'
+STAGE_PREPROCESS = 'preprocess'
+STAGE_INFER = 'infer'
+STAGE_POSTPROCESS = 'postprocess'
+STAGE_RENDER = 'render'
+STAGE_REGISTER = 'register'
+STAGE_COMPARE = 'compare'
+STAGE_PERSIST = 'persist'
+STAGE_DONE = 'done'
+
+STAGE_LABELS = {
+    STAGE_QUEUE: '排队',
+    STAGE_DECODE: '解码',
+    STAGE_PREPROCESS: '预处理',
+    STAGE_INFER: '推理',
+    STAGE_POSTPROCESS: '后处理',
+    STAGE_RENDER: '绘制结果',
+    STAGE_REGISTER: '配准',
+    STAGE_COMPARE: '变化分析',
+    STAGE_PERSIST: '保存',
+    STAGE_DONE: '完成',
+}
+
+# 各阶段在整体进度中的权重，大致对应CPU上的相对耗时
+STAGE_WEIGHTS = {
+    STAGE_QUEUE: 0,
+    STAGE_DECODE: 1,
+    STAGE_PREPROCESS: 1,
+    STAGE_INFER: 8,
+    STAGE_POSTPROCESS: 1,
+    STAGE_RENDER: 1,
+    STAGE_REGISTER: 1,
+    STAGE_COMPARE: 1,
+    STAGE_PERSIST: 1,
+}
+
+
+@dataclass
+class ProgressEvent:
+    """阶段进度事件：stage 阶段的 done/total（total为None表示总数未知），fraction 为整个任务的完成比例"""
+    stage: str
+    done: int
+    total: int
+    fraction: float
+    timestamp: float
+    elapsed: float
+    finished: bool = False
+    message: str = ''
+
+    @property
+    def label(self):
+        return STAGE_LABELS.get(self.stage, self.stage)
+
+    def describe(self):
+        """用于页面显示的一行说明，例如 “推理 2/4”"""
+        text = self.message or self.label
+        if self.total:
+            text += f" {self.done}/{self.total}"
+        return text
+
+
+class ProgressReporter:
+    """结构化的阶段进度发布者
+
+    stages 为参与整体进度计算的阶段，按 STAGE_WEIGHTS 把各阶段的完成数折算为整体完成比例，未列出的阶段只发布事件。
+    回调在发布事件的线程中同步调用；推理在执行器线程中进行时，页面可以用 subscribe(..., local=True)
+    只接收脚本线程中的事件，并在等待结果期间用 latest() 读取其他线程发布的最近事件。
+    """
+
+    def __init__(self, stages=None):
+        self.stages = list(stages) if stages is not None else list(STAGE_WEIGHTS)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空所有阶段的状态，用于同一个发布者开始下一批任务"""
+        with self._lock:
+            self._state = {}
+            self._latest = None
+            self._completed = False
+            self._high = 0.0
+
+    def subscribe(self, callback, local=False):
+        """callback(event)；local 为True时只接收当前线程发布的事件"""
+        self._subscribers.append((callback, threading.get_ident() if local else None))
+        return callback
+
+    def _fraction(self):
+        if self._completed:
+            return 1.0
+        weights = sum(STAGE_WEIGHTS.get(stage, 1) for stage in self.stages)
+        if not weights:
+            return 0.0
+        done = 0.0
+        for stage in self.stages:
+            state = self._state.get(stage)
+            if state is None:
+                continue
+            if state['finished']:
+                done += STAGE_WEIGHTS.get(stage, 1)
+            elif state['total']:
+                done += STAGE_WEIGHTS.get(stage, 1) * min(state['done'] / state['total'], 1.0)
+        return done / weights
+
+    def _emit(self, stage, message=''):
+        with self._lock:
+            state = self._state[stage]
+            now = time.time()
+            # 同一阶段可能被多个组件先后发布（例如检测器和变化检测引擎都会绘制结果），整体进度只增不减
+            self._high = max(self._high, self._fraction())
+            event = ProgressEvent(stage, state['done'], state['total'], self._high, now,
+                                  now - state['started'], state['finished'], message)
+            self._latest = event
+        thread = threading.get_ident()
+        for callback, owner in self._subscribers:
+            if owner is None or owner == thread:
+                callback(event)
+        return event
+
+    def start(self, stage, total=1, message=''):
+        with self._lock:
+            self._state[stage] = {'done': 0, 'total': total, 'started': time.time(), 'finished': False}
+        return self._emit(stage, message)
+
+    def advance(self, stage, count=1, message=''):
+        with self._lock:
+            state = self._state.setdefault(stage, {'done': 0, 'total': None, 'started': time.time(),
+                                                   'finished': False})
+            state['done'] += count
+        return self._emit(stage, message)
+
+    def finish(self, stage, message=''):
+        with self._lock:
+            state = self._state.setdefault(stage, {'done': 0, 'total': None, 'started': time.time(),
+                                                   'finished': False})
+            if state['total'] is not None:
+                state['done'] = state['total']
+            state['finished'] = True
+            state['elapsed'] = time.time() - state['started']
+        return self._emit(stage, message)
+
+    @contextmanager
+    def stage(self, stage, total=1, message=''):
+        """with progress.stage(STAGE_INFER, len(images)): ...，结束时发布完成事件"""
+        self.start(stage, total, message)
+        try:
+            yield self
+        finally:
+            self.finish(stage, message)
+
+    def complete(self, message=''):
+        """整个任务结束，跳过的阶段也计为完成"""
+        with self._lock:
+            self._completed = True
+            self._state.setdefault(STAGE_DONE, {'done': 1, 'total': 1, 'started': time.time(), 'finished': True})
+        return self._emit(STAGE_DONE, message)
+
+    def latest(self):
+        """最近发布的事件，没有事件时返回None"""
+        with self._lock:
+            return self._latest
+
+    def timings(self):
+        """已完成阶段的耗时（秒）"""
+        with self._lock:
+            return {stage: state['elapsed'] for stage, state in self._state.items() if 'elapsed' in state}
+
+
+def ensure_reporter(progress):
+    """引擎和检测器的 progress 参数可以为None，此时返回一个没有订阅者的发布者"""
+    return progress if progress is not None else ProgressReporter(())
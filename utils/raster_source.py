@@ -0,0 +1,333 @@
+import math
+import struct
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# TIFF标签
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIGURATION = 284
+TAG_PREDICTOR = 317
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SAMPLE_FORMAT = 339
+
+# TIFF字段类型 -> numpy类型
+TIFF_TYPES = {1: 'u1', 2: 'u1', 3: 'u2', 4: 'u4', 6: 'i1', 7: 'u1', 8: 'i2', 9: 'i4', 11: 'f4', 12: 'f8',
+              16: 'u8', 17: 'i8', 18: 'u8', 5: 'u4', 10: 'i4'}
+# RATIONAL类型每个值由两个32位整数组成
+TIFF_TYPE_COUNT_FACTOR = {5: 2, 10: 2}
+
+SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+class RasterSource:
+    """按窗口读取的栅格数据源
+
+    子类实现 _read(x, y, w, h)，返回 (h, w, bands) 的数组，只读取窗口覆盖的数据。
+    read_window 统一转换为模型需要的8位RGB。
+    """
+
+    width = 0
+    height = 0
+    bands = 0
+    dtype = np.dtype('u1')
+
+    def __init__(self, scale=None):
+        # 非8位数据按 scale 线性缩放到0-255，默认使用数据类型的最大值
+        self.scale = scale
+
+    def _read(self, x, y, w, h):
+        raise NotImplementedError
+
+    def _read_strided(self, x, y, cols, rows, step):
+        """每隔 step 个像素采样 rows 行 cols 列，默认逐行读取，只访问被采样的行"""
+        width = (cols - 1) * step + 1
+        return np.stack([self._read(x, y + i * step, width, 1)[0, ::step] for i in range(rows)])
+
+    def read_window(self, x, y, w, h, step=1):
+        """读取窗口并转换为uint8 RGB数组，超出栅格范围的部分填0
+
+        step 大于1时每隔 step 个像素采样一次（最近邻缩小），返回 (ceil(h/step), ceil(w/step), 3) 的数组，
+        用于生成概览图。
+        """
+        out_h, out_w = -(-h // step), -(-w // step)
+        # 落在栅格范围内的采样点下标范围
+        i0, i1 = -(-max(0, -y) // step), -(-(min(self.height, y + h) - y) // step)
+        j0, j1 = -(-max(0, -x) // step), -(-(min(self.width, x + w) - x) // step)
+        window = np.zeros((out_h, out_w, 3), dtype=np.uint8)
+        if i1 > i0 and j1 > j0:
+            if step == 1:
+                data = self._read(x + j0, y + i0, j1 - j0, i1 - i0)
+            else:
+                data = self._read_strided(x + j0 * step, y + i0 * step, j1 - j0, i1 - i0, step)
+            window[i0:i1, j0:j1] = self._to_rgb(data)
+        return window
+
+    def read_image(self, x, y, w, h, step=1):
+        return Image.fromarray(self.read_window(x, y, w, h, step))
+
+    def _to_rgb(self, data):
+        if data.ndim == 2:
+            data = data[:, :, None]
+        if data.dtype != np.uint8:
+            scale = self.scale or (np.iinfo(data.dtype).max if data.dtype.kind in 'ui' else 1.0)
+            data = np.clip(data.astype(np.float32) * (255.0 / scale), 0, 255).astype(np.uint8)
+        if data.shape[2] == 1:
+            return np.repeat(data, 3, axis=2)
+        # 多于3个波段（如RGBA、多光谱）时取前三个波段
+        return data[:, :, :3]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NpyRasterSource(RasterSource):
+    """内存映射的 .npy 栅格，形状为 (H, W) 或 (H, W, C)"""
+
+    def __init__(self, path, scale=None):
+        super().__init__(scale)
+        self.path = Path(path)
+        self._array = np.load(self.path, mmap_mode='r')
+        if self._array.ndim not in (2, 3):
+            raise ValueError(f"不支持的栅格形状: {self._array.shape}")
+        self.height, self.width = self._array.shape[:2]
+        self.bands = 1 if self._array.ndim == 2 else self._array.shape[2]
+        self.dtype = self._array.dtype
+
+    def _read(self, x, y, w, h):
+        return np.array(self._array[y:y + h, x:x + w])
+
+    def _read_strided(self, x, y, cols, rows, step):
+        return np.array(self._array[y:y + (rows - 1) * step + 1:step, x:x + (cols - 1) * step + 1:step])
+
+    def close(self):
+        self._array = None
+
+
+class RawRasterSource(NpyRasterSource):
+    """无文件头的原始栅格（按行存储的 H x W x C 像素），需要给出尺寸和数据类型"""
+
+    def __init__(self, path, width, height, bands=3, dtype='u1', offset=0, scale=None):
+        RasterSource.__init__(self, scale)
+        self.path = Path(path)
+        shape = (height, width) if bands == 1 else (height, width, bands)
+        self._array = np.memmap(self.path, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape)
+        self.width, self.height, self.bands = width, height, bands
+        self.dtype = self._array.dtype
+
+
+class PilRasterSource(RasterSource):
+    """普通图片（JPEG/PNG等），整体解码后按窗口切分，仅用于较小的图片"""
+
+    def __init__(self, path_or_image):
+        super().__init__()
+        image = path_or_image if isinstance(path_or_image, Image.Image) else Image.open(path_or_image)
+        self._array = np.asarray(image.convert('RGB'))
+        self.height, self.width = self._array.shape[:2]
+        self.bands = 3
+
+    def _read(self, x, y, w, h):
+        return self._array[y:y + h, x:x + w]
+
+    def _read_strided(self, x, y, cols, rows, step):
+        return self._array[y:y + (rows - 1) * step + 1:step, x:x + (cols - 1) * step + 1:step]
+
+
+class TiffRasterSource(RasterSource):
+    """按条带或分块读取TIFF（含BigTIFF）的第一页
+
+    未压缩、像素交错存储的TIFF直接对文件做内存映射，窗口只访问覆盖到的条带/分块；
+    压缩或其他布局的TIFF在安装了 tifffile 时逐块解码，同样只读取需要的分块。
+    """
+
+    def __init__(self, path, scale=None):
+        super().__init__(scale)
+        self.path = Path(path)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r')
+        self._tiff = None
+        self._lock = threading.Lock()
+        self._parse_header()
+
+    def _parse_header(self):
+        mm = self._mm
+        byte_order = bytes(mm[:2])
+        if byte_order not in (b'II', b'MM'):
+            raise ValueError(f"不是TIFF文件: {self.path}")
+        self._endian = '<' if byte_order == b'II' else '>'
+        magic = struct.unpack(self._endian + 'H', bytes(mm[2:4]))[0]
+        if magic == 42:
+            self._bigtiff = False
+            ifd_offset = struct.unpack(self._endian + 'I', bytes(mm[4:8]))[0]
+        elif magic == 43:
+            self._bigtiff = True
+            ifd_offset = struct.unpack(self._endian + 'Q', bytes(mm[8:16]))[0]
+        else:
+            raise ValueError(f"不支持的TIFF版本: {magic}")
+        tags = self._read_ifd(ifd_offset)
+
+        self.width = int(tags[TAG_IMAGE_WIDTH][0])
+        self.height = int(tags[TAG_IMAGE_LENGTH][0])
+        self.bands = int(tags.get(TAG_SAMPLES_PER_PIXEL, [1])[0])
+        bits = int(tags.get(TAG_BITS_PER_SAMPLE, [1])[0])
+        sample_format = SAMPLE_FORMATS.get(int(tags.get(TAG_SAMPLE_FORMAT, [1])[0]), 'u')
+        if bits % 8:
+            raise ValueError(f"不支持 {bits} 位的TIFF")
+        self.dtype = np.dtype(f"{self._endian}{sample_format}{bits // 8}")
+        self.compression = int(tags.get(TAG_COMPRESSION, [1])[0])
+        self.planar = int(tags.get(TAG_PLANAR_CONFIGURATION, [1])[0])
+        self.predictor = int(tags.get(TAG_PREDICTOR, [1])[0])
+
+        if TAG_TILE_OFFSETS in tags:
+            self.tiled = True
+            self.segment_width = int(tags[TAG_TILE_WIDTH][0])
+            self.segment_height = int(tags[TAG_TILE_LENGTH][0])
+            self.offsets = tags[TAG_TILE_OFFSETS]
+            self.byte_counts = tags.get(TAG_TILE_BYTE_COUNTS)
+        else:
+            self.tiled = False
+            self.segment_width = self.width
+            self.segment_height = min(int(tags.get(TAG_ROWS_PER_STRIP, [self.height])[0]), self.height)
+            self.offsets = tags[TAG_STRIP_OFFSETS]
+            self.byte_counts = tags.get(TAG_STRIP_BYTE_COUNTS)
+        self.segments_across = math.ceil(self.width / self.segment_width)
+
+        self.native = self.compression == 1 and (self.planar == 1 or self.bands == 1) and self.predictor == 1
+        if not self.native:
+            try:
+                import tifffile
+            except ImportError:
+                raise ImportError("读取压缩或分波段存储的TIFF需要安装tifffile: pip install tifffile")
+            self._tiff = tifffile.TiffFile(str(self.path))
+            self._page = self._tiff.pages[0]
+            if self.planar != 1 and self.bands > 1:
+                raise ValueError("暂不支持分波段存储（PlanarConfiguration=2）的压缩TIFF")
+
+    def _read_ifd(self, offset):
+        """读取IFD中的所有标签，返回 tag -> numpy数组"""
+        mm = self._mm
+        e = self._endian
+        if self._bigtiff:
+            count = struct.unpack(e + 'Q', bytes(mm[offset:offset + 8]))[0]
+            entry_size, inline_size, pos = 20, 8, offset + 8
+            entry_format = e + 'HHQ'
+        else:
+            count = struct.unpack(e + 'H', bytes(mm[offset:offset + 2]))[0]
+            entry_size, inline_size, pos = 12, 4, offset + 2
+            entry_format = e + 'HHI'
+        tags = {}
+        for i in range(count):
+            entry = pos + i * entry_size
+            tag, field_type, value_count = struct.unpack(entry_format, bytes(mm[entry:entry + entry_size - inline_size]))
+            if field_type not in TIFF_TYPES:
+                continue
+            dtype = np.dtype(e + TIFF_TYPES[field_type])
+            n = value_count * TIFF_TYPE_COUNT_FACTOR.get(field_type, 1)
+            size = n * dtype.itemsize
+            value_pos = entry + entry_size - inline_size
+            if size > inline_size:
+                value_pos = struct.unpack(e + ('Q' if self._bigtiff else 'I'),
+                                          bytes(mm[value_pos:value_pos + inline_size]))[0]
+            tags[tag] = np.frombuffer(mm[value_pos:value_pos + size], dtype=dtype)
+        return tags
+
+    def _segment(self, index):
+        """返回第 index 个条带/分块的 (rows, segment_width, bands) 数组"""
+        row = (index // self.segments_across) * self.segment_height
+        rows = self.segment_height if self.tiled else min(self.segment_height, self.height - row)
+        if self.native:
+            # 未压缩数据直接返回内存映射上的视图，不复制
+            start = int(self.offsets[index])
+            size = rows * self.segment_width * self.bands * self.dtype.itemsize
+            data = np.frombuffer(self._mm[start:start + size], dtype=self.dtype)
+            return data.reshape(rows, self.segment_width, self.bands)
+        with self._lock:
+            fh = self._tiff.filehandle
+            fh.seek(int(self._page.dataoffsets[index]))
+            data = fh.read(int(self._page.databytecounts[index]))
+            segment, _, _ = self._page.decode(data, index, jpegtables=self._page.jpegtables)
+        return np.asarray(segment).reshape(-1, self.segment_width, self.bands)[:rows]
+
+    def _read(self, x, y, w, h):
+        out = np.empty((h, w, self.bands), dtype=self.dtype.newbyteorder('='))
+        first_row, last_row = y // self.segment_height, (y + h - 1) // self.segment_height
+        first_col, last_col = x // self.segment_width, (x + w - 1) // self.segment_width
+        for seg_row in range(first_row, last_row + 1):
+            for seg_col in range(first_col, last_col + 1):
+                segment = self._segment(seg_row * self.segments_across + seg_col)
+                sx, sy = seg_col * self.segment_width, seg_row * self.segment_height
+                # 窗口与分块的交集
+                ix0, iy0 = max(x, sx), max(y, sy)
+                ix1 = min(x + w, sx + self.segment_width, self.width)
+                iy1 = min(y + h, sy + segment.shape[0])
+                out[iy0 - y:iy1 - y, ix0 - x:ix1 - x] = segment[iy0 - sy:iy1 - sy, ix0 - sx:ix1 - sx]
+        return out
+
+    def _read_strided(self, x, y, cols, rows, step):
+        """按条带/分块取出采样点，每个包含采样点的条带/分块在一个窗口内只解码一次
+
+        逐行读取时压缩TIFF的每个采样行都要重新解码它所在的整个条带/分块，一个条带包含多个采样行时重复解码；
+        没有采样点落入的条带/分块不会被读取。
+        """
+        out = np.empty((rows, cols, self.bands), dtype=self.dtype.newbyteorder('='))
+        ys = y + np.arange(rows) * step
+        xs = x + np.arange(cols) * step
+        seg_rows, seg_cols = ys // self.segment_height, xs // self.segment_width
+        for seg_row in np.unique(seg_rows):
+            row_index = np.flatnonzero(seg_rows == seg_row)
+            for seg_col in np.unique(seg_cols):
+                col_index = np.flatnonzero(seg_cols == seg_col)
+                segment = self._segment(int(seg_row) * self.segments_across + int(seg_col))
+                sx, sy = seg_col * self.segment_width, seg_row * self.segment_height
+                out[np.ix_(row_index, col_index)] = segment[np.ix_(ys[row_index] - sy, xs[col_index] - sx)]
+        return out
+
+    def close(self):
+        self._mm = None
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+
+
+def open_raster(path, scale=None):
+    """根据扩展名打开栅格：.npy 内存映射，.tif/.tiff 按条带/分块读取，其他格式使用PIL整体解码"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.npy':
+        return NpyRasterSource(path, scale=scale)
+    if suffix in ('.tif', '.tiff'):
+        return TiffRasterSource(path, scale=scale)
+    return PilRasterSource(path)
+
+
+def iter_windows(width, height, tile_size=640, overlap=64):
+    """按行优先顺序生成覆盖整幅栅格的 (x, y, w, h) 窗口，相邻窗口重叠 overlap 像素，最后一行/列贴齐边缘"""
+    stride = max(tile_size - overlap, 1)
+
+    def positions(length):
+        if length <= tile_size:
+            return [0]
+        starts = list(range(0, length - tile_size + 1, stride))
+        if starts[-1] + tile_size < length:
+            starts.append(length - tile_size)
+        return starts
+
+    for y in positions(height):
+        for x in positions(width):
+            yield x, y, min(tile_size, width), min(tile_size, height)
@@ -0,0 +1,156 @@
+import atexit
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# 每个槽位的元数据: [引用计数, ndim, dim0, dim1, dim2, dtype编号]
+_META_FIELDS = 6
+_DTYPES = [np.dtype(np.uint8), np.dtype(np.float32), np.dtype(np.float16), np.dtype(np.int32)]
+# 本进程创建的共享内存段名称
+_owned_names = set()
+
+
+class RingFullError(RuntimeError):
+    """在超时时间内没有可用槽位"""
+
+
+class SharedMemoryRing:
+    """基于 multiprocessing.shared_memory 的定长槽位环形缓冲区
+
+    创建方进程负责分配（acquire）、引用计数和回收；其他进程按名称附加后，
+    只读写创建方交给它的槽位数据，不修改引用计数。
+    同一进程树中的多个进程共享环时，应传入同一个 multiprocessing.Lock。
+    """
+
+    def __init__(self, name=None, n_slots=6, slot_size=32 * 1024 * 1024, create=True, lock=None):
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.create = create
+        self._lock = lock or threading.Lock()
+        self._cursor = 0
+        header_size = n_slots * _META_FIELDS * 8
+        # 数据区按64字节对齐
+        self._data_offset = (header_size + 63) // 64 * 64
+        total_size = self._data_offset + n_slots * slot_size
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=total_size)
+            _owned_names.add(self.shm._name)
+            atexit.register(self.unlink)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # 附加方退出时不能让resource_tracker删除共享内存段
+            if self.shm._name not in _owned_names:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            if self.shm.size < total_size:
+                raise ValueError(f"共享内存 {name} 的大小与槽位配置不一致")
+        self._meta = np.ndarray((n_slots, _META_FIELDS), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self._meta[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def describe(self):
+        """附加到该环所需的参数"""
+        return {'name': self.name, 'n_slots': self.n_slots, 'slot_size': self.slot_size}
+
+    def fits(self, shape, dtype=np.uint8):
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize <= self.slot_size
+
+    def acquire(self, timeout=10.0):
+        """分配一个空闲槽位，引用计数置为1"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                for step in range(self.n_slots):
+                    slot = (self._cursor + step) % self.n_slots
+                    if self._meta[slot, 0] == 0:
+                        self._meta[slot] = 0
+                        self._meta[slot, 0] = 1
+                        self._cursor = (slot + 1) % self.n_slots
+                        return slot
+            if time.monotonic() >= deadline:
+                raise RingFullError(f"共享内存环 {self.name} 没有空闲槽位")
+            time.sleep(0.001)
+
+    def retain(self, slot):
+        with self._lock:
+            if self._meta[slot, 0] <= 0:
+                raise ValueError(f"槽位 {slot} 未被分配")
+            self._meta[slot, 0] += 1
+
+    def release(self, slot):
+        """引用计数减一，归零后槽位可被重新分配"""
+        with self._lock:
+            if self._meta[slot, 0] <= 0:
+                raise ValueError(f"槽位 {slot} 未被分配")
+            self._meta[slot, 0] -= 1
+
+    def refcount(self, slot):
+        return int(self._meta[slot, 0])
+
+    def write(self, slot, array):
+        """把数组复制进槽位并记录形状和类型"""
+        array = np.ascontiguousarray(array)
+        if array.ndim > 3 or array.dtype not in _DTYPES:
+            raise ValueError(f"不支持的数组: shape={array.shape}, dtype={array.dtype}")
+        if not self.fits(array.shape, array.dtype):
+            raise ValueError(f"数组大小 {array.nbytes} 超出槽位容量 {self.slot_size}")
+        self.view(slot, array.shape, array.dtype)[...] = array
+        meta = self._meta[slot]
+        meta[1] = array.ndim
+        meta[2:5] = list(array.shape) + [0] * (3 - array.ndim)
+        meta[5] = _DTYPES.index(array.dtype)
+        return array.shape
+
+    def view(self, slot, shape=None, dtype=None):
+        """返回槽位数据的零拷贝视图；不指定形状时使用写入时记录的元数据"""
+        if shape is None:
+            meta = self._meta[slot]
+            shape = tuple(int(v) for v in meta[2:2 + meta[1]])
+            dtype = _DTYPES[meta[5]]
+        offset = self._data_offset + slot * self.slot_size
+        return np.ndarray(shape, dtype=dtype or np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def close(self):
+        self._meta = None
+        self.shm.close()
+
+    def unlink(self):
+        if not self.create:
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        _owned_names.discard(self.shm._name)
+        self.create = False
+
+
+class RingRegistry:
+    """服务端按名称缓存附加的共享内存环"""
+
+    def __init__(self):
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, n_slots, slot_size):
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                ring = SharedMemoryRing(name=name, n_slots=n_slots, slot_size=slot_size, create=False)
+                self._rings[name] = ring
+            return ring
+
+    def close_all(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings.clear()
@@ -0,0 +1,85 @@
+import hashlib
+import io
+import math
+import os
+import uuid
+from pathlib import Path
+
+import cv2
+from PIL import Image, features
+
+from utils.batch_io import open_source
+
+THUMBNAIL_DIR = Path(__file__).parent.parent / 'data' / 'thumbnails'
+
+
+def content_key(data):
+    """图片内容的哈希，作为缩略图缓存键"""
+    return hashlib.sha1(data).hexdigest()
+
+
+class ThumbnailCache:
+    """按内容哈希缓存的缩略图
+
+    每张图片只在第一次显示时解码并缩小一次，之后直接返回磁盘上的小图文件。
+    Pillow支持时使用WebP，否则使用JPEG。
+    """
+
+    def __init__(self, cache_dir=None, size=256, image_format=None, quality=80):
+        self.cache_dir = Path(cache_dir) if cache_dir else THUMBNAIL_DIR
+        self.size = size
+        self.format = image_format or ('WEBP' if features.check('webp') else 'JPEG')
+        self.extension = '.webp' if self.format == 'WEBP' else '.jpg'
+        self.quality = quality
+
+    def path_for(self, key):
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}_{self.size}{self.extension}"
+
+    def make(self, image):
+        """缩小为最长边不超过 size 的RGB图片；JPEG在解码阶段直接按比例缩小，避免解码完整分辨率"""
+        if image.format == 'JPEG':
+            image.draft('RGB', (self.size, self.size))
+        image = image.convert('RGB')
+        image.thumbnail((self.size, self.size), Image.Resampling.LANCZOS)
+        return image
+
+    def save(self, image, path):
+        """先写临时文件再原子替换，多个线程或进程同时生成同一缩略图时不会读到不完整的文件"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        self.make(image).save(tmp_path, format=self.format, quality=self.quality)
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, key, source):
+        """返回缩略图路径，不存在时从 source 生成
+
+        source 可以是图片路径、zip:// 条目、文件对象或字节串，只有缓存未命中时才会读取。
+        """
+        path = self.path_for(key)
+        if path.exists():
+            return path
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        elif hasattr(source, 'seek'):
+            source.seek(0)
+        else:
+            source = open_source(source)
+        with Image.open(source) as image:
+            return self.save(image, path)
+
+    def save_array(self, array, path, bgr=True):
+        """把检测可视化结果（OpenCV的BGR数组）保存为缩略图"""
+        if bgr:
+            array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+        return self.save(Image.fromarray(array), path)
+
+
+def paginate(total, page, page_size):
+    """返回 (起始下标, 结束下标, 总页数)，page 从1开始并限制在有效范围内"""
+    pages = max(1, math.ceil(total / page_size))
+    page = min(max(1, int(page)), pages)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total), pages
@@ -0,0 +1,370 @@
+"""大幅影像检测结果的XYZ瓦片金字塔
+
+    python -m utils.tile_pyramid build ortho.tif --detections buildings.jsonl --scene-id ortho
+    python -m utils.tile_pyramid build ortho.tif --mask mask.npy --scene-id ortho_seg --precompute-tiles 1024
+    python -m utils.tile_pyramid serve --host 0.0.0.0 --port 8601
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+from PIL import Image, features
+
+from utils.raster_source import open_raster
+
+logger = logging.getLogger(__name__)
+
+# 每个场景（一次大幅影像检测）的元数据和瓦片保存在 data/scenes/<场景ID>/ 下
+SCENE_DIR = Path(__file__).parent.parent / 'data' / 'scenes'
+SCENE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# 本地化部署时把Leaflet发行包（leaflet.js、leaflet.css 和 images/）放在该目录，由瓦片服务在 /static/leaflet/ 下提供；
+# 也可以用 BUILDING_LEAFLET_URL 指定其他地址。两者都没有时从公共CDN加载
+LEAFLET_DIR = Path(__file__).parent.parent / 'static' / 'leaflet'
+LEAFLET_CDN_URL = 'https://unpkg.com/leaflet@1.9.4/dist'
+STATIC_TYPES = {'.js': 'application/javascript', '.css': 'text/css', '.png': 'image/png', '.svg': 'image/svg+xml'}
+
+# 叠加层颜色（RGB）：分割掩码半透明填充，检测框描边
+MASK_COLOR = np.array([255, 0, 0], dtype=np.float32)
+MASK_ALPHA = 0.4
+BOX_COLOR = (255, 0, 0)
+
+
+class TilePyramid:
+    """检测/分割结果叠加图的 z/x/y 瓦片金字塔
+
+    最高层级 max_zoom 的一个瓦片像素对应一个栅格像素，层级每降低一级分辨率减半。瓦片直接按窗口从栅格中
+    采样生成（低层级隔点采样），不需要先生成更高层级；粗层级可以预先生成，其余瓦片在第一次请求时生成并缓存到磁盘。
+    """
+
+    def __init__(self, scene_dir):
+        self.scene_dir = Path(scene_dir)
+        with open(self.scene_dir / 'meta.json', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.width = self.meta['width']
+        self.height = self.meta['height']
+        self.tile_size = self.meta['tile_size']
+        self.max_zoom = self.meta['max_zoom']
+        self.format = self.meta['format']
+        self.extension = self.meta['extension']
+        self.raster = open_raster(self.meta['raster'], scale=self.meta.get('scale'))
+        boxes_path = self.scene_dir / 'boxes.npy'
+        self.boxes = np.load(boxes_path) if boxes_path.exists() else np.zeros((0, 4), dtype=np.float32)
+        self.mask = np.load(self.meta['mask'], mmap_mode='r') if self.meta.get('mask') else None
+
+    @property
+    def scene_id(self):
+        return self.scene_dir.name
+
+    @classmethod
+    def create(cls, scene_dir, raster_path, detections=None, mask_path=None, tile_size=256, image_format=None,
+               scale=None):
+        """创建场景：记录栅格和掩码路径，保存检测框，清除旧的瓦片缓存"""
+        scene_dir = Path(scene_dir)
+        scene_dir.mkdir(parents=True, exist_ok=True)
+        with open_raster(raster_path, scale=scale) as raster:
+            width, height = raster.width, raster.height
+        image_format = image_format or ('WEBP' if features.check('webp') else 'PNG')
+        boxes = np.array([d['bbox'] for d in detections or [] if 'bbox' in d], dtype=np.float32).reshape(-1, 4)
+        np.save(scene_dir / 'boxes.npy', boxes)
+        meta = {
+            'raster': str(Path(raster_path).resolve()),
+            'mask': str(Path(mask_path).resolve()) if mask_path else None,
+            'scale': scale,
+            'width': width,
+            'height': height,
+            'tile_size': tile_size,
+            'max_zoom': max(0, math.ceil(math.log2(max(width, height) / tile_size))),
+            'format': image_format,
+            'extension': '.webp' if image_format == 'WEBP' else '.png',
+            'detections': len(boxes),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            # 重建同名场景时更换版本号，避免浏览器使用缓存的旧瓦片
+            'version': uuid.uuid4().hex[:8],
+        }
+        with open(scene_dir / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        tiles_dir = scene_dir / 'tiles'
+        if tiles_dir.exists():
+            shutil.rmtree(tiles_dir, ignore_errors=True)
+        return cls(scene_dir)
+
+    def level_size(self, z):
+        """第 z 层横向和纵向的瓦片数"""
+        span = self.tile_size << (self.max_zoom - z)
+        return math.ceil(self.width / span), math.ceil(self.height / span)
+
+    def tile_path(self, z, x, y):
+        return self.scene_dir / 'tiles' / str(z) / str(x) / f"{y}{self.extension}"
+
+    def render_tile(self, z, x, y):
+        """生成瓦片：从栅格采样底图，叠加分割掩码和检测框，栅格范围以外透明"""
+        step = 1 << (self.max_zoom - z)
+        span = self.tile_size * step
+        x0, y0 = x * span, y * span
+        tile = self.raster.read_window(x0, y0, span, span, step)
+        valid_h = -(-(min(self.height, y0 + span) - y0) // step)
+        valid_w = -(-(min(self.width, x0 + span) - x0) // step)
+
+        if self.mask is not None:
+            mask = self.mask[y0:y0 + span:step, x0:x0 + span:step] > 0
+            region = tile[:mask.shape[0], :mask.shape[1]]
+            region[mask] = (region[mask] * (1 - MASK_ALPHA) + MASK_COLOR * MASK_ALPHA).astype(np.uint8)
+
+        if len(self.boxes):
+            boxes = self.boxes
+            visible = ((boxes[:, 2] >= x0) & (boxes[:, 0] <= x0 + span) &
+                       (boxes[:, 3] >= y0) & (boxes[:, 1] <= y0 + span))
+            thickness = 2 if step <= 2 else 1
+            for x1, y1, x2, y2 in (boxes[visible] - [x0, y0, x0, y0]) / step:
+                cv2.rectangle(tile, (int(x1), int(y1)), (int(round(x2)), int(round(y2))), BOX_COLOR, thickness)
+
+        alpha = np.zeros(tile.shape[:2], dtype=np.uint8)
+        alpha[:valid_h, :valid_w] = 255
+        return Image.fromarray(np.dstack([tile, alpha]), 'RGBA')
+
+    def get_tile(self, z, x, y):
+        """返回瓦片文件路径，首次请求时生成；超出金字塔范围时返回None"""
+        if not 0 <= z <= self.max_zoom:
+            return None
+        columns, rows = self.level_size(z)
+        if not (0 <= x < columns and 0 <= y < rows):
+            return None
+        path = self.tile_path(z, x, y)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，并发请求同一瓦片时不会读到不完整的文件
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        self.render_tile(z, x, y).save(tmp_path, format=self.format, quality=80)
+        os.replace(tmp_path, path)
+        return path
+
+    def precompute(self, max_tiles=256):
+        """预先生成粗层级：从第0层开始，直到某一层的瓦片数超过 max_tiles，返回生成的瓦片数"""
+        count = 0
+        for z in range(self.max_zoom + 1):
+            columns, rows = self.level_size(z)
+            if columns * rows > max_tiles:
+                break
+            for x in range(columns):
+                for y in range(rows):
+                    self.get_tile(z, x, y)
+                    count += 1
+        return count
+
+    def viewer_html(self, tile_url, height=600, leaflet_url=LEAFLET_CDN_URL):
+        """可平移缩放的Leaflet查看器，只请求当前视野内的瓦片；tile_url 含 {z}/{x}/{y} 占位符，
+        leaflet_url 为 leaflet.js / leaflet.css 所在的地址（见 get_leaflet_url）"""
+        return f"""
+<link rel="stylesheet" href="{leaflet_url}/leaflet.css"/>
+<script src="{leaflet_url}/leaflet.js"></script>
+<div id="map" style="height: {height}px; background: #1e1e1e; border-radius: 8px;"></div>
+<script>
+    var maxZoom = {self.max_zoom};
+    var map = L.map('map', {{crs: L.CRS.Simple, minZoom: 0, maxZoom: maxZoom + 2, attributionControl: false}});
+    var bounds = L.latLngBounds(map.unproject([0, {self.height}], maxZoom), map.unproject([{self.width}, 0], maxZoom));
+    L.tileLayer('{tile_url}', {{
+        tileSize: {self.tile_size}, maxNativeZoom: maxZoom, maxZoom: maxZoom + 2, bounds: bounds, noWrap: true
+    }}).addTo(map);
+    map.fitBounds(bounds);
+    map.setMaxBounds(bounds.pad(0.2));
+</script>
+"""
+
+    def close(self):
+        self.raster.close()
+        self.mask = None
+
+
+# 当前进程中已打开的场景，scene_id -> TilePyramid
+_pyramids = {}
+_pyramids_lock = threading.Lock()
+
+
+def get_pyramid(scene_id, scene_root=None):
+    """返回已打开的场景，未打开时从场景目录加载；场景不存在时返回None"""
+    if not SCENE_ID_PATTERN.match(scene_id):
+        return None
+    with _pyramids_lock:
+        pyramid = _pyramids.get(scene_id)
+        if pyramid is None:
+            scene_dir = Path(scene_root or SCENE_DIR) / scene_id
+            if not (scene_dir / 'meta.json').exists():
+                return None
+            pyramid = _pyramids[scene_id] = TilePyramid(scene_dir)
+        return pyramid
+
+
+def register_pyramid(pyramid):
+    """登记新建或重建的场景，替换同名的旧场景"""
+    with _pyramids_lock:
+        old = _pyramids.get(pyramid.scene_id)
+        _pyramids[pyramid.scene_id] = pyramid
+    if old is not None and old is not pyramid:
+        old.close()
+    return pyramid
+
+
+def static_file(parts, root=None):
+    """/static/leaflet/ 下的请求对应的本地文件，不存在或路径越出 LEAFLET_DIR 时返回None"""
+    root = Path(root or LEAFLET_DIR).resolve()
+    if len(parts) < 3 or parts[:2] != ['static', 'leaflet'] or any(part in ('', '.', '..') for part in parts[2:]):
+        return None
+    path = root.joinpath(*parts[2:]).resolve()
+    if root not in path.parents or path.suffix not in STATIC_TYPES or not path.is_file():
+        return None
+    return path
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """GET /tiles/<场景ID>/<z>/<x>/<y>.<扩展名> 返回瓦片图片，GET /static/leaflet/<文件> 返回本地的Leaflet文件"""
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=86400')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts[0] == 'static':
+            path = static_file(parts)
+            if path is None:
+                self.send_error(404)
+            else:
+                self._send(path.read_bytes(), STATIC_TYPES[path.suffix])
+            return
+        try:
+            if len(parts) != 5 or parts[0] != 'tiles':
+                raise ValueError(f"未知路径: {self.path}")
+            scene_id = parts[1]
+            z, x, y = int(parts[2]), int(parts[3]), int(Path(parts[4]).stem)
+        except ValueError:
+            self.send_error(404)
+            return
+        pyramid = get_pyramid(scene_id, self.server.scene_root)
+        try:
+            path = pyramid.get_tile(z, x, y) if pyramid is not None else None
+        except Exception as e:
+            logger.error(f"生成瓦片 {scene_id}/{z}/{x}/{y} 失败: {str(e)}")
+            self.send_error(500)
+            return
+        if path is None:
+            self.send_error(404)
+            return
+        self._send(path.read_bytes(), f"image/{pyramid.format.lower()}")
+
+
+class TileHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scene_root=None):
+        self.scene_root = scene_root
+        super().__init__(address, TileRequestHandler)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_tile_base_url():
+    """在后台线程中启动进程级瓦片服务（只启动一次），返回浏览器访问瓦片服务的地址
+
+    BUILDING_TILE_HOST / BUILDING_TILE_PORT 指定监听地址（默认 127.0.0.1:8601）；通过反向代理或其他主机名
+    访问时用 BUILDING_TILE_URL 指定浏览器可以访问的地址。端口已被占用时（例如另一个页面进程或
+    `python -m utils.tile_pyramid serve` 已在运行）直接使用已有的服务。
+    """
+    global _server
+    host = os.environ.get('BUILDING_TILE_HOST', '127.0.0.1')
+    port = int(os.environ.get('BUILDING_TILE_PORT', 8601))
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = TileHTTPServer((host, port))
+                threading.Thread(target=_server.serve_forever, daemon=True, name='tile-server').start()
+            except OSError as e:
+                logger.warning(f"瓦片服务端口 {port} 不可用，使用已有的服务: {str(e)}")
+    return os.environ.get('BUILDING_TILE_URL', f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{port}").rstrip('/')
+
+
+def get_leaflet_url(base_url=None):
+    """查看器加载Leaflet的地址：BUILDING_LEAFLET_URL，其次是瓦片服务提供的 LEAFLET_DIR，最后是公共CDN"""
+    if os.environ.get('BUILDING_LEAFLET_URL'):
+        return os.environ['BUILDING_LEAFLET_URL'].rstrip('/')
+    if (LEAFLET_DIR / 'leaflet.js').exists():
+        return f"{base_url or get_tile_base_url()}/static/leaflet"
+    return LEAFLET_CDN_URL
+
+
+def tile_url_template(pyramid, base_url=None):
+    return (f"{base_url or get_tile_base_url()}/tiles/{pyramid.scene_id}/{{z}}/{{x}}/{{y}}{pyramid.extension}"
+            f"?v={pyramid.meta.get('version', '')}")
+
+
+def load_detections(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="大幅影像检测结果的XYZ瓦片金字塔")
+    parser.add_argument('--scene-root', default=str(SCENE_DIR), help="场景目录")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="创建场景并预先生成粗层级瓦片")
+    build.add_argument('raster', help="栅格文件（.tif/.tiff/.npy 或普通图片）")
+    build.add_argument('--detections', help="检测结果JSONL文件（python -m utils.tiled_detector 的输出）")
+    build.add_argument('--mask', help="分割掩码 .npy 文件（python -m utils.tiled_detector --mask-output 的输出）")
+    build.add_argument('--scene-id', help="场景ID，默认使用栅格文件名")
+    build.add_argument('--tile-size', type=int, default=256, help="瓦片边长（像素）")
+    build.add_argument('--scale', type=float, help="非8位栅格缩放到0-255时对应的最大值")
+    build.add_argument('--precompute-tiles', type=int, default=256, help="预先生成瓦片数不超过该值的粗层级")
+
+    serve = subparsers.add_parser('serve', help="启动瓦片服务")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8601)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        scene_id = args.scene_id or re.sub(r'[^A-Za-z0-9_-]', '_', Path(args.raster).stem)
+        if not SCENE_ID_PATTERN.match(scene_id):
+            parser.error("场景ID只能包含字母、数字、下划线和连字符")
+        detections = load_detections(args.detections) if args.detections else None
+        pyramid = TilePyramid.create(Path(args.scene_root) / scene_id, args.raster, detections, args.mask,
+                                     tile_size=args.tile_size, scale=args.scale)
+        count = pyramid.precompute(args.precompute_tiles)
+        print(f"场景 {scene_id} 已创建：{pyramid.width}x{pyramid.height}，层级 0-{pyramid.max_zoom}，"
+              f"预先生成 {count} 个瓦片，其余瓦片在首次访问时生成")
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        server = TileHTTPServer((args.host, args.port), scene_root=args.scene_root)
+        print(f"瓦片服务已启动: http://{args.host}:{args.port}/tiles/<场景ID>/{{z}}/{{x}}/{{y}}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
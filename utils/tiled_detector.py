@@ -0,0 +1,174 @@
+"""大幅栅格分块检测
+
+    python -m utils.tiled_detector ortho.tif --model build_V8n.pt --tile-size 640 --overlap 64 --output buildings.jsonl
+    python -m utils.tiled_detector mosaic.npy --skip-blank --batch-size 8
+    python -m utils.tiled_detector ortho.tif --model build_unet.pth --mask-output mask.npy --min-area 50
+"""
+import argparse
+import json
+
+import numpy as np
+
+from utils.batch_pipeline import BatchPipeline
+from utils.mask_stitcher import MaskStitcher
+from utils.raster_source import open_raster, iter_windows
+
+
+def box_iou(box, boxes):
+    """一个框与多个框的IoU，框格式为 [x1, y1, x2, y2]"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def merge_detections(detections, iou_thres=0.5):
+    """对拼接到全图坐标的检测框做NMS，去除相邻分块重叠区域中的重复目标"""
+    detections = [d for d in detections if 'bbox' in d]
+    if not detections:
+        return []
+    boxes = np.array([d['bbox'] for d in detections], dtype=np.float32)
+    order = np.argsort([-d['confidence'] for d in detections])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        order = order[1:][box_iou(boxes[i], boxes[order[1:]]) <= iou_thres]
+    return [detections[i] for i in keep]
+
+
+class TiledDetector:
+    """按窗口读取栅格并分块检测
+
+    只读取当前需要的窗口，解码、推理和后处理通过 BatchPipeline 流水线重叠执行，流水线中同时存在的
+    分块数量有上限，因此内存占用与栅格大小无关。检测框换算为全图坐标。
+    """
+
+    def __init__(self, detector=None, tile_size=640, overlap=64, conf_thres=0.5, iou_thres=0.45, batch_size=4,
+                 decode_workers=2, prefetch=8, skip_blank=False, infer_batch=None):
+        self.detector = detector
+        # 页面中通过进程级推理执行器推理时传入 infer_batch(images)，见 BatchPipeline
+        self.infer_batch = infer_batch
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+        # 跳过空白/nodata分块（正射影像边缘的大片无数据区域），不做分块间去重
+        self.skip_blank = skip_blank
+        self.stats = {}
+
+    def _pipeline(self, raster):
+        prefilter = None
+        if self.skip_blank:
+            from utils.prefilter import PreFilter
+            prefilter = PreFilter(dedup_distance=-1)
+
+        def drop_visualization(item):
+            item.plotted_image = None
+
+        return BatchPipeline(self.detector, conf_thres=self.conf_thres, iou_thres=self.iou_thres,
+                             batch_size=self.batch_size, decode_workers=self.decode_workers,
+                             queue_size=self.prefetch, load_image=lambda window: raster.read_image(*window),
+                             on_result=drop_visualization, prefilter=prefilter, infer_batch=self.infer_batch)
+
+    def iter_tiles(self, raster, on_idle=None, on_tile=None):
+        """逐块返回 (window, detections)，window 为 (x, y, w, h)，检测框已换算为全图坐标
+
+        raster 可以是 RasterSource 或栅格文件路径；检测失败的分块抛出异常。on_tile(stats) 在每块完成后
+        执行，on_idle() 在等待结果期间周期性执行，均可用于刷新进度。
+        """
+        if not hasattr(raster, 'read_window'):
+            with open_raster(raster) as source:
+                yield from self.iter_tiles(source, on_idle=on_idle, on_tile=on_tile)
+            return
+        windows = list(iter_windows(raster.width, raster.height, self.tile_size, self.overlap))
+        self.stats = {'tiles': len(windows), 'done': 0, 'skipped': 0, 'width': raster.width, 'height': raster.height}
+        pipeline = self._pipeline(raster)
+        for item in pipeline.run(((f"{x}_{y}", (x, y, w, h)) for x, y, w, h in windows), on_idle=on_idle):
+            if item.error is not None:
+                raise RuntimeError(f"分块 {item.name} 检测失败: {str(item.error)}")
+            x, y, _, _ = windows[item.index]
+            detections = item.detections or []
+            for detection in detections:
+                detection['window'] = list(windows[item.index])
+                if 'bbox' in detection:
+                    x1, y1, x2, y2 = detection['bbox']
+                    detection['bbox'] = [x1 + x, y1 + y, x2 + x, y2 + y]
+                    detection['width'], detection['height'] = raster.width, raster.height
+            self.stats['done'] += 1
+            if 'skipped' in item.extra:
+                self.stats['skipped'] += 1
+            if on_tile is not None:
+                on_tile(self.stats)
+            yield windows[item.index], detections
+        self.stats['elapsed'] = pipeline.elapsed
+
+    def detect(self, raster, merge_iou=0.5, on_idle=None, on_tile=None):
+        """检测整幅栅格，返回合并重叠区域后的全图检测框列表"""
+        detections = []
+        for _, tile_detections in self.iter_tiles(raster, on_idle=on_idle, on_tile=on_tile):
+            detections.extend(tile_detections)
+        return merge_detections(detections, merge_iou)
+
+    def segment(self, raster, mask_path=None, min_area=0, work_dir=None, on_idle=None, on_tile=None):
+        """分割模型检测整幅栅格：各分块的概率图累加到磁盘上的 MaskStitcher，重叠区域取平均
+
+        返回连通域列表（每个连通域对应一个建筑物），mask_path 不为空时同时写出全分辨率二值掩码（.npy）。
+        """
+        if not hasattr(raster, 'read_window'):
+            with open_raster(raster) as source:
+                return self.segment(source, mask_path, min_area, work_dir, on_idle, on_tile)
+        with MaskStitcher(raster.width, raster.height, work_dir=work_dir) as stitcher:
+            for window, detections in self.iter_tiles(raster, on_idle=on_idle, on_tile=on_tile):
+                for detection in detections:
+                    if 'segmentation' in detection:
+                        stitcher.add(window, detection.pop('segmentation'))
+            return stitcher.finalize(mask_path=mask_path, min_area=min_area)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="大幅栅格分块检测：按窗口读取TIFF/.npy栅格，内存占用与栅格大小无关")
+    parser.add_argument('raster', help="栅格文件（.tif/.tiff/.npy 或普通图片）")
+    parser.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    parser.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    parser.add_argument('--iou', type=float, default=0.45, help="IOU阈值")
+    parser.add_argument('--tile-size', type=int, default=640, help="分块边长（像素）")
+    parser.add_argument('--overlap', type=int, default=64, help="相邻分块的重叠像素数")
+    parser.add_argument('--merge-iou', type=float, default=0.5, help="合并重叠区域重复检测框的IoU阈值")
+    parser.add_argument('--batch-size', type=int, default=4, help="单次前向推理的最大分块数")
+    parser.add_argument('--scale', type=float, help="非8位栅格缩放到0-255时对应的最大值，默认为数据类型最大值")
+    parser.add_argument('--skip-blank', action='store_true', help="跳过空白/nodata分块")
+    parser.add_argument('--mask-output', help="分割模型：全分辨率二值掩码的输出路径（.npy）")
+    parser.add_argument('--min-area', type=int, default=0, help="分割模型：忽略面积小于该值（像素）的连通域")
+    parser.add_argument('--work-dir', help="分割模型：概率累加文件的存放目录，默认使用系统临时目录")
+    parser.add_argument('--output', '-o', default='raster_detections.jsonl', help="结果JSONL文件路径")
+    args = parser.parse_args(argv)
+
+    from utils.model_detector import ModelDetector
+    detector = ModelDetector(args.model)
+    tiled = TiledDetector(detector, tile_size=args.tile_size, overlap=args.overlap, conf_thres=args.conf,
+                          iou_thres=args.iou, batch_size=args.batch_size, skip_blank=args.skip_blank)
+    with open_raster(args.raster, scale=args.scale) as raster:
+        print(f"栅格尺寸 {raster.width}x{raster.height}，{raster.bands} 个波段")
+        if detector.model_type == 'yolo':
+            detections = tiled.detect(raster, merge_iou=args.merge_iou)
+        else:
+            detections = tiled.segment(raster, mask_path=args.mask_output, min_area=args.min_area,
+                                       work_dir=args.work_dir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for detection in detections:
+            f.write(json.dumps({k: v for k, v in detection.items() if k != 'segmentation'}, ensure_ascii=False) + '\n')
+    stats = tiled.stats
+    print(f"分块检测完成：共 {stats['tiles']} 块，跳过空白 {stats['skipped']} 块，检测到建筑物 {len(detections)} 个，"
+          f"耗时 {stats.get('elapsed', 0):.1f}秒，结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""无人机视频/密集帧序列的建筑物检测与跟踪
+
+    python -m utils.video_detector flight.mp4 --model build_V8n.pt --output tracks.json
+    python -m utils.video_detector flight.mp4 --keyframe-interval 30 --stride 2 --save-video tracked.mp4
+    python -m utils.video_detector frames/ --fps 10 --output tracks.json
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.batch_io import iter_image_paths, load_image
+from utils.change_detector import COLOR_BUILDING, COLOR_NEW
+from utils.change_matcher import match_buildings
+from utils.change_series import footprints
+from utils.coregistration import MIN_RESPONSE, phase_correlation, prepare_image
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+# 帧间运动估计在最长边不超过该值的灰度图上进行
+MOTION_SIZE = 256
+# 卡尔曼滤波的观测噪声（像素标准差）：关键帧检测框、非关键帧按全局运动平移的框
+DETECTION_NOISE = 4.0
+MOTION_NOISE = 2.0
+
+
+def iter_frames(source, stride=1, max_frames=None, fps=25.0):
+    """逐帧读取视频文件或图片序列（目录、glob模式、ZIP压缩包），返回 (帧序号, 时间戳秒, RGB数组)
+
+    不预先解码整段视频；stride > 1 时跳过的视频帧只 grab 不解码，跳过的图片不读取。
+    图片序列没有帧率信息，时间戳按 fps 计算。
+    """
+    if str(source).lower().endswith(VIDEO_EXTENSIONS):
+        capture = cv2.VideoCapture(str(source))
+        if not capture.isOpened():
+            raise ValueError(f"无法打开视频: {source}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or fps
+        try:
+            index, emitted = 0, 0
+            while max_frames is None or emitted < max_frames:
+                if index % stride:
+                    if not capture.grab():
+                        break
+                else:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    yield index, index / fps, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    emitted += 1
+                index += 1
+        finally:
+            capture.release()
+        return
+    emitted = 0
+    for index, path in enumerate(iter_image_paths([source])):
+        if index % stride:
+            continue
+        if max_frames is not None and emitted >= max_frames:
+            break
+        yield index, index / fps, np.asarray(load_image(path))
+        emitted += 1
+
+
+def video_fps(source, default=25.0):
+    """视频文件的帧率，图片序列返回 default"""
+    if not str(source).lower().endswith(VIDEO_EXTENSIONS):
+        return default
+    capture = cv2.VideoCapture(str(source))
+    try:
+        return capture.get(cv2.CAP_PROP_FPS) or default
+    finally:
+        capture.release()
+
+
+def prefetch_frames(frames, size=8):
+    """在后台线程中解码帧，解码与检测、跟踪重叠执行；队列有界，内存占用与视频长度无关"""
+    frame_queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # 消费方提前关闭生成器时不再阻塞在已满的队列上，读取线程随即退出并释放已解码的帧
+        while not stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            frame = frame_queue.get()
+            if frame is done:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        stop.set()
+
+
+class KalmanBoxTrack:
+    """单个建筑物的匀速卡尔曼滤波：状态为框中心、宽高及其每帧的变化量"""
+
+    def __init__(self, track_id, box, confidence, frame_index, timestamp):
+        x1, y1, x2, y2 = box
+        self.id = track_id
+        self.state = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=np.float64)
+        self.covariance = np.diag([DETECTION_NOISE ** 2] * 4 + [100.0] * 4)
+        self.hits = 1
+        self.misses = 0
+        self.first_frame = self.last_frame = frame_index
+        self.first_time = self.last_time = timestamp
+        self.confidences = [float(confidence)]
+        self.best = {'frame': frame_index, 'timestamp': round(timestamp, 3),
+                     'bbox': [round(float(v), 2) for v in box], 'confidence': round(float(confidence), 4)}
+
+    transition = np.eye(8) + np.eye(8, k=4)
+    observation = np.eye(4, 8)
+    process_noise = np.diag([1.0, 1.0, 0.5, 0.5, 0.1, 0.1, 0.05, 0.05])
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.state[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self):
+        self.state = self.transition @ self.state
+        self.state[2:4] = np.maximum(self.state[2:4], 1.0)
+        self.covariance = self.transition @ self.covariance @ self.transition.T + self.process_noise
+
+    def update(self, box, noise):
+        x1, y1, x2, y2 = box
+        residual = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1]) - self.observation @ self.state
+        innovation = self.observation @ self.covariance @ self.observation.T + np.eye(4) * noise ** 2
+        gain = self.covariance @ self.observation.T @ np.linalg.inv(innovation)
+        self.state = self.state + gain @ residual
+        self.covariance = (np.eye(8) - gain @ self.observation) @ self.covariance
+
+    def detected(self, box, confidence, frame_index, timestamp):
+        """关键帧中与检测框匹配"""
+        self.update(box, DETECTION_NOISE)
+        self.hits += 1
+        self.misses = 0
+        self.last_frame, self.last_time = frame_index, timestamp
+        self.confidences.append(float(confidence))
+        if confidence > self.best['confidence']:
+            self.best = {'frame': frame_index, 'timestamp': round(timestamp, 3),
+                         'bbox': [round(float(v), 2) for v in box], 'confidence': round(float(confidence), 4)}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'first_frame': self.first_frame,
+            'last_frame': self.last_frame,
+            'first_time': round(self.first_time, 3),
+            'last_time': round(self.last_time, 3),
+            'hits': self.hits,
+            'mean_confidence': round(float(np.mean(self.confidences)), 4),
+            'best': self.best,
+        }
+
+
+@dataclass
+class FrameResult:
+    """单帧的跟踪结果：boxes 中每项为 {'track_id', 'bbox', 'detected'}，detected 表示该框来自本帧的检测"""
+    index: int
+    timestamp: float
+    keyframe: bool
+    reason: str = ''
+    shift: tuple = (0.0, 0.0)
+    boxes: list = field(default_factory=list)
+
+
+@dataclass
+class VideoResult:
+    """整段视频的结果：tracks 为去重后的建筑物（每个建筑物一条轨迹），frames 为逐帧结果（keep_frames=True 时）"""
+    tracks: list = field(default_factory=list)
+    frames: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+class VideoDetector:
+    """关键帧检测 + 帧间跟踪的视频建筑物检测
+
+    只在关键帧上完整推理：固定间隔 keyframe_interval 帧、相位相关响应过低（场景切换）或自上一关键帧以来
+    新进入视野的面积超过 new_view_threshold 时触发。关键帧之间用全局相位相关估计相机平移，
+    把每条轨迹的框按平移量更新卡尔曼滤波；关键帧上按IoU最优匹配检测框与轨迹的预测框，场景切换时结束全部轨迹。
+    连续 max_age 个关键帧未匹配或移出画面的轨迹结束，命中次数少于 min_hits 的轨迹视为误检不输出。
+    """
+
+    def __init__(self, detector=None, infer_batch=None, conf_thres=0.5, iou_thres=0.45, keyframe_interval=15,
+                 new_view_threshold=0.25, match_iou=0.3, max_age=2, min_hits=2, motion=True, min_area=20):
+        if detector is None and infer_batch is None:
+            raise ValueError("必须提供detector或infer_batch")
+        self.detector = detector
+        self.infer_batch = infer_batch
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.keyframe_interval = keyframe_interval
+        self.new_view_threshold = new_view_threshold
+        self.match_iou = match_iou
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.motion = motion
+        self.min_area = min_area
+        self.stats = {}
+        self._tracks = []
+
+    def _infer(self, image):
+        if self.infer_batch is not None:
+            return self.infer_batch([image])[0][0]
+        return self.detector.detect(image, conf_thres=self.conf_thres, iou_thres=self.iou_thres)[0]
+
+    def track(self, frames):
+        """逐帧处理 (帧序号, 时间戳, RGB数组)，返回 (FrameResult, RGB数组) 的生成器；结束后 tracks() 给出去重后的建筑物"""
+        self._tracks, active = [], []
+        self.stats = {'frames': 0, 'keyframes': 0, 'scene_cuts': 0, 'detect_time': 0.0, 'track_time': 0.0}
+        previous = None
+        since_keyframe, new_view = 0, 0.0
+        for index, timestamp, image in frames:
+            start = time.perf_counter()
+            height, width = image.shape[:2]
+            gray, _ = prepare_image(image, MOTION_SIZE)
+            shift, reason = np.zeros(2), ''
+            if previous is None:
+                reason = 'first'
+            elif previous.shape != gray.shape:
+                reason = 'scene'
+            else:
+                small_shift, response = phase_correlation(previous, gray)
+                if response < MIN_RESPONSE:
+                    reason = 'scene'
+                else:
+                    shift = small_shift * (width / gray.shape[1])
+                    new_view += abs(shift[0]) / width + abs(shift[1]) / height
+            previous = gray
+            since_keyframe += 1
+            if not reason and self.new_view_threshold and new_view > self.new_view_threshold:
+                reason = 'view'
+            if not reason and self.keyframe_interval and since_keyframe >= self.keyframe_interval:
+                reason = 'interval'
+
+            if reason == 'scene':
+                # 场景切换后原有轨迹的位置没有意义，全部结束，由本帧的检测结果开始新的轨迹
+                active = []
+            for track in active:
+                propagated = track.box + np.tile(shift, 2)
+                track.predict()
+                if self.motion:
+                    track.update(propagated, MOTION_NOISE)
+
+            detected = set()
+            if reason:
+                self.stats['keyframes'] += 1
+                self.stats['scene_cuts'] += reason == 'scene'
+                since_keyframe, new_view = 0, 0.0
+                self.stats['track_time'] += time.perf_counter() - start
+                detect_start = time.perf_counter()
+                detections = self._infer(Image.fromarray(image))
+                self.stats['detect_time'] += time.perf_counter() - detect_start
+                start = time.perf_counter()
+                boxes, confidences = footprints(detections, (width, height), self.min_area)
+                track_boxes = np.array([track.box for track in active]).reshape(-1, 4)
+                match = match_buildings(track_boxes, boxes, iou_threshold=self.match_iou,
+                                        area_change_threshold=np.inf)
+                for i, j, _ in match.matched:
+                    active[i].detected(boxes[j], confidences[j], index, timestamp)
+                    detected.add(active[i].id)
+                for i in match.demolished:
+                    active[i].misses += 1
+                for j in match.new:
+                    track = KalmanBoxTrack(len(self._tracks) + 1, boxes[j], confidences[j], index, timestamp)
+                    self._tracks.append(track)
+                    active.append(track)
+                    detected.add(track.id)
+
+            # 移出画面或连续多个关键帧未匹配的轨迹结束
+            active = [track for track in active
+                      if track.misses <= self.max_age and _visible_fraction(track.box, width, height) >= 0.3]
+            result = FrameResult(index, timestamp, bool(reason), reason, (float(shift[0]), float(shift[1])), [
+                {'track_id': track.id, 'bbox': [round(float(v), 2) for v in track.box], 'detected': track.id in detected}
+                for track in active if track.hits >= self.min_hits or track.id in detected])
+            self.stats['frames'] += 1
+            self.stats['track_time'] += time.perf_counter() - start
+            yield result, image
+
+    def tracks(self):
+        """去重后的建筑物轨迹：每个建筑物一条，按首次出现的帧排序"""
+        return [track.to_dict() for track in self._tracks if track.hits >= self.min_hits]
+
+    def run(self, source, stride=1, max_frames=None, fps=25.0, prefetch=8, on_frame=None, keep_frames=False):
+        """处理视频文件或图片序列，on_frame(result, image) 在每帧处理完后调用（例如写出标注视频）"""
+        start = time.perf_counter()
+        frames = prefetch_frames(iter_frames(source, stride=stride, max_frames=max_frames, fps=fps), prefetch)
+        result = VideoResult()
+        for frame_result, image in self.track(frames):
+            if on_frame is not None:
+                on_frame(frame_result, image)
+            if keep_frames:
+                result.frames.append(frame_result)
+        result.tracks = self.tracks()
+        elapsed = time.perf_counter() - start
+        result.stats = dict(self.stats, tracks=len(result.tracks), elapsed=elapsed,
+                            fps=self.stats['frames'] / elapsed if elapsed > 0 else 0.0,
+                            source_fps=video_fps(source, fps) / stride)
+        return result
+
+
+def _visible_fraction(box, width, height):
+    x1, y1, x2, y2 = box
+    area = max(x2 - x1, 1e-6) * max(y2 - y1, 1e-6)
+    visible = max(0.0, min(x2, width) - max(x1, 0)) * max(0.0, min(y2, height) - max(y1, 0))
+    return visible / area
+
+
+def draw_tracks(image, frame_result):
+    """在RGB帧上绘制轨迹框和编号，本帧检测到的框用绿色，跟踪外推的框用蓝色"""
+    plotted_image = np.array(image)
+    for box in frame_result.boxes:
+        x1, y1, x2, y2 = map(int, box['bbox'])
+        color = COLOR_NEW if box['detected'] else COLOR_BUILDING
+        cv2.rectangle(plotted_image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(plotted_image, f"#{box['track_id']}", (x1, max(y1 - 4, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    color, 1)
+    if frame_result.keyframe:
+        cv2.putText(plotted_image, f"keyframe ({frame_result.reason})", (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.7,
+                    COLOR_NEW, 2)
+    return plotted_image
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无人机视频/帧序列建筑物检测：只在关键帧推理，帧间跟踪，输出去重后的建筑物轨迹")
+    parser.add_argument('source', help="视频文件，或图片目录、glob模式、ZIP压缩包（按文件名排序作为帧序列）")
+    parser.add_argument('--model', default='build_V8n.pt', help="model目录下的模型文件名")
+    parser.add_argument('--conf', type=float, default=0.5, help="置信度阈值")
+    parser.add_argument('--iou', type=float, default=0.45, help="检测的IOU阈值")
+    parser.add_argument('--keyframe-interval', type=int, default=15, help="关键帧的最大间隔帧数（0表示只按场景变化触发）")
+    parser.add_argument('--new-view', type=float, default=0.25, help="新进入视野的面积比例超过该值时触发关键帧（0表示不使用）")
+    parser.add_argument('--match-iou', type=float, default=0.3, help="检测框与轨迹匹配的IoU阈值")
+    parser.add_argument('--max-age', type=int, default=2, help="轨迹允许连续未匹配的关键帧数")
+    parser.add_argument('--min-hits', type=int, default=2, help="轨迹至少被检测到的次数，少于该值视为误检")
+    parser.add_argument('--no-motion', action='store_true', help="不估计帧间相机运动，只用卡尔曼滤波外推")
+    parser.add_argument('--stride', type=int, default=1, help="每隔多少帧处理一帧")
+    parser.add_argument('--max-frames', type=int, help="最多处理的帧数")
+    parser.add_argument('--fps', type=float, default=25.0, help="图片序列的帧率（视频使用文件中的帧率）")
+    parser.add_argument('--output', '-o', default='tracks.json', help="建筑物轨迹的JSON文件路径")
+    parser.add_argument('--save-video', help="保存标注视频（mp4）")
+    args = parser.parse_args(argv)
+
+    from utils.model_detector import ModelDetector
+    detector = VideoDetector(ModelDetector(args.model), conf_thres=args.conf, iou_thres=args.iou,
+                             keyframe_interval=args.keyframe_interval, new_view_threshold=args.new_view,
+                             match_iou=args.match_iou, max_age=args.max_age, min_hits=args.min_hits,
+                             motion=not args.no_motion)
+    writer = None
+
+    def write_frame(frame_result, image):
+        nonlocal writer
+        if writer is None:
+            fps = video_fps(args.source, args.fps) / args.stride
+            writer = cv2.VideoWriter(args.save_video, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                     (image.shape[1], image.shape[0]))
+        writer.write(cv2.cvtColor(draw_tracks(image, frame_result), cv2.COLOR_RGB2BGR))
+
+    try:
+        result = detector.run(args.source, stride=args.stride, max_frames=args.max_frames, fps=args.fps,
+                              on_frame=write_frame if args.save_video else None)
+    finally:
+        if writer is not None:
+            writer.release()
+    stats = result.stats
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.fspath(args.source), 'tracks': result.tracks, 'stats': stats}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"共 {stats['frames']} 帧，关键帧 {stats['keyframes']} 个（场景切换 {stats['scene_cuts']} 次），"
+          f"建筑物 {stats['tracks']} 个；处理速度 {stats['fps']:.1f} 帧/秒（视频 {stats['source_fps']:.1f} 帧/秒），"
+          f"推理 {stats['detect_time']:.1f}秒，跟踪 {stats['track_time']:.1f}秒，结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
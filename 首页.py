@@ -286,6 +286,8 @@ with st.sidebar:
         - 🔍 **模型比对**：比较不同模型的检测效果
         - 🔄 **变化检测**：建筑物变化分析
         - 📊 **历史记录**：查看和管理历史检测记录
+        - 🗺️ **大幅影像**：整幅正射影像分块检测与缩放浏览
+        - 📈 **多时期分析**：多个时期影像中建筑物的生命周期追踪
         """)
     
     # 图片要求说明